@@ -149,16 +149,19 @@ export class RemoveBGModule {
 
     handleFiles(files) {
         const validTypes = ['image/png', 'image/jpeg', 'image/jpg', 'image/webp', 'image/gif', 'image/bmp'];
+        // Videos come out as an animated PNG/WebP cutout
+        const videoTypes = ['video/mp4', 'video/webm', 'video/quicktime', 'video/x-matroska', 'video/x-msvideo', 'video/x-m4v'];
 
         files.forEach(file => {
             // Vérifier le type
-            if (!validTypes.includes(file.type)) {
+            const isVideo = videoTypes.includes(file.type);
+            if (!validTypes.includes(file.type) && !isVideo) {
                 console.warn(`Type de fichier non supporté: ${file.name}`);
                 return;
             }
 
-            // Vérifier la taille (10MB max)
-            if (file.size > 10 * 1024 * 1024) {
+            // Vérifier la taille (10MB max, 50MB pour une vidéo)
+            if (file.size > (isVideo ? 50 : 10) * 1024 * 1024) {
                 console.warn(`Fichier trop volumineux: ${file.name}`);
                 return;
             }
@@ -199,7 +202,9 @@ export class RemoveBGModule {
             fileItem.className = `rembg-file-item ${item.status}`;
             fileItem.innerHTML = `
                 <div class="rembg-preview">
-                    <img src="${item.preview}" alt="Aperçu">
+                    ${item.file.type.startsWith('video/')
+                        ? `<video src="${item.preview}" muted></video>`
+                        : `<img src="${item.preview}" alt="Aperçu">`}
                 </div>
                 <div class="file-details">
                     <h3>${item.name}</h3>
@@ -77,6 +77,9 @@ exports.removeBackground = async (req, res) => {
         const blob = new Blob([fileBuffer], { type: req.file.mimetype });
         formData.append('file', blob, req.file.originalname);
         formData.append('model', model);
+        if (req.body.format) {
+            formData.append('format', req.body.format);
+        }
 
         const userId = req.session.user ? req.session.user.id : null;
         const serverUrl = userId ? db.getConfigValue('REMBG_URL', userId, REMBG_SERVER_URL_ENV) : REMBG_SERVER_URL_ENV;
@@ -95,7 +98,11 @@ exports.removeBackground = async (req, res) => {
 
         // Récupérer l'image traitée
         const outputBuffer = Buffer.from(await response.arrayBuffer());
-        const outputFilename = `nobg-${Date.now()}.png`;
+        const outputType = response.headers.get('content-type') || '';
+        const outputExt = outputType.includes('webp') ? 'webp' : outputType.includes('jpeg') ? 'jpg' : 'png';
+        const outputFilename = `nobg-${Date.now()}.${outputExt}`;
+        // Set for animations and videos: number of frames in the output
+        const frames = response.headers.get('x-frames');
 
         // Dossier de destination permanent (Databank)
         const databankDir = path.join(__dirname, '../../public/databank');
@@ -117,6 +124,7 @@ exports.removeBackground = async (req, res) => {
                 tool: 'rembg',
                 model: model,
                 originalName: req.file.originalname,
+                ...(frames && { frames: Number(frames) }),
                 timestamp: Date.now()
             }, userId);
             console.log('✅ REMBG: Résultat ajouté à la Databank');
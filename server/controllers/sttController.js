@@ -1,6 +1,7 @@
 const fs = require('fs');
 const path = require('path');
 const db = require('../lib/db');
+const { readError, waitForJob } = require('../lib/jobs');
 
 // Configuration du serveur Python Whisper
 const WHISPER_SERVER_URL_ENV = process.env.WHISPER_URL || 'http://localhost:5200';
@@ -101,20 +102,31 @@ exports.transcribe = async (req, res) => {
         if (language) {
             formData.append('language', language);
         }
+        if (req.body.words) {
+            formData.append('words', req.body.words);
+        }
 
         // Envoyer au serveur Whisper
         const userId = req.session.user ? req.session.user.id : 1;
         const serverUrl = db.getConfigValue('WHISPER_URL', userId, WHISPER_SERVER_URL_ENV);
 
-        const response = await fetch(`${serverUrl}/transcribe`, {
+        const jobResponse = await fetch(`${serverUrl}/jobs`, {
             method: 'POST',
             body: formData
         });
 
         cleanUp();
 
+        if (!jobResponse.ok) {
+            const errorData = await readError(jobResponse);
+            return res.status(jobResponse.status).json(errorData);
+        }
+
+        const job = await jobResponse.json();
+        const { response } = await waitForJob(serverUrl, job.id);
+
         if (!response.ok) {
-            const errorData = await response.json();
+            const errorData = await readError(response);
             return res.status(response.status).json(errorData);
         }
 
@@ -131,6 +143,7 @@ exports.transcribe = async (req, res) => {
                 originalName: req.file.originalname,
                 duration: result.duration,
                 segments: result.segments ? result.segments.length : 0,
+                transcriptId: result.transcript_id,
                 timestamp: Date.now()
             }, userId);
             console.log('✅ STT: Résultat ajouté à la Databank');
@@ -154,3 +167,37 @@ exports.transcribe = async (req, res) => {
         res.status(500).json({ error: error.message });
     }
 };
+
+/**
+ * Transcription terminée en JSON ou en sous-titres (srt/vtt), relue depuis le cache du serveur Whisper
+ * sans relancer le modèle
+ */
+exports.getTranscript = async (req, res) => {
+    const { id, format } = req.params;
+
+    try {
+        const userId = req.session.user ? req.session.user.id : 1;
+        const serverUrl = db.getConfigValue('WHISPER_URL', userId, WHISPER_SERVER_URL_ENV);
+        const query = req.query.name ? `?name=${encodeURIComponent(req.query.name)}` : '';
+        const response = await fetch(`${serverUrl}/transcripts/${encodeURIComponent(id)}/${encodeURIComponent(format)}${query}`);
+
+        if (!response.ok) {
+            const errorData = await readError(response);
+            return res.status(response.status).json(errorData);
+        }
+
+        res.set('Content-Type', response.headers.get('content-type'));
+        const disposition = response.headers.get('content-disposition');
+        if (disposition) {
+            res.set('Content-Disposition', disposition);
+        }
+        res.send(Buffer.from(await response.arrayBuffer()));
+
+    } catch (error) {
+        console.error('❌ STT Error:', error.message);
+        res.status(503).json({
+            error: 'Whisper server not running',
+            hint: 'Start the Python server: python server/python/whisper_server.py'
+        });
+    }
+};
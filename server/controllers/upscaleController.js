@@ -4,6 +4,7 @@ const path = require('path');
 // Configuration du serveur Python Upscale
 const UPSCALE_SERVER_URL_ENV = process.env.UPSCALE_URL || 'http://localhost:5300';
 const db = require('../lib/db');
+const { readError, waitForJob } = require('../lib/jobs');
 
 /**
  * Vérifie si le serveur Upscale est disponible
@@ -59,25 +60,41 @@ exports.upscaleImage = async (req, res) => {
         formData.append('scale', scale);
         formData.append('model', model);
         formData.append('denoise', denoise);
+        if (req.body.format) {
+            formData.append('format', req.body.format);
+        }
 
         // Envoyer au serveur Upscale
         const userId = req.session.user ? req.session.user.id : 1;
         const serverUrl = db.getConfigValue('UPSCALE_URL', userId, UPSCALE_SERVER_URL_ENV);
 
-        const response = await fetch(`${serverUrl}/upscale`, {
+        const jobResponse = await fetch(`${serverUrl}/jobs`, {
             method: 'POST',
             body: formData
         });
 
+        if (!jobResponse.ok) {
+            const errorData = await readError(jobResponse);
+            cleanUp();
+            return res.status(jobResponse.status).json(errorData);
+        }
+
+        const job = await jobResponse.json();
+        const { job: finishedJob, response } = await waitForJob(serverUrl, job.id);
+        // Strategy picked by the server (tiles, lighter model, lower scale) with predicted and measured cost
+        const cost = finishedJob?.detail?.cost;
+
         if (!response.ok) {
-            const errorData = await response.json();
+            const errorData = await readError(response);
             cleanUp();
             return res.status(response.status).json(errorData);
         }
 
         // Récupérer l'image traitée
         const outputBuffer = Buffer.from(await response.arrayBuffer());
-        const outputFilename = `upscaled-${Date.now()}.png`;
+        const outputType = response.headers.get('content-type') || '';
+        const outputExt = outputType.includes('webp') ? 'webp' : outputType.includes('jpeg') ? 'jpg' : 'png';
+        const outputFilename = `upscaled-${Date.now()}.${outputExt}`;
 
         // Dossier Databank
         const databankDir = path.join(__dirname, '../../public/databank');
@@ -91,14 +108,18 @@ exports.upscaleImage = async (req, res) => {
         fs.writeFileSync(outputPath, outputBuffer);
 
         console.log(`✅ Upscale: Image agrandie avec succès!`);
+        if (cost && cost.strategy !== 'direct' && cost.strategy !== 'tiled') {
+            console.log(`📐 Upscale: ${cost.strategy} -> ${cost.model} x${cost.scale} (demandé: ${model} x${scale})`);
+        }
 
         // Ajouter à la Databank
         try {
             const userId = req.session.user ? req.session.user.id : 1;
             db.addDatabankItem('image', `/databank/${outputFilename}`, {
                 tool: 'upscale',
-                scale: scale,
+                scale: cost ? cost.scale : scale,
                 denoise: denoise,
+                ...(cost && { model: cost.model, strategy: cost.strategy }),
                 originalName: req.file.originalname,
                 timestamp: Date.now()
             }, userId);
@@ -114,7 +135,8 @@ exports.upscaleImage = async (req, res) => {
             success: true,
             message: 'Image agrandie et enregistrée dans la Databank',
             fileName: outputFilename,
-            originalName: req.file.originalname
+            originalName: req.file.originalname,
+            ...(cost && { cost })
         });
 
     } catch (error) {
@@ -0,0 +1,57 @@
+// Suivi des jobs asynchrones des serveurs Python (évite les timeouts fetch)
+const JOB_POLL_INTERVAL_MS = 1000;
+// Délai maximal d'attente d'un job (le serveur Python peut avoir redémarré ou être bloqué)
+const JOB_TIMEOUT_MS = parseInt(process.env.AI_JOB_TIMEOUT_MS, 10) || 30 * 60 * 1000;
+
+/**
+ * Réponse d'erreur JSON construite localement (même forme que celles du serveur Python)
+ */
+const jobErrorResponse = (status, error) => new Response(JSON.stringify({ error }), {
+    status,
+    headers: { 'Content-Type': 'application/json' }
+});
+
+/**
+ * Corps d'erreur d'une réponse du serveur Python: son JSON, ou son texte brut
+ * (proxy, page d'erreur HTML) pour ne pas le confondre avec un serveur arrêté
+ */
+const readError = async (response) => {
+    const text = await response.text();
+    try {
+        return JSON.parse(text);
+    } catch {
+        return { error: text.trim() || response.statusText || `Erreur ${response.status}` };
+    }
+};
+
+/**
+ * Attend la fin d'un job: { job, response } avec l'état final du job (null en cas d'échec
+ * du suivi) et la réponse de /jobs/<id>/result, ou une réponse d'erreur
+ */
+const waitForJob = async (serverUrl, jobId) => {
+    const deadline = Date.now() + JOB_TIMEOUT_MS;
+    while (Date.now() < deadline) {
+        await new Promise(resolve => setTimeout(resolve, JOB_POLL_INTERVAL_MS));
+        const statusResponse = await fetch(`${serverUrl}/jobs/${jobId}`);
+        if (statusResponse.status === 404) {
+            // Job perdu: serveur redémarré ou job expiré
+            return { job: null, response: jobErrorResponse(502, `Job ${jobId} perdu par le serveur (redémarrage ?)`) };
+        }
+        if (!statusResponse.ok) {
+            return { job: null, response: statusResponse };
+        }
+        const job = await statusResponse.json();
+        if (job.state === 'done' || job.state === 'error') {
+            return { job, response: await fetch(`${serverUrl}/jobs/${jobId}/result`) };
+        }
+    }
+    return { job: null, response: jobErrorResponse(504, `Job ${jobId} non terminé après ${JOB_TIMEOUT_MS / 1000}s`) };
+};
+
+module.exports = {
+    JOB_POLL_INTERVAL_MS,
+    JOB_TIMEOUT_MS,
+    jobErrorResponse,
+    readError,
+    waitForJob
+};
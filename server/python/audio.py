@@ -0,0 +1,253 @@
+"""
+Audio decoding helpers for the Whisper server.
+FFmpeg decodes any supported container to 16 kHz mono float32 PCM. Uploads are
+piped to its stdin straight from memory, so nothing is written to disk, and the
+output is read either whole or incrementally one window at a time.
+
+Configuration:
+  FFMPEG_PATH   full path of the ffmpeg executable (skips the lookup)
+"""
+import functools
+import glob
+import os
+import shutil
+import subprocess
+import tempfile
+import threading
+
+import numpy as np
+
+# Whisper's native input format and window length
+SAMPLE_RATE = 16000
+WINDOW_SECONDS = 30
+WINDOW_SAMPLES = SAMPLE_RATE * WINDOW_SECONDS
+
+PROJECT_ROOT = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+# Last location found by the slow lookup, reused by later starts
+FFMPEG_CACHE_FILE = os.path.join(PROJECT_ROOT, "models", "whisper", "ffmpeg_path.txt")
+
+_EXE = "ffmpeg.exe" if os.name == 'nt' else "ffmpeg"
+_READ_SIZE = 1024 * 1024
+
+
+def _search_ffmpeg():
+    """Fixed install locations, then WinGet packages (bounded glob, no recursive walk)"""
+    for directory in (
+        PROJECT_ROOT,
+        os.path.join(PROJECT_ROOT, "server", "python"),
+        r"C:\Program Files\ffmpeg\bin",
+        r"C:\ffmpeg\bin"
+    ):
+        path = os.path.join(directory, _EXE)
+        if os.path.isfile(path):
+            return path
+    winget = os.path.join(os.path.expanduser("~"), "AppData", "Local", "Microsoft", "WinGet", "Packages")
+    matches = glob.glob(os.path.join(winget, "*FFmpeg*", "*", "bin", _EXE))
+    return sorted(matches)[-1] if matches else None
+
+
+@functools.lru_cache(maxsize=None)
+def find_ffmpeg():
+    """Path of the ffmpeg executable, or None. Looked up once per process."""
+    path = os.environ.get('FFMPEG_PATH')
+    if path and os.path.isfile(path):
+        return path
+
+    path = shutil.which("ffmpeg")
+    if path:
+        return path
+
+    try:
+        with open(FFMPEG_CACHE_FILE, encoding='utf-8') as f:
+            path = f.read().strip()
+        if os.path.isfile(path):
+            return path
+    except OSError:
+        pass
+
+    path = _search_ffmpeg()
+    if path:
+        try:
+            os.makedirs(os.path.dirname(FFMPEG_CACHE_FILE), exist_ok=True)
+            with open(FFMPEG_CACHE_FILE, 'w', encoding='utf-8') as f:
+                f.write(path)
+        except OSError:
+            pass
+    return path
+
+
+def ffmpeg_decode_cmd(source, sr=SAMPLE_RATE):
+    """FFmpeg command line emitting f32le mono PCM on stdout"""
+    return [
+        find_ffmpeg() or "ffmpeg",
+        "-nostdin",
+        "-threads", "0",
+        "-i", source,
+        "-f", "f32le",
+        "-ac", "1",
+        "-acodec", "pcm_f32le",
+        "-ar", str(sr),
+        "-loglevel", "error",
+        "-"
+    ]
+
+
+def _feed(stream, pipe):
+    """Copy a file-like object to ffmpeg's stdin (runs in its own thread)"""
+    try:
+        shutil.copyfileobj(stream, pipe, _READ_SIZE)
+    except (BrokenPipeError, OSError, ValueError):
+        # ffmpeg exited early, the error is reported from its stderr
+        pass
+    finally:
+        try:
+            pipe.close()
+        except OSError:
+            pass
+
+
+class _Decoder:
+    """FFmpeg process decoding a path or a file-like object fed through stdin"""
+
+    def __init__(self, source, sr):
+        self.feeder = None
+        if isinstance(source, str):
+            self.proc = subprocess.Popen(ffmpeg_decode_cmd(source, sr), stdin=subprocess.DEVNULL,
+                                         stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+        else:
+            self.proc = subprocess.Popen(ffmpeg_decode_cmd("pipe:0", sr), stdin=subprocess.PIPE,
+                                         stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+            self.feeder = threading.Thread(target=_feed, args=(source, self.proc.stdin), daemon=True)
+            self.feeder.start()
+        # stderr is drained in the background so a chatty ffmpeg never blocks on it
+        self._errors = []
+        self._stderr_thread = threading.Thread(target=lambda: self._errors.append(self.proc.stderr.read()), daemon=True)
+        self._stderr_thread.start()
+
+    def read(self, size):
+        return self.proc.stdout.read(size)
+
+    def readinto(self, buffer):
+        return self.proc.stdout.readinto(buffer)
+
+    def finish(self, produced=True):
+        """
+        Wait for ffmpeg, raises RuntimeError if decoding failed. A pipe that
+        produced no audio counts as a failure: ffmpeg exits cleanly on an MP4
+        whose index it could not reach without seeking.
+        """
+        self.proc.wait()
+        if self.feeder is not None:
+            self.feeder.join()
+        self._stderr_thread.join()
+        if self.proc.returncode != 0 or (self.feeder is not None and not produced):
+            message = b''.join(self._errors).decode(errors='replace').strip()
+            raise RuntimeError(f"Failed to load audio: {message}")
+
+    def close(self):
+        if self.proc.poll() is None:
+            self.proc.kill()
+            self.proc.wait()
+        if self.feeder is not None:
+            self.feeder.join()
+        self.proc.stdout.close()
+        self._stderr_thread.join()
+        self.proc.stderr.close()
+
+
+def _spill(stream):
+    """
+    Fallback for containers that need a seekable input (e.g. MP4/M4A with the
+    index at the end of the file): copy the stream to a temp file.
+    """
+    stream.seek(0)
+    with tempfile.NamedTemporaryFile(delete=False) as tmp:
+        shutil.copyfileobj(stream, tmp, _READ_SIZE)
+        return tmp.name
+
+
+def _spill_for_retry(source):
+    """Temp copy of a seekable stream ffmpeg could not read from a pipe, None if not possible"""
+    if isinstance(source, str) or not source.seekable():
+        return None
+    print("⚠️ Whisper: flux non décodable depuis un pipe, passage par un fichier temporaire")
+    return _spill(source)
+
+
+def decode_audio(source, sr=SAMPLE_RATE):
+    """Whole file as a float32 array; source is a path or a file-like object"""
+    decoder = _Decoder(source, sr)
+    buffer = bytearray()
+    try:
+        while True:
+            chunk = decoder.read(_READ_SIZE)
+            if not chunk:
+                break
+            buffer += chunk
+        decoder.finish(bool(buffer))
+    except RuntimeError:
+        tmp_path = None if buffer else _spill_for_retry(source)
+        if tmp_path is None:
+            raise
+        try:
+            return decode_audio(tmp_path, sr)
+        finally:
+            os.unlink(tmp_path)
+    finally:
+        decoder.close()
+    # bytearray keeps the array writable without another copy
+    return np.frombuffer(buffer, np.float32)
+
+
+def iter_pcm(source, chunk_samples=WINDOW_SAMPLES, sr=SAMPLE_RATE):
+    """Yield float32 PCM chunks of at most chunk_samples samples while ffmpeg decodes"""
+    decoder = _Decoder(source, sr)
+    produced = False
+    try:
+        while True:
+            buffer = bytearray(chunk_samples * 4)
+            size = decoder.readinto(buffer)
+            if not size:
+                break
+            produced = True
+            yield np.frombuffer(buffer, np.float32, count=size // 4)
+        decoder.finish(produced)
+    except RuntimeError:
+        tmp_path = None if produced else _spill_for_retry(source)
+        if tmp_path is None:
+            raise
+        try:
+            yield from iter_pcm(tmp_path, chunk_samples, sr)
+        finally:
+            os.unlink(tmp_path)
+    finally:
+        decoder.close()
+
+
+def iter_windows(pcm, chunk_samples=WINDOW_SAMPLES):
+    """Split an already decoded array into chunks for PcmReader"""
+    for start in range(0, len(pcm), chunk_samples):
+        yield pcm[start:start + chunk_samples]
+
+
+class PcmReader:
+    """Reads an exact number of samples from a chunk iterator"""
+
+    def __init__(self, chunks):
+        self._chunks = iter(chunks)
+        self._pending = np.zeros(0, dtype=np.float32)
+        self.exhausted = False
+
+    def read(self, samples):
+        parts = [self._pending]
+        available = len(self._pending)
+        while available < samples and not self.exhausted:
+            chunk = next(self._chunks, None)
+            if chunk is None:
+                self.exhausted = True
+                break
+            parts.append(chunk)
+            available += len(chunk)
+        data = np.concatenate(parts) if len(parts) > 1 else parts[0]
+        self._pending = data[samples:]
+        return data[:samples]
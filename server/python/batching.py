@@ -0,0 +1,80 @@
+"""
+Micro-batching helper shared by the AI servers.
+Concurrent submissions for the same key (e.g. a model name) are queued and
+handed to a single handler call, up to a size cap or a short deadline.
+"""
+import queue
+import threading
+import time
+from concurrent.futures import Future
+
+
+class MicroBatcher:
+    """Groups concurrent submissions per key and processes them in batches"""
+
+    def __init__(self, handler, max_batch_size=8, max_wait_ms=10):
+        # handler(key, items) -> list of results, one per item, in order
+        self.handler = handler
+        self.max_batch_size = max(int(max_batch_size), 1)
+        self.max_wait = max(float(max_wait_ms), 0) / 1000
+        self._queues = {}
+        self._lock = threading.Lock()
+        self.batches = 0
+        self.items = 0
+
+    def submit(self, key, item):
+        """Queue one item, returns a Future resolved with its result"""
+        future = Future()
+        self._queue_for(key).put((item, future))
+        return future
+
+    def submit_many(self, key, items):
+        return [self.submit(key, item) for item in items]
+
+    def depth(self):
+        """Number of items waiting across all keys"""
+        with self._lock:
+            return sum(q.qsize() for q in self._queues.values())
+
+    def stats(self):
+        return {
+            'batches': self.batches,
+            'items': self.items,
+            'avg_batch_size': round(self.items / self.batches, 2) if self.batches else 0,
+            'queued': self.depth(),
+            'max_batch_size': self.max_batch_size,
+            'max_wait_ms': self.max_wait * 1000
+        }
+
+    def _queue_for(self, key):
+        with self._lock:
+            q = self._queues.get(key)
+            if q is None:
+                q = self._queues[key] = queue.Queue()
+                worker = threading.Thread(target=self._run, args=(key, q), daemon=True,
+                                          name=f"batcher-{key}")
+                worker.start()
+            return q
+
+    def _run(self, key, q):
+        while True:
+            batch = [q.get()]
+            deadline = time.monotonic() + self.max_wait
+            while len(batch) < self.max_batch_size:
+                remaining = deadline - time.monotonic()
+                try:
+                    batch.append(q.get(timeout=remaining) if remaining > 0 else q.get_nowait())
+                except queue.Empty:
+                    break
+
+            items = [item for item, _ in batch]
+            try:
+                results = self.handler(key, items)
+                for (_, future), result in zip(batch, results):
+                    future.set_result(result)
+            except Exception as e:
+                for _, future in batch:
+                    if not future.done():
+                        future.set_exception(e)
+            self.batches += 1
+            self.items += len(batch)
@@ -0,0 +1,403 @@
+"""
+Benchmark suite for the AI servers (rembg, whisper, upscale).
+Generates synthetic images/audio, drives the Flask endpoints in-process through
+the test client and reports p50/p95 latency, throughput and peak RSS.
+Results are written as JSON and can be compared against a stored baseline.
+
+Usage:
+  python benchmark.py --stub                        # offline, stubbed models (CI)
+  python benchmark.py --services upscale --repeat 5 # real models
+  python benchmark.py --stub --output bench.json --baseline baseline.json
+  python benchmark.py --services rembg-batch --batch-sizes 1,4,8   # rembg micro-batch sizes
+"""
+import argparse
+import io
+import json
+import os
+import platform
+import sys
+import time
+import wave
+
+# Measure the models, not the result cache
+os.environ.setdefault('AI_RESULT_CACHE_MB', '0')
+
+import numpy as np
+from PIL import Image
+
+from metrics import RssSampler
+
+SERVICES = ('rembg', 'whisper', 'upscale')
+DEFAULT_MEGAPIXELS = '0.25,1,4'
+DEFAULT_DURATIONS = '5,30,120'
+
+# Small models used when benchmarking for real
+REAL_MODELS = {'rembg': 'u2netp', 'whisper': 'tiny', 'upscale': ('pan', 2)}
+
+
+# === Synthetic inputs ===
+
+def synthetic_image(megapixels, seed=0):
+    """PNG bytes: smooth gradient background with a textured square subject"""
+    side = int((megapixels * 1e6) ** 0.5)
+    rng = np.random.default_rng(seed)
+    y, x = np.mgrid[0:side, 0:side]
+    arr = np.stack([x * 255 // side, y * 255 // side, np.full_like(x, 96)], axis=-1).astype(np.uint8)
+    lo, hi = side // 4, 3 * side // 4
+    arr[lo:hi, lo:hi] = rng.integers(0, 255, (hi - lo, hi - lo, 3), dtype=np.uint8)
+    buf = io.BytesIO()
+    Image.fromarray(arr).save(buf, format='PNG', compress_level=1)
+    return buf.getvalue()
+
+
+def synthetic_audio(seconds, sr=16000, seed=0):
+    """WAV bytes: tone bursts separated by low noise, roughly speech-like pacing"""
+    rng = np.random.default_rng(seed)
+    t = np.arange(int(seconds * sr)) / sr
+    signal = 0.01 * rng.standard_normal(len(t))
+    envelope = (np.sin(2 * np.pi * 0.25 * t) > 0).astype(np.float32)
+    signal += envelope * 0.3 * np.sin(2 * np.pi * (180 + 40 * np.sin(2 * np.pi * 3 * t)) * t)
+    pcm = (np.clip(signal, -1, 1) * 32767).astype(np.int16)
+    buf = io.BytesIO()
+    with wave.open(buf, 'wb') as w:
+        w.setnchannels(1)
+        w.setsampwidth(2)
+        w.setframerate(sr)
+        w.writeframes(pcm.tobytes())
+    return buf.getvalue()
+
+
+# === Stub models (offline) ===
+
+class _StubInput:
+    name = 'input'
+    shape = [1, 3, 320, 320]
+
+
+class _StubInnerSession:
+    def get_inputs(self):
+        return [_StubInput()]
+
+
+class StubRembgSession:
+    """Luminance threshold instead of a segmentation network"""
+    inner_session = _StubInnerSession()
+
+    def predict(self, img, *args, **kwargs):
+        small = img.convert('L').resize((320, 320))
+        mask = small.point(lambda v: 255 if v > 100 else 0)
+        return [mask.resize(img.size)]
+
+
+class StubWhisperModel:
+    """Returns one segment per 5 s of audio (the upload is still decoded by ffmpeg)"""
+
+    def transcribe(self, audio, **options):
+        duration = len(audio) / 16000
+        segments = [{'start': float(s), 'end': float(min(s + 5, duration)), 'text': f' segment {s}'}
+                    for s in range(0, int(duration), 5)]
+        return {'text': ''.join(s['text'] for s in segments), 'language': 'en', 'segments': segments}
+
+
+def stub_upscale_model(scale):
+    import torch
+    torch.manual_seed(0)
+    return torch.nn.Sequential(
+        torch.nn.Conv2d(3, 16, 3, padding=1),
+        torch.nn.ReLU(),
+        torch.nn.Conv2d(16, 3 * scale * scale, 3, padding=1),
+        torch.nn.PixelShuffle(scale)
+    )
+
+
+# === Measurement ===
+
+def percentile(values, q):
+    return float(np.percentile(values, q)) if values else 0.0
+
+
+def measure(client, path, make_form, repeat, warmup=1):
+    """POST make_form() to path `repeat` times, returns latencies (s) and peak RSS (bytes)"""
+    for _ in range(warmup):
+        response = client.post(path, data=make_form())
+        if response.status_code != 200:
+            raise RuntimeError(f"{path} -> {response.status_code}: {response.get_data(as_text=True)[:200]}")
+
+    latencies = []
+    with RssSampler() as rss:
+        for _ in range(repeat):
+            start = time.perf_counter()
+            response = client.post(path, data=make_form())
+            response.get_data()
+            latencies.append(time.perf_counter() - start)
+            if response.status_code != 200:
+                raise RuntimeError(f"{path} -> {response.status_code}")
+    return latencies, rss.peak
+
+
+def summarize(service, case, model, latencies, peak_rss, work_units, unit):
+    total = sum(latencies)
+    return {
+        'service': service,
+        'case': case,
+        'model': model,
+        'runs': len(latencies),
+        'p50_ms': round(percentile(latencies, 50) * 1000, 2),
+        'p95_ms': round(percentile(latencies, 95) * 1000, 2),
+        'mean_ms': round(total / len(latencies) * 1000, 2),
+        'requests_per_sec': round(len(latencies) / total, 3) if total else 0,
+        f'{unit}_per_sec': round(work_units * len(latencies) / total, 3) if total else 0,
+        'peak_rss_mb': round(peak_rss / (1024 * 1024), 1)
+    }
+
+
+# === Service benchmarks ===
+
+def alpha_quality(reference_png, candidate_png):
+    """Mean absolute alpha difference (0-1) and IoU of the opaque areas of two cutouts"""
+    reference = np.asarray(Image.open(io.BytesIO(reference_png)).getchannel('A'), dtype=np.float32) / 255
+    candidate = np.asarray(Image.open(io.BytesIO(candidate_png)).getchannel('A'), dtype=np.float32) / 255
+    a, b = reference > 0.5, candidate > 0.5
+    union = np.logical_or(a, b).sum()
+    return {
+        'alpha_mae': round(float(np.abs(reference - candidate).mean()), 4),
+        'alpha_iou': round(float(np.logical_and(a, b).sum() / union) if union else 1.0, 4)
+    }
+
+
+def bench_rembg(args):
+    import rembg_server
+    model = REAL_MODELS['rembg']
+    if args.stub:
+        rembg_server.registry.get(model, StubRembgSession)
+    client = rembg_server.app.test_client()
+    results = []
+    for mp in args.megapixels:
+        data = synthetic_image(mp)
+        for refine in args.rembg_refine:
+            form = lambda: {'file': (io.BytesIO(data), 'bench.png'), 'model': model, 'refine': refine}
+            latencies, peak = measure(client, '/remove', form, args.repeat)
+            case = f'{mp}MP' if refine == 'none' else f'{mp}MP-{refine}'
+            result = summarize('rembg', case, model, latencies, peak, mp, 'megapixels')
+            if refine != 'none':
+                # Quality against the default full-resolution path
+                reference = client.post('/remove', data={'file': (io.BytesIO(data), 'bench.png'), 'model': model,
+                                                         'refine': 'none'}).get_data()
+                result.update(alpha_quality(reference, client.post('/remove', data=form()).get_data()))
+            results.append(result)
+    return results
+
+
+def bench_rembg_batch(args):
+    """Masks per second when the rembg model runs on micro-batches of each size"""
+    import rembg_server
+    model = REAL_MODELS['rembg']
+    if args.stub:
+        rembg_server.registry.get(model, StubRembgSession)
+    session = rembg_server.get_session(model)
+    mp = min(args.megapixels)
+    images = [Image.open(io.BytesIO(synthetic_image(mp, seed=i))).convert('RGB') for i in range(args.batch_images)]
+    # Warm-up run so session initialisation is not measured
+    rembg_server.predict_masks(model, images[:1])
+    batched = rembg_server.supports_batching(model, session)
+    results = []
+    for batch_size in args.batch_sizes:
+        latencies = []
+        with RssSampler() as rss:
+            for _ in range(args.repeat):
+                start = time.perf_counter()
+                for i in range(0, len(images), batch_size):
+                    rembg_server.predict_masks(model, images[i:i + batch_size])
+                latencies.append(time.perf_counter() - start)
+        result = summarize('rembg', f'{mp}MP-b{batch_size}', model, latencies, rss.peak, len(images), 'images')
+        result['batched_inference'] = batched
+        results.append(result)
+    return results
+
+
+def bench_whisper(args):
+    import whisper_server
+    model = REAL_MODELS['whisper']
+    if args.stub:
+        whisper_server.registry.get(model, StubWhisperModel)
+    client = whisper_server.app.test_client()
+    results = []
+    for seconds in args.durations:
+        data = synthetic_audio(seconds)
+        latencies, peak = measure(
+            client, '/transcribe',
+            lambda: {'file': (io.BytesIO(data), 'bench.wav'), 'model': model, 'language': 'en'},
+            args.repeat)
+        results.append(summarize('whisper', f'{seconds}s', model, latencies, peak, seconds, 'audio_seconds'))
+    return results
+
+
+def bench_upscale(args):
+    import upscale_server
+    model, scale = REAL_MODELS['upscale']
+    if args.stub:
+        upscale_server.registry.get((model, scale), lambda: stub_upscale_model(scale))
+    client = upscale_server.app.test_client()
+    results = []
+    for mp in args.upscale_megapixels:
+        data = synthetic_image(mp)
+        for fmt in args.upscale_formats:
+            for denoise in args.upscale_denoise:
+                latencies, peak = measure(
+                    client, '/upscale',
+                    lambda: {'file': (io.BytesIO(data), 'bench.png'), 'model': model, 'scale': str(scale),
+                             'format': fmt, 'denoise': denoise},
+                    args.repeat)
+                case = f'{mp}MP-x{scale}' + ('' if fmt == 'png' else f'-{fmt}') + \
+                       ('' if denoise == 'false' else f'-dn-{denoise}')
+                results.append(summarize('upscale', case, model, latencies, peak, mp, 'megapixels'))
+    return results
+
+
+def bench_upscale_mixed(args):
+    """
+    Mixed load: one large image and several small ones sent at the same time.
+    Compare AI_SCHEDULER=1 (default) with AI_SCHEDULER=0 (every request on every core).
+    """
+    from concurrent.futures import ThreadPoolExecutor
+    import upscale_server
+    model, scale = REAL_MODELS['upscale']
+    if args.stub:
+        upscale_server.registry.get((model, scale), lambda: stub_upscale_model(scale))
+    client = upscale_server.app.test_client()
+    large_mp = max(args.upscale_megapixels)
+    small_mp = min(args.upscale_megapixels)
+    large, small = synthetic_image(large_mp), synthetic_image(small_mp, seed=1)
+
+    def post(data):
+        # One test client per thread: the client keeps per-request state
+        start = time.perf_counter()
+        response = upscale_server.app.test_client().post('/upscale', data={
+            'file': (io.BytesIO(data), 'bench.png'), 'model': model, 'scale': str(scale)})
+        response.get_data()
+        if response.status_code != 200:
+            raise RuntimeError(f"/upscale -> {response.status_code}")
+        return time.perf_counter() - start
+
+    client.post('/upscale', data={'file': (io.BytesIO(small), 'bench.png'), 'model': model,
+                                  'scale': str(scale)}).get_data()
+    results = []
+    for _ in range(args.repeat):
+        payloads = [large] + [small] * args.concurrency
+        start = time.perf_counter()
+        with RssSampler() as rss, ThreadPoolExecutor(max_workers=len(payloads)) as pool:
+            latencies = list(pool.map(post, payloads))
+        wall = time.perf_counter() - start
+        results.append((wall, latencies, rss.peak))
+
+    walls = [wall for wall, _, _ in results]
+    small_latencies = [l for _, latencies, _ in results for l in latencies[1:]]
+    work = large_mp + small_mp * args.concurrency
+    result = summarize('upscale', f'mixed-{args.concurrency}', model, small_latencies,
+                       max(peak for _, _, peak in results), small_mp, 'megapixels')
+    # Aggregate figures over the whole mix, per-request percentiles for the small images
+    result.update({
+        'wall_ms': round(percentile(walls, 50) * 1000, 2),
+        'requests_per_sec': round((1 + args.concurrency) / percentile(walls, 50), 3),
+        'megapixels_per_sec': round(work / percentile(walls, 50), 3),
+        'scheduler': upscale_server.cpu_scheduler.enabled
+    })
+    return [result]
+
+
+BENCHMARKS = {'rembg': bench_rembg, 'rembg-batch': bench_rembg_batch, 'whisper': bench_whisper,
+              'upscale': bench_upscale, 'upscale-mixed': bench_upscale_mixed}
+
+
+# === Baseline comparison ===
+
+def compare(results, baseline, tolerance):
+    """Print p50/p95 deltas against a baseline, returns the list of regressions"""
+    previous = {(r['service'], r['case'], r['model']): r for r in baseline.get('results', [])}
+    regressions = []
+    print(f"\n{'service':<9} {'case':<12} {'p50 ms':>10} {'Δp50':>8} {'p95 ms':>10} {'Δp95':>8}")
+    for r in results:
+        old = previous.get((r['service'], r['case'], r['model']))
+        if old is None:
+            print(f"{r['service']:<9} {r['case']:<12} {r['p50_ms']:>10} {'new':>8} {r['p95_ms']:>10} {'new':>8}")
+            continue
+        deltas = {}
+        for field in ('p50_ms', 'p95_ms'):
+            deltas[field] = (r[field] - old[field]) / old[field] if old[field] else 0.0
+            if deltas[field] > tolerance:
+                regressions.append((r['service'], r['case'], field, deltas[field]))
+        print(f"{r['service']:<9} {r['case']:<12} {r['p50_ms']:>10} {deltas['p50_ms']:>+8.1%} "
+              f"{r['p95_ms']:>10} {deltas['p95_ms']:>+8.1%}")
+    return regressions
+
+
+def parse_floats(value):
+    return [float(v) for v in value.split(',') if v]
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark the AI servers in-process')
+    parser.add_argument('--services', default=','.join(SERVICES))
+    parser.add_argument('--stub', action='store_true', help='Use stubbed models (offline, CI)')
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--megapixels', type=parse_floats, default=parse_floats(DEFAULT_MEGAPIXELS))
+    parser.add_argument('--rembg-refine', type=lambda v: v.split(','), default=['none'],
+                        help='rembg mask refinement modes to compare, e.g. none,guided')
+    parser.add_argument('--upscale-megapixels', type=parse_floats, default=parse_floats('0.1,0.25,1'))
+    parser.add_argument('--upscale-formats', type=lambda v: v.split(','), default=['png'],
+                        help='Upscale output formats to compare, e.g. png,webp,jpeg')
+    parser.add_argument('--upscale-denoise', type=lambda v: v.split(','), default=['false'],
+                        help='Upscale denoise modes to compare, e.g. false,nlmeans,guided,auto')
+    parser.add_argument('--batch-sizes', type=lambda v: [int(b) for b in v.split(',') if b], default=[1, 4, 8],
+                        help='rembg micro-batch sizes to compare (rembg-batch)')
+    parser.add_argument('--batch-images', type=int, default=32, help='Images per pass (rembg-batch)')
+    parser.add_argument('--durations', type=parse_floats, default=parse_floats(DEFAULT_DURATIONS))
+    parser.add_argument('--concurrency', type=int, default=4,
+                        help='Small images sent alongside the large one (upscale-mixed)')
+    parser.add_argument('--output', help='Write results JSON to this file')
+    parser.add_argument('--baseline', help='Compare against a previous results JSON')
+    parser.add_argument('--tolerance', type=float, default=0.15, help='Allowed p50/p95 slowdown (0.15 = 15%%)')
+    args = parser.parse_args()
+
+    results = []
+    for service in args.services.split(','):
+        if service not in BENCHMARKS:
+            parser.error(f"Service inconnu: {service}")
+        print(f"⏱️ Benchmark {service}{' (stub)' if args.stub else ''}...")
+        results.extend(BENCHMARKS[service](args))
+
+    report = {
+        'meta': {
+            'timestamp': time.time(),
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'cpu_count': os.cpu_count(),
+            'ai_threads': os.environ.get('AI_THREADS'),
+            'stub': args.stub,
+            'repeat': args.repeat
+        },
+        'results': results
+    }
+
+    for r in results:
+        quality = f"  alpha MAE {r['alpha_mae']:.4f} IoU {r['alpha_iou']:.4f}" if 'alpha_iou' in r else ''
+        print(f"  {r['service']:<8} {r['case']:<12} p50 {r['p50_ms']:>9.1f}ms  p95 {r['p95_ms']:>9.1f}ms  "
+              f"{r['requests_per_sec']:>7.2f} req/s  RSS {r['peak_rss_mb']:>7.1f}MB{quality}")
+
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump(report, f, indent=2)
+        print(f"💾 Résultats écrits dans {args.output}")
+
+    if args.baseline:
+        with open(args.baseline, encoding='utf-8') as f:
+            baseline = json.load(f)
+        regressions = compare(results, baseline, args.tolerance)
+        if regressions:
+            for service, case, field, delta in regressions:
+                print(f"⚠️ Régression {service} {case} {field}: {delta:+.1%}")
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
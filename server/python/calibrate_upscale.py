@@ -0,0 +1,124 @@
+"""
+Calibration of the upscale cost model (upscale_cost.py) on this machine.
+Each model runs on random inputs of a few sizes, in one forward pass, and the
+measurements are fitted to
+  seconds               = overhead + seconds_per_mp * input megapixels  (least squares)
+  memory growth - output = mb_per_mp * input megapixels
+The time coefficient is stored for one thread (the server scales it to its own
+thread count), in the file the upscale server reads at startup: restart it
+after a calibration.
+
+Usage:
+  python calibrate_upscale.py                                  # pan, edsr, msrn at x2/x3/x4
+  python calibrate_upscale.py --models pan --scales 4 --backend onnx
+  python calibrate_upscale.py --stub --output calibration.json # pipeline check, no weights
+"""
+import argparse
+import gc
+import os
+import platform
+import time
+
+import numpy as np
+
+from cpu_scheduler import speedup
+from metrics import RssSampler
+from warmup import import_torch
+import upscale_cost
+
+
+def measure(upscale_tensor, mdl, scale, megapixels, repeat):
+    """Fastest of `repeat` forward passes and the largest memory growth seen, in MB"""
+    torch = import_torch()
+    side = max(int((megapixels * 1e6) ** 0.5), 8)
+    inputs = torch.rand((1, 3, side, side))
+    seconds, memory_mb = [], 0.0
+    for _ in range(repeat):
+        gc.collect()
+        with RssSampler() as rss:
+            start_rss = rss.peak
+            start = time.perf_counter()
+            preds = upscale_tensor(mdl, inputs, scale, tile_size=0)
+            seconds.append(time.perf_counter() - start)
+        del preds
+        memory_mb = max(memory_mb, (rss.peak - start_rss) / (1024 * 1024))
+    return side * side / 1e6, min(seconds), memory_mb
+
+
+def fit(samples, scale, threads):
+    """Coefficients from (megapixels, seconds, memory MB) samples"""
+    mp = np.array([s[0] for s in samples])
+    seconds = np.array([s[1] for s in samples])
+    if len(samples) > 1:
+        slope, overhead = np.polyfit(mp, seconds, 1)
+    else:
+        slope, overhead = seconds[0] / mp[0], 0.0
+    # The output tensor is counted by the cost model on its own
+    activations = np.array([max(s[2] - 12 * s[0] * scale * scale, 0.0) for s in samples])
+    return {
+        'seconds_per_mp': round(float(max(slope, 0.0)) * speedup(threads, upscale_cost.PARALLEL), 4),
+        'overhead': round(float(max(overhead, 0.0)), 4),
+        'mb_per_mp': round(float((mp * activations).sum() / (mp * mp).sum()), 1),
+        'threads': threads,
+        'samples': [[round(float(v), 4) for v in s] for s in samples]
+    }
+
+
+def parse_floats(value):
+    return [float(v) for v in value.split(',') if v]
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Measure the upscale cost coefficients of this machine')
+    parser.add_argument('--models', default='pan,edsr,msrn')
+    parser.add_argument('--scales', default='2,3,4')
+    parser.add_argument('--backend', default='torch', help='torch, onnx or onnx-int8')
+    parser.add_argument('--megapixels', type=parse_floats, default=parse_floats('0.02,0.05,0.1'),
+                        help='Input sizes to measure')
+    parser.add_argument('--repeat', type=int, default=2)
+    parser.add_argument('--threads', type=int, help='torch threads (default: AI_THREADS or every core)')
+    parser.add_argument('--stub', action='store_true', help='Stubbed models (pipeline check, meaningless figures)')
+    parser.add_argument('--output', help=f'Coefficients file (default {upscale_cost.CALIBRATION_FILE})')
+    args = parser.parse_args()
+    if args.stub and not args.output:
+        parser.error('--stub demande --output: des mesures de stub ne doivent pas remplacer la calibration')
+
+    torch = import_torch()
+    import upscale_server
+    threads = args.threads or upscale_server.cpu_scheduler.cores
+    torch.set_num_threads(threads)
+
+    coefficients = {}
+    for model_name in args.models.split(','):
+        for scale in (int(s) for s in args.scales.split(',')):
+            if args.stub:
+                from benchmark import stub_upscale_model
+                mdl = upscale_server.registry.get((model_name, scale, 'stub'), lambda: stub_upscale_model(scale))
+            else:
+                mdl = upscale_server.get_model(model_name, scale, args.backend)
+            if mdl is None:
+                print(f"⚠️ {model_name} x{scale} indisponible, ignoré")
+                continue
+            print(f"📏 Calibration {model_name} x{scale} ({args.backend}, {threads} thread(s))...")
+            # Warm-up: first-run allocations and lazy initialization are not part of the cost
+            measure(upscale_server.upscale_tensor, mdl, scale, min(args.megapixels), 1)
+            samples = [measure(upscale_server.upscale_tensor, mdl, scale, mp, args.repeat) for mp in args.megapixels]
+            entry = fit(samples, scale, threads)
+            coefficients[upscale_cost.coefficient_key(model_name, scale, args.backend)] = entry
+            print(f"  {entry['seconds_per_mp']:.2f}s/MP (1 thread) + {entry['overhead']:.3f}s, "
+                  f"{entry['mb_per_mp']:.0f}MB/MP")
+            # One model resident at a time: the others would distort the memory figures
+            del mdl
+            for key in ((model_name, scale), (model_name, scale, args.backend), (model_name, scale, 'stub')):
+                upscale_server.registry.unload(key)
+
+    if not coefficients:
+        parser.exit(1, 'Aucun modèle calibré\n')
+    output = args.output or upscale_cost.CALIBRATION_FILE
+    upscale_cost.save_calibration(coefficients, output, timestamp=time.time(), platform=platform.platform(),
+                                  cpu_count=os.cpu_count())
+    print(f"💾 Coefficients écrits dans {output}")
+
+
+if __name__ == '__main__':
+    main()
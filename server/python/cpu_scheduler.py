@@ -0,0 +1,206 @@
+"""
+CPU scheduler shared by the inference paths of a server process.
+Giving every request every core oversubscribes the CPU as soon as two requests
+overlap, so inferences take a slot first:
+- at most AI_MAX_INFERENCES run at the same time, the others wait;
+- waiting requests are admitted cheapest first, with aging so a large job is
+  not starved (its priority doubles every AGING_SECONDS of waiting);
+- the intra-op thread count follows the load: the cores are split between the
+  running inferences, and no model gets more threads than its scaling curve
+  (Amdahl's law, parallel fraction per model) can use.
+
+With the OpenMP backend, torch's thread count only applies to the thread that
+sets it: each request sets its share on its own thread when admitted, and picks
+up a new share (other requests admitted or finished) by calling refresh()
+between steps. ONNX Runtime sessions (rembg, upscale onnx*) have a fixed thread
+count: for them only the admission control applies.
+
+Configuration:
+  AI_SCHEDULER          0 to disable (every request runs at once with all threads)
+  AI_MAX_INFERENCES     concurrent inferences per process (default cores // 2, 1 to 4)
+  AI_THREADS            cores available to this process (set per worker by serve.py)
+"""
+import collections
+import itertools
+import os
+import sys
+import threading
+import time
+from contextlib import contextmanager
+
+# Fraction of the work that parallelizes, per model (or service) name
+PARALLEL_FRACTION = {
+    'upscale': 0.95,
+    'whisper': 0.85,
+    'rembg': 0.9,
+    # Small Whisper models are dominated by per-token overhead
+    'tiny': 0.7,
+    'base': 0.8,
+    'small': 0.85,
+    'medium': 0.9,
+    'large': 0.92
+}
+DEFAULT_PARALLEL_FRACTION = 0.9
+# A thread is only worth adding if it brings at least this relative speedup
+MIN_THREAD_GAIN = 0.05
+AGING_SECONDS = 5.0
+DECISION_LOG = 20
+
+
+def _env_int(name, default):
+    try:
+        return int(os.environ.get(name, default))
+    except ValueError:
+        return default
+
+
+def speedup(threads, parallel_fraction):
+    return 1.0 / ((1.0 - parallel_fraction) + parallel_fraction / threads)
+
+
+def useful_threads(parallel_fraction, cores):
+    """Largest thread count whose last thread still brings MIN_THREAD_GAIN"""
+    threads = 1
+    while threads < cores and speedup(threads + 1, parallel_fraction) >= \
+            speedup(threads, parallel_fraction) * (1 + MIN_THREAD_GAIN):
+        threads += 1
+    return threads
+
+
+class _Ticket:
+    __slots__ = ('model', 'cost', 'useful', 'threads', 'queued', 'started')
+
+    def __init__(self, model, cost, useful):
+        self.model = model
+        self.cost = cost
+        self.useful = useful
+        self.threads = None
+        self.queued = time.monotonic()
+        self.started = None
+
+
+class CpuScheduler:
+    """Admission control and thread allocation for one server process"""
+
+    def __init__(self, service, cores=None, max_active=None):
+        self.service = service
+        self.enabled = os.environ.get('AI_SCHEDULER', '1').lower() not in ('0', 'false', 'no', 'off')
+        self.cores = max(cores or _env_int('AI_THREADS', 0) or os.cpu_count() or 1, 1)
+        default_active = min(max(self.cores // 2, 1), 4)
+        self.max_active = max(max_active or _env_int('AI_MAX_INFERENCES', default_active), 1)
+        self.admitted = 0
+        self.total_wait = 0.0
+        self.decisions = collections.deque(maxlen=DECISION_LOG)
+        self._active = []
+        self._waiting = []
+        self._order = itertools.count()
+        self._cond = threading.Condition()
+        # Ticket of the request running on the calling thread
+        self._local = threading.local()
+
+    def _useful(self, model):
+        fraction = PARALLEL_FRACTION.get(model, PARALLEL_FRACTION.get(self.service, DEFAULT_PARALLEL_FRACTION))
+        return useful_threads(fraction, self.cores)
+
+    def _next_entry(self):
+        # Cheapest first; waiting lowers the effective cost so large jobs get their turn
+        now = time.monotonic()
+        return min(self._waiting, key=lambda item: (item[1].cost / (1 + (now - item[1].queued) / AGING_SECONDS),
+                                                    item[0]))
+
+    def _apply_threads(self):
+        """Split the cores between the running inferences, capped by what their models can use"""
+        if not self._active:
+            return
+        share = max(self.cores // len(self._active), 1)
+        threads = min(share, max(ticket.useful for ticket in self._active))
+        for ticket in self._active:
+            ticket.threads = min(threads, ticket.useful)
+
+    @staticmethod
+    def _set_torch_threads(threads):
+        # Only affects the calling thread (and the threads it creates later)
+        torch = sys.modules.get('torch')
+        if torch and threads and torch.get_num_threads() != threads:
+            torch.set_num_threads(threads)
+
+    def _dispatch(self):
+        """Admit waiting tickets while slots are free (caller holds the lock)"""
+        admitted = []
+        while self._waiting and len(self._active) < self.max_active:
+            entry = self._next_entry()
+            self._waiting.remove(entry)
+            ticket = entry[1]
+            ticket.started = time.monotonic()
+            self._active.append(ticket)
+            admitted.append(ticket)
+        if not admitted:
+            return
+        self._apply_threads()
+        for ticket in admitted:
+            waited = ticket.started - ticket.queued
+            self.admitted += 1
+            self.total_wait += waited
+            self.decisions.append({
+                'model': ticket.model,
+                'cost': round(ticket.cost, 2),
+                'threads': ticket.threads,
+                'waited_ms': round(waited * 1000, 1),
+                'running': len(self._active),
+                'queued': len(self._waiting)
+            })
+        self._cond.notify_all()
+
+    @contextmanager
+    def slot(self, model, cost=1.0):
+        """Wait for an inference slot; yields the thread count granted to this request"""
+        if not self.enabled:
+            yield None
+            return
+
+        ticket = _Ticket(model, cost, self._useful(model))
+        with self._cond:
+            self._waiting.append((next(self._order), ticket))
+            self._dispatch()
+            while ticket.started is None:
+                self._cond.wait()
+        self._local.ticket = ticket
+        self._set_torch_threads(ticket.threads)
+        try:
+            yield ticket.threads
+        finally:
+            self._local.ticket = None
+            with self._cond:
+                self._active.remove(ticket)
+                self._apply_threads()
+                self._dispatch()
+
+    def refresh(self):
+        """Current thread share of the request running on this thread (None outside a slot), applied to torch"""
+        ticket = getattr(self._local, 'ticket', None)
+        if ticket is None:
+            return None
+        with self._cond:
+            threads = ticket.threads
+        self._set_torch_threads(threads)
+        return threads
+
+    def depth(self):
+        with self._cond:
+            return len(self._waiting)
+
+    def stats(self):
+        now = time.monotonic()
+        with self._cond:
+            return {
+                'enabled': self.enabled,
+                'cores': self.cores,
+                'max_active': self.max_active,
+                'running': [{'model': t.model, 'cost': round(t.cost, 2), 'threads': t.threads,
+                             'seconds': round(now - t.started, 1)} for t in self._active],
+                'waiting': [{'model': t.model, 'cost': round(t.cost, 2), 'waited_seconds': round(now - t.queued, 1)}
+                            for _, t in self._waiting],
+                'admitted': self.admitted,
+                'mean_wait_ms': round(self.total_wait / self.admitted * 1000, 1) if self.admitted else 0,
+                'recent_decisions': list(self.decisions)
+            }
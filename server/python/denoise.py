@@ -0,0 +1,156 @@
+"""
+Denoising for the upscale pipeline.
+Methods:
+  nlmeans    OpenCV non-local means (best on heavy noise, by far the slowest)
+  bilateral  edge-preserving bilateral filter
+  guided     self-guided filter (He et al.) on each channel: a few box filters, the fastest
+  auto       estimates the noise level first (Immerkaer, 1996): clean images are
+             left untouched, light noise goes through the guided filter and heavy
+             noise through NL-means, with a strength matched to the estimate
+Large images are cut into horizontal strips, with the margin the filter reads
+around them, denoised in parallel (OpenCV releases the GIL) and stitched back.
+The strips are the only parallelism: OpenCV's own thread pool is turned off,
+or each strip would start its own threads on top of them.
+
+Configuration:
+  UPSCALE_DENOISE_METHOD   method used for denoise=true (default auto)
+"""
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+import metrics
+from warmup import import_cv2
+
+METHODS = ('auto', 'nlmeans', 'bilateral', 'guided')
+DEFAULT_METHOD = os.environ.get('UPSCALE_DENOISE_METHOD', 'auto').lower()
+if DEFAULT_METHOD not in METHODS:
+    DEFAULT_METHOD = 'auto'
+
+# Noise standard deviation (0-255 scale) assumed when it is not estimated
+DEFAULT_SIGMA = 10.0
+# auto: below CLEAN_SIGMA nothing is done, above HEAVY_SIGMA NL-means takes over
+CLEAN_SIGMA = 3.0
+HEAVY_SIGMA = 12.0
+
+# NL-means windows (the previous fixed call used 7/7: search window reduced from 21 for CPU)
+NLM_TEMPLATE = 7
+NLM_SEARCH = 7
+BILATERAL_DIAMETER = 5
+GUIDED_RADIUS = 2
+
+# Below this size the strips cost more than they save
+MIN_PARALLEL_PIXELS = 500_000
+
+
+def parse_method(value):
+    """Method name from the `denoise` form field, None when disabled; returns (method, error)"""
+    value = str(value or '').lower()
+    if value in ('', '0', 'false', 'no', 'off', 'none'):
+        return None, None
+    if value in ('1', 'true', 'yes', 'on'):
+        return DEFAULT_METHOD, None
+    if value not in METHODS:
+        return None, f"Débruitage inconnu: {value} (choix: {', '.join(METHODS)})"
+    return value, None
+
+
+def estimate_noise(array):
+    """
+    Standard deviation of the noise of an HWC uint8 image, on the 0-255 scale.
+    The Laplacian-difference kernel cancels smooth content, so what remains is mostly noise.
+    """
+    cv2 = import_cv2()
+    h, w = array.shape[:2]
+    if h < 3 or w < 3:
+        return 0.0
+    channels = array.shape[2] if array.ndim == 3 else 1
+    kernel = np.array([[1, -2, 1], [-2, 4, -2], [1, -2, 1]], dtype=np.float32)
+    # Per channel (the filter applies to each one): a gray conversion would average part of the noise away
+    response = cv2.filter2D(array, cv2.CV_32F, kernel)[1:-1, 1:-1]
+    return float(np.sqrt(np.pi / 2) * np.abs(response).sum(dtype=np.float64) / (6.0 * (w - 2) * (h - 2) * channels))
+
+
+def _nlmeans(array, sigma):
+    cv2 = import_cv2()
+    h = min(max(sigma, 3.0), 20.0)
+    return cv2.fastNlMeansDenoisingColored(array, None, h, h, NLM_TEMPLATE, NLM_SEARCH)
+
+
+def _bilateral(array, sigma):
+    cv2 = import_cv2()
+    return cv2.bilateralFilter(array, BILATERAL_DIAMETER, 3.0 * sigma, BILATERAL_DIAMETER / 2.0)
+
+
+def _guided(array, sigma):
+    """Each channel guides itself: smooths where the local variance is below the noise level"""
+    cv2 = import_cv2()
+    size = (2 * GUIDED_RADIUS + 1, 2 * GUIDED_RADIUS + 1)
+    box = lambda x: cv2.boxFilter(x, -1, size, borderType=cv2.BORDER_REFLECT)
+    # Regions whose variance is within a few noise levels are flattened, real edges are kept
+    eps = (3.0 * sigma) ** 2
+    image = array.astype(np.float32)
+    mean = box(image)
+    var = box(image * image) - mean * mean
+    a = var / (var + eps)
+    b = mean - a * mean
+    q = box(a) * image + box(b)
+    np.clip(q, 0.0, 255.0, out=q)
+    return q.astype(np.uint8)
+
+
+# Filter and the rows it reads above and below each output row
+FILTERS = {
+    'nlmeans': (_nlmeans, NLM_TEMPLATE // 2 + NLM_SEARCH // 2),
+    'bilateral': (_bilateral, BILATERAL_DIAMETER // 2),
+    'guided': (_guided, 2 * GUIDED_RADIUS)
+}
+
+
+def _strips(height, count, margin):
+    """(top, bottom, padded top, padded bottom) of `count` horizontal strips"""
+    step = -(-height // count)
+    for top in range(0, height, step):
+        bottom = min(top + step, height)
+        yield top, bottom, max(top - margin, 0), min(bottom + margin, height)
+
+
+def _apply(fn, margin, array, sigma, threads):
+    # Process-wide setting: the threads granted by the CPU scheduler are the strips
+    cv2 = import_cv2()
+    if cv2.getNumThreads() != 1:
+        cv2.setNumThreads(1)
+    height, width = array.shape[:2]
+    if threads <= 1 or height * width < MIN_PARALLEL_PIXELS or height < 4 * threads * margin:
+        return fn(array, sigma)
+
+    out = np.empty_like(array)
+
+    def run(strip):
+        top, bottom, padded_top, padded_bottom = strip
+        result = fn(array[padded_top:padded_bottom], sigma)
+        out[top:bottom] = result[top - padded_top:bottom - padded_top]
+
+    with ThreadPoolExecutor(max_workers=threads, thread_name_prefix='denoise') as pool:
+        # list() re-raises the first error of the strips
+        list(pool.map(run, _strips(height, threads, margin)))
+    return out
+
+
+def denoise(array, method='auto', threads=1, model=''):
+    """
+    Denoised copy of an HWC uint8 RGB array (or the array itself when auto finds it clean).
+    Returns (array, info) with info = {'method', 'sigma'}; method is 'none' when skipped.
+    """
+    sigma = None
+    if method == 'auto':
+        with metrics.stage('noise_estimate', model):
+            sigma = estimate_noise(array)
+        if sigma < CLEAN_SIGMA:
+            return array, {'method': 'none', 'sigma': round(sigma, 2)}
+        method = 'guided' if sigma < HEAVY_SIGMA else 'nlmeans'
+
+    fn, margin = FILTERS[method]
+    result = _apply(fn, margin, array, sigma or DEFAULT_SIGMA, max(int(threads or 1), 1))
+    return result, {'method': method, 'sigma': round(sigma, 2) if sigma is not None else None}
@@ -0,0 +1,196 @@
+"""
+Frame sequences for rembg: animated GIF/WebP/PNG are decoded with PIL and
+videos with ffmpeg (raw RGB frames on a pipe). Each frame is compared with the
+last keyframe on a small grayscale thumbnail, so the segmentation model only
+runs when the picture actually changes:
+  infer      too many pixels changed: the frame becomes the new keyframe
+  reuse      (almost) nothing changed: the keyframe's mask is used as is
+  propagate  small changes: the keyframe's mask is re-fitted to the frame's
+             edges with the guided filter (mask_refine)
+Frames are decoded one at a time and scaled so the whole sequence fits in
+REMBG_MAX_MEGAPIXELS: a long or large video is downscaled instead of holding
+hundreds of full-size frames. Decisions only need the last keyframe, so frames
+wait in chunks of REMBG_FRAME_CHUNK for their keyframes' masks (one batched
+model run per chunk) and are dropped once cut out.
+
+Configuration:
+  REMBG_MAX_FRAMES       frames processed per upload (default 300), the rest is dropped
+  REMBG_MAX_MEGAPIXELS   pixels of all the frames of a sequence together (default 60)
+  REMBG_FRAME_CHUNK      frames waiting for their keyframes' masks (default 16)
+  REMBG_FRAME_REUSE      0 to run the model on every frame
+"""
+import math
+import os
+import re
+import subprocess
+import tempfile
+import threading
+
+import numpy as np
+from PIL import Image, ImageSequence
+
+from mask_refine import work_image, guided_upsample
+
+VIDEO_EXTENSIONS = {'mp4', 'webm', 'mov', 'mkv', 'avi', 'm4v'}
+
+MAX_FRAMES = int(os.environ.get('REMBG_MAX_FRAMES', 300))
+MAX_PIXELS = int(float(os.environ.get('REMBG_MAX_MEGAPIXELS', 60)) * 1_000_000)
+FRAME_CHUNK = max(int(os.environ.get('REMBG_FRAME_CHUNK', 16)), 1)
+FRAME_REUSE = os.environ.get('REMBG_FRAME_REUSE', '1').lower() not in ('0', 'false', 'no', 'off')
+
+# Frame differencing on thumbnails: a pixel counts as changed beyond PIXEL_DELTA
+# (0-255), and the share of changed pixels picks the action
+THUMB_SIZE = 96
+PIXEL_DELTA = 16
+REUSE_CHANGED = 0.002
+PROPAGATE_CHANGED = 0.03
+# Working size of the guided filter when a mask is propagated
+PROPAGATE_SIZE = 512
+
+DEFAULT_FRAME_MS = 100
+DEFAULT_FPS = 25.0
+
+
+def is_video(filename):
+    return '.' in filename and filename.rsplit('.', 1)[1].lower() in VIDEO_EXTENSIONS
+
+
+def _frame_mode(img):
+    # Keep the source transparency (GIF/WebP) in the cutout
+    return 'RGBA' if img.mode in ('RGBA', 'LA', 'PA') or 'transparency' in img.info else 'RGB'
+
+
+def fit(size, pixels):
+    """size scaled down (aspect kept) to at most `pixels` pixels"""
+    width, height = size
+    if width * height <= pixels:
+        return size
+    scale = math.sqrt(pixels / (width * height))
+    return max(int(width * scale), 1), max(int(height * scale), 1)
+
+
+def frame_pixels(count):
+    """Per-frame pixel budget of a sequence of `count` frames"""
+    return max(MAX_PIXELS // max(count, 1), 1)
+
+
+def animation_frames(img, max_frames=MAX_FRAMES):
+    """(frame, duration in ms) of an animated image, one frame at a time, scaled to the pixel budget"""
+    count = min(img.n_frames, max_frames)
+    if img.n_frames > max_frames:
+        print(f"⚠️ Animation tronquée à {max_frames} images")
+    pixels = frame_pixels(count)
+    for i, frame in enumerate(ImageSequence.Iterator(img)):
+        if i >= count:
+            break
+        duration = frame.info.get('duration') or DEFAULT_FRAME_MS
+        frame = frame.convert(_frame_mode(frame))
+        size = fit(frame.size, pixels)
+        if size != frame.size:
+            frame = frame.resize(size, Image.Resampling.LANCZOS)
+        yield frame, duration
+
+
+def _probe_frames(ffmpeg, path):
+    """Frame count of a video from ffmpeg's stream header (duration x rate), None if unknown"""
+    info = subprocess.run([ffmpeg, '-nostdin', '-hide_banner', '-i', path], stdin=subprocess.DEVNULL,
+                          capture_output=True).stderr.decode(errors='replace')
+    duration = re.search(r'Duration: (\d+):(\d+):([\d.]+)', info)
+    rate = re.search(r'Video:.*?([\d.]+) (?:fps|tbr)', info)
+    if not duration or not rate:
+        return None
+    hours, minutes, seconds = duration.groups()
+    return math.ceil((int(hours) * 3600 + int(minutes) * 60 + float(seconds)) * float(rate.group(1)))
+
+
+def video_frames(data, suffix='.mp4', max_frames=MAX_FRAMES):
+    """(frame, duration in ms) of a video decoded by ffmpeg, one frame at a time, scaled to the pixel budget"""
+    from audio import find_ffmpeg
+
+    ffmpeg = find_ffmpeg() or 'ffmpeg'
+    # Containers like MP4 need a seekable input: go through a temp file
+    with tempfile.NamedTemporaryFile(suffix=suffix, delete=False) as tmp:
+        tmp.write(data)
+    try:
+        pixels = frame_pixels(min(_probe_frames(ffmpeg, tmp.name) or max_frames, max_frames))
+        # Scaled by ffmpeg after auto-rotation, so the budget applies to the displayed size
+        factor = f"min(1\\,sqrt({pixels}/(iw*ih)))"
+        scale_filter = f"scale=w=max(1\\,trunc(iw*{factor})):h=max(1\\,trunc(ih*{factor}))"
+        proc = subprocess.Popen([ffmpeg, '-nostdin', '-hide_banner', '-i', tmp.name, '-frames:v', str(max_frames),
+                                 '-vf', scale_filter, '-an', '-f', 'rawvideo', '-pix_fmt', 'rgb24', 'pipe:1'],
+                                stdin=subprocess.DEVNULL, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+        try:
+            # The output stream line (decoded size and rate) comes before the first frame
+            header = []
+            size = fps = None
+            in_output = False
+            for line in iter(proc.stderr.readline, b''):
+                text = line.decode(errors='replace').strip()
+                header.append(text)
+                if text.startswith('Output #0'):
+                    in_output = True
+                elif in_output and 'Video:' in text:
+                    match = re.search(r', (\d+)x(\d+)', text)
+                    size = (int(match.group(1)), int(match.group(2))) if match else None
+                    rate = re.search(r'([\d.]+) (?:fps|tbr)', text)
+                    fps = float(rate.group(1)) if rate else DEFAULT_FPS
+                    break
+            if size is None:
+                proc.wait()
+                raise RuntimeError(f"Vidéo illisible: {' '.join(header[-2:])}")
+            # Drained in the background from now on so ffmpeg never blocks on it
+            threading.Thread(target=proc.stderr.read, daemon=True).start()
+
+            frame_bytes = size[0] * size[1] * 3
+            duration = round(1000 / fps)
+            decoded = 0
+            while decoded < max_frames:
+                buffer = proc.stdout.read(frame_bytes)
+                if len(buffer) < frame_bytes:
+                    break
+                decoded += 1
+                yield Image.frombuffer('RGB', size, buffer, 'raw', 'RGB', 0, 1), duration
+            if not decoded:
+                raise RuntimeError('Aucune image décodée dans la vidéo')
+        finally:
+            if proc.poll() is None:
+                proc.kill()
+            proc.wait()
+            proc.stdout.close()
+    finally:
+        os.unlink(tmp.name)
+
+
+def _thumbnail(frame):
+    scale = THUMB_SIZE / max(frame.size)
+    size = (max(round(frame.width * scale), 1), max(round(frame.height * scale), 1))
+    return np.asarray(frame.convert('L').resize(size, Image.Resampling.BILINEAR), dtype=np.int16)
+
+
+class Planner:
+    """
+    Per-frame decisions, made as the frames come: a frame is only compared with the
+    last keyframe, so a stream is planned without keeping the frames around
+    """
+
+    def __init__(self, reuse=FRAME_REUSE):
+        self.reuse = reuse
+        self.key_thumb = None
+
+    def next(self, frame):
+        """'infer' (new keyframe), 'reuse' or 'propagate' the last keyframe's mask"""
+        thumb = _thumbnail(frame)
+        if self.reuse and self.key_thumb is not None and thumb.shape == self.key_thumb.shape:
+            changed = np.count_nonzero(np.abs(thumb - self.key_thumb) > PIXEL_DELTA) / thumb.size
+            if changed <= REUSE_CHANGED:
+                return 'reuse'
+            if changed <= PROPAGATE_CHANGED:
+                return 'propagate'
+        self.key_thumb = thumb
+        return 'infer'
+
+
+def propagate(mask, frame, work_size=PROPAGATE_SIZE):
+    """Keyframe mask re-fitted to the edges of a slightly different frame"""
+    small = work_image(frame, work_size)
+    return guided_upsample(mask.resize(small.size, Image.Resampling.BILINEAR), small, frame)
@@ -0,0 +1,216 @@
+"""
+Image output pipeline shared by rembg and upscale.
+Encodes results as PNG (tunable zlib level), WebP (lossless or lossy) or JPEG,
+and frame sequences as animated PNG / WebP, into a BytesIO whose storage
+becomes the returned bytes without a copy, or streams the encoded bytes while
+PIL is still writing them.
+
+Configuration:
+  AI_PNG_COMPRESS_LEVEL   zlib level for PNG output, 0-9 (default 1: fast, slightly larger)
+  AI_WEBP_QUALITY         lossy WebP / JPEG quality (default 90)
+"""
+import io
+import os
+import queue
+import threading
+import unicodedata
+from urllib.parse import quote
+
+from flask import Response
+
+import metrics
+
+FORMATS = {
+    'png': ('PNG', 'image/png', 'png'),
+    'webp': ('WEBP', 'image/webp', 'webp'),
+    'jpeg': ('JPEG', 'image/jpeg', 'jpg')
+}
+
+
+def _env_int(name, default, lo, hi):
+    try:
+        return min(max(int(os.environ.get(name, default)), lo), hi)
+    except ValueError:
+        return default
+
+
+PNG_COMPRESS_LEVEL = _env_int('AI_PNG_COMPRESS_LEVEL', 1, 0, 9)
+DEFAULT_QUALITY = _env_int('AI_WEBP_QUALITY', 90, 1, 100)
+# libwebp speed/size trade-off (0 = fastest, 6 = smallest); lossless output is
+# already large, so it gets the fastest setting
+WEBP_METHOD = 2
+WEBP_LOSSLESS_METHOD = 0
+
+STREAM_QUEUE_CHUNKS = 16
+
+
+class OutputFormat:
+    """Encoder choice and settings for one response"""
+
+    def __init__(self, name='png', quality=None, lossless=None, compress_level=None):
+        self.name = name
+        self.quality = quality or DEFAULT_QUALITY
+        self.lossless = name == 'png' or (name == 'webp' and bool(lossless))
+        self.compress_level = PNG_COMPRESS_LEVEL if compress_level is None else compress_level
+
+    @property
+    def mimetype(self):
+        return FORMATS[self.name][1]
+
+    @property
+    def extension(self):
+        return FORMATS[self.name][2]
+
+    def save_params(self):
+        if self.name == 'png':
+            return {'compress_level': self.compress_level}
+        if self.name == 'webp' and self.lossless:
+            # For lossless WebP, quality is the compression effort
+            return {'lossless': True, 'quality': 0, 'method': WEBP_LOSSLESS_METHOD}
+        if self.name == 'webp':
+            return {'quality': self.quality, 'method': WEBP_METHOD}
+        return {'quality': self.quality}
+
+    def cache_params(self):
+        """Settings that change the output bytes, for the result-cache key"""
+        return {'format': self.name, **self.save_params()}
+
+
+def parse_output_format(form, allowed=tuple(FORMATS), default='png'):
+    """OutputFormat from the form fields format/quality/lossless/compression, returns (format, error)"""
+    name = (form.get('format') or default).lower()
+    if name == 'jpg':
+        name = 'jpeg'
+    if name not in allowed:
+        return None, f"Format de sortie non supporté: {name} ({', '.join(allowed)})"
+    try:
+        quality = int(form['quality']) if form.get('quality') else None
+        compress_level = int(form['compression']) if form.get('compression') else None
+    except ValueError:
+        return None, 'Paramètres de compression invalides'
+    if quality is not None and not 1 <= quality <= 100:
+        return None, 'La qualité doit être entre 1 et 100'
+    if compress_level is not None and not 0 <= compress_level <= 9:
+        return None, 'La compression PNG doit être entre 0 et 9'
+    lossless = str(form.get('lossless', '')).lower() in ('1', 'true', 'yes', 'on')
+    return OutputFormat(name, quality, lossless, compress_level), None
+
+
+def prepare(img, output):
+    """Mode conversion the encoder needs (JPEG has no alpha)"""
+    if output.name == 'jpeg' and img.mode not in ('RGB', 'L'):
+        return img.convert('RGB')
+    return img
+
+
+def encode(img, output, stage='encode', model=''):
+    """Encoded bytes of img"""
+    buffer = io.BytesIO()
+    with metrics.stage(stage, model):
+        prepare(img, output).save(buffer, FORMATS[output.name][0], **output.save_params())
+    # An unshared BytesIO hands its storage over as the bytes object, without a copy
+    return buffer.getvalue()
+
+
+def encode_animation(frames, output, durations, loop=0, stage='encode', model=''):
+    """Animated PNG (APNG) or WebP of a list of frames; durations in ms, per frame"""
+    if output.name not in ('png', 'webp'):
+        raise ValueError(f"Format animé non supporté: {output.name}")
+    buffer = io.BytesIO()
+    with metrics.stage(stage, model):
+        frames[0].save(buffer, FORMATS[output.name][0], save_all=True, append_images=frames[1:],
+                       duration=list(durations), loop=loop, **output.save_params())
+    return buffer.getvalue()
+
+
+class _StreamCancelled(Exception):
+    pass
+
+
+class _QueueWriter:
+    def __init__(self, chunks, cancelled):
+        self._chunks = chunks
+        self._cancelled = cancelled
+
+    def write(self, chunk):
+        if self._cancelled.is_set():
+            # The client went away: abort the encoder
+            raise _StreamCancelled()
+        self._chunks.put(bytes(chunk))
+        return len(chunk)
+
+    def flush(self):
+        pass
+
+
+def encode_stream(img, output, on_complete=None, stage='encode', model=''):
+    """
+    Generator of encoded chunks, produced while PIL encodes in a background thread.
+    on_complete(data) receives the full output once it has been streamed entirely;
+    an encoder error is logged and raised instead, and nothing is handed over.
+    """
+    chunks = queue.Queue(maxsize=STREAM_QUEUE_CHUNKS)
+    cancelled = threading.Event()
+    done = object()
+    errors = []
+
+    def run():
+        try:
+            with metrics.stage(stage, model):
+                prepare(img, output).save(_QueueWriter(chunks, cancelled), FORMATS[output.name][0],
+                                          **output.save_params())
+        except _StreamCancelled:
+            return
+        except Exception as e:
+            errors.append(e)
+        chunks.put(done)
+
+    threading.Thread(target=run, daemon=True, name='image-encoder').start()
+
+    parts = [] if on_complete else None
+    try:
+        while True:
+            chunk = chunks.get()
+            if chunk is done:
+                break
+            if parts is not None:
+                parts.append(chunk)
+            yield chunk
+        if errors:
+            print(f"❌ Encodage {FORMATS[output.name][0]} interrompu ({stage}): {errors[0]}")
+            raise errors[0]
+        if parts is not None:
+            on_complete(b''.join(parts))
+    finally:
+        cancelled.set()
+        # Unblock the encoder if it is waiting on a full queue
+        while not chunks.empty():
+            chunks.get_nowait()
+
+
+def _prefetched(first, chunks):
+    # A generator rather than itertools.chain: closing the body still cancels the encoder
+    try:
+        yield first
+        yield from chunks
+    finally:
+        chunks.close()
+
+
+def stream_response(img, output, download_name, on_complete=None, stage='encode', model=''):
+    """
+    Attachment response whose body is encoded while it is being sent. The first
+    chunk is encoded before the headers go out, so an encoder that fails right
+    away raises here (an error response) rather than in a 200.
+    """
+    chunks = encode_stream(img, output, on_complete, stage, model)
+    first = next(chunks, None)
+    body = chunks if first is None else _prefetched(first, chunks)
+    response = Response(body, mimetype=output.mimetype, direct_passthrough=True)
+    simple = unicodedata.normalize('NFKD', download_name).encode('ascii', 'ignore').decode('ascii')
+    if simple == download_name:
+        response.headers.set('Content-Disposition', 'attachment', filename=download_name)
+    else:
+        response.headers.set('Content-Disposition', 'attachment', filename=simple,
+                             **{'filename*': f"UTF-8''{quote(download_name, safe='')}"})
+    return response
@@ -0,0 +1,336 @@
+"""
+Asynchronous job queue shared by the AI servers.
+Long-running work (upscaling, transcription) is submitted as a job and run by
+a bounded worker pool; clients poll the job for state and progress, then
+fetch the result. Binary results are written to disk as soon as the job
+finishes and streamed from there, so they do not sit in memory until the TTL;
+expired jobs are purged by a background thread.
+
+Configuration:
+  AI_JOB_WORKERS   jobs running at the same time (default 1)
+  AI_JOB_QUEUE     jobs allowed to wait for a worker (default 8)
+  AI_JOB_TTL       seconds a finished job and its result are kept (default 3600)
+  AI_JOB_DIR       directory shared by the worker processes of one server
+                   (set by serve.py): job state and results are published
+                   there so any worker can answer GET /jobs/<id>
+                   (a private temp directory holds the results otherwise)
+"""
+import io
+import json
+import os
+import re
+import tempfile
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+from flask import jsonify, send_file
+
+JOB_ID_RE = re.compile(r'[0-9a-f]{32}')
+# Minimum seconds between two progress publications in shared mode
+PUBLISH_INTERVAL = 0.5
+
+
+def _env_int(name, default):
+    try:
+        return int(os.environ.get(name, default))
+    except ValueError:
+        return default
+
+
+class QueueFull(Exception):
+    """Raised when the job queue is at capacity"""
+
+    def __init__(self, retry_after):
+        super().__init__('File d\'attente pleine')
+        self.retry_after = retry_after
+
+
+class Job:
+    def __init__(self, kind):
+        self.id = uuid.uuid4().hex
+        self.kind = kind
+        self.state = 'queued'
+        self.progress = 0.0
+        self.detail = {}
+        self.error = None
+        self.result = None
+        self.result_path = None
+        self.mimetype = None
+        self.filename = None
+        self.created = time.time()
+        self.started = None
+        self.finished = None
+        self.on_update = None
+        self.published = 0.0
+
+    @classmethod
+    def from_dict(cls, data):
+        """Read-only copy of a job published by another worker"""
+        job = cls(data['kind'])
+        job.id = data['id']
+        job.state = data['state']
+        job.progress = data['progress'] / 100
+        job.detail = data['detail']
+        job.error = data.get('error')
+        job.created = data['created']
+        job.started = data['started']
+        job.finished = data['finished']
+        job.mimetype = data.get('mimetype')
+        job.filename = data.get('filename')
+        return job
+
+    def update(self, progress, **detail):
+        """Progress callback handed to the job function (progress in 0..1)"""
+        self.progress = max(0.0, min(float(progress), 1.0))
+        self.detail.update(detail)
+        if self.on_update:
+            self.on_update(self)
+
+    def to_dict(self):
+        data = {
+            'id': self.id,
+            'kind': self.kind,
+            'state': self.state,
+            'progress': round(self.progress * 100, 1),
+            'detail': self.detail,
+            'created': self.created,
+            'started': self.started,
+            'finished': self.finished
+        }
+        if self.error:
+            data['error'] = self.error
+        return data
+
+
+class JobManager:
+    """Bounded worker pool with backpressure"""
+
+    def __init__(self, name, workers=None, max_queue=None, ttl_seconds=None, shared_dir=None):
+        self.name = name
+        self.workers = max(workers or _env_int('AI_JOB_WORKERS', 1), 1)
+        self.max_queue = max_queue if max_queue is not None else _env_int('AI_JOB_QUEUE', 8)
+        self.ttl = ttl_seconds or _env_int('AI_JOB_TTL', 3600)
+        self.shared_dir = shared_dir or os.environ.get('AI_JOB_DIR') or None
+        if self.shared_dir:
+            os.makedirs(self.shared_dir, exist_ok=True)
+        self._jobs = {}
+        self._lock = threading.Lock()
+        self._executor = None
+        self._executor_pid = None
+        self._reaper_pid = None
+        self._result_dir = None
+        self._durations = []
+
+    def submit(self, kind, fn, *args, **kwargs):
+        """
+        Queue fn(job, *args, **kwargs). fn reports progress with job.update() and
+        returns either a dict (JSON result) or (bytes, mimetype, filename).
+        Raises QueueFull when all workers are busy and the queue is full.
+        """
+        with self._lock:
+            self._purge()
+            if self._pending() >= self.workers + self.max_queue:
+                raise QueueFull(self._retry_after())
+            job = Job(kind)
+            self._jobs[job.id] = job
+        self._ensure_reaper()
+        if self.shared_dir:
+            job.on_update = self._publish_progress
+            self._publish(job)
+        self._pool().submit(self._run, job, fn, args, kwargs)
+        return job
+
+    def get(self, job_id, with_result=False):
+        """Job by id, looking at the other workers' jobs in shared mode"""
+        with self._lock:
+            job = self._jobs.get(job_id)
+        if job is None and self.shared_dir and JOB_ID_RE.fullmatch(job_id):
+            job = self._load_shared(job_id, with_result)
+        return job
+
+    def depth(self):
+        with self._lock:
+            return sum(1 for j in self._jobs.values() if j.state == 'queued')
+
+    def stats(self):
+        with self._lock:
+            states = {}
+            for job in self._jobs.values():
+                states[job.state] = states.get(job.state, 0) + 1
+            return {'workers': self.workers, 'max_queue': self.max_queue, 'jobs': states}
+
+    def _pool(self):
+        # Created lazily and per process so a forked worker gets its own threads
+        if self._executor is None or self._executor_pid != os.getpid():
+            self._executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix=f"{self.name}-job")
+            self._executor_pid = os.getpid()
+        return self._executor
+
+    def _ensure_reaper(self):
+        # Started lazily and per process so it survives a fork of the server
+        if self._reaper_pid == os.getpid():
+            return
+        self._reaper_pid = os.getpid()
+        threading.Thread(target=self._reap, daemon=True, name=f"{self.name}-job-reaper").start()
+
+    def _reap(self):
+        interval = max(min(self.ttl / 2, 60), 1)
+        while True:
+            time.sleep(interval)
+            with self._lock:
+                self._purge()
+
+    def _results(self):
+        """Directory of the binary results: the shared one, else a private temp directory"""
+        if self.shared_dir:
+            return self.shared_dir
+        if self._result_dir is None or not os.path.isdir(self._result_dir):
+            self._result_dir = tempfile.mkdtemp(prefix=f"{self.name}-jobs-")
+        return self._result_dir
+
+    def _store_result(self, job, data):
+        """Binary result moved to disk; kept in memory only if it cannot be written"""
+        try:
+            path = os.path.join(self._results(), job.id + '.bin')
+            self._write_file(path, data)
+        except OSError as e:
+            print(f"⚠️ [{self.name}] Résultat du job {job.id} gardé en mémoire ({e})")
+            job.result = data
+            return
+        job.result_path = path
+
+    def _run(self, job, fn, args, kwargs):
+        job.state = 'running'
+        job.started = time.time()
+        try:
+            result = fn(job, *args, **kwargs)
+            if isinstance(result, tuple):
+                data, job.mimetype, job.filename = result
+                self._store_result(job, data)
+            else:
+                job.result = result
+            job.progress = 1.0
+            job.state = 'done'
+        except Exception as e:
+            print(f"❌ [{self.name}] Job {job.id} en erreur: {e}")
+            job.error = str(e)
+            job.state = 'error'
+        finally:
+            job.finished = time.time()
+            with self._lock:
+                self._durations = (self._durations + [job.finished - job.started])[-20:]
+            if self.shared_dir:
+                self._publish(job, with_result=True)
+
+    def _pending(self):
+        return sum(1 for j in self._jobs.values() if j.state in ('queued', 'running'))
+
+    def _retry_after(self):
+        """Rough seconds until a slot frees up, from recent job durations"""
+        if not self._durations:
+            return 5
+        avg = sum(self._durations) / len(self._durations)
+        return max(int(avg * self._pending() / self.workers / 2), 1)
+
+    def _purge(self):
+        now = time.time()
+        expired = [jid for jid, j in self._jobs.items() if j.finished and now - j.finished > self.ttl]
+        for jid in expired:
+            job = self._jobs.pop(jid)
+            paths = [job.result_path] if job.result_path else []
+            if self.shared_dir:
+                paths += [self._shared_path(jid, '.json'), self._shared_path(jid, '.bin')]
+            for path in paths:
+                try:
+                    os.unlink(path)
+                except OSError:
+                    pass
+
+    # --- Shared mode: one JSON file per job (+ .bin for binary results) ---
+
+    def _shared_path(self, job_id, suffix):
+        return os.path.join(self.shared_dir, job_id + suffix)
+
+    def _write_file(self, path, data):
+        fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix='.tmp')
+        with os.fdopen(fd, 'wb') as f:
+            f.write(data)
+        os.replace(tmp_path, path)
+
+    def _publish(self, job, with_result=False):
+        data = job.to_dict()
+        data.update(mimetype=job.mimetype, filename=job.filename)
+        try:
+            if with_result and job.state == 'done':
+                if job.result_path:
+                    # Already written there by _store_result()
+                    data['result_file'] = True
+                elif isinstance(job.result, (bytes, bytearray)):
+                    self._write_file(self._shared_path(job.id, '.bin'), job.result)
+                    data['result_file'] = True
+                else:
+                    data['result'] = job.result
+            self._write_file(self._shared_path(job.id, '.json'), json.dumps(data).encode('utf-8'))
+            job.published = time.monotonic()
+        except (OSError, TypeError) as e:
+            print(f"⚠️ [{self.name}] Publication du job {job.id} impossible ({e})")
+
+    def _publish_progress(self, job):
+        if time.monotonic() - job.published >= PUBLISH_INTERVAL:
+            self._publish(job)
+
+    def _load_shared(self, job_id, with_result):
+        try:
+            with open(self._shared_path(job_id, '.json'), 'rb') as f:
+                data = json.loads(f.read())
+            job = Job.from_dict(data)
+            if with_result and job.state == 'done':
+                if data.get('result_file'):
+                    job.result_path = self._shared_path(job_id, '.bin')
+                else:
+                    job.result = data.get('result')
+            return job
+        except (OSError, ValueError, KeyError):
+            return None
+
+
+def queue_full_response(error):
+    response = jsonify({'error': 'Serveur occupé, réessayez plus tard', 'retry_after': error.retry_after})
+    response.status_code = 429
+    response.headers['Retry-After'] = str(error.retry_after)
+    return response
+
+
+def register_job_routes(app, manager):
+    """GET /jobs/<id> (state, progress) and GET /jobs/<id>/result"""
+
+    @app.route('/jobs/<job_id>', methods=['GET'])
+    def get_job(job_id):
+        job = manager.get(job_id)
+        if job is None:
+            return jsonify({'error': 'Job introuvable'}), 404
+        return jsonify(job.to_dict())
+
+    @app.route('/jobs/<job_id>/result', methods=['GET'])
+    def get_job_result(job_id):
+        job = manager.get(job_id, with_result=True)
+        if job is None:
+            return jsonify({'error': 'Job introuvable'}), 404
+        if job.state == 'error':
+            return jsonify({'error': job.error, 'state': job.state}), 500
+        if job.state != 'done':
+            return jsonify({'error': 'Job non terminé', 'state': job.state,
+                            'progress': round(job.progress * 100, 1)}), 409
+        if job.result_path:
+            try:
+                # Streamed from disk; the file stays until the job expires
+                return send_file(open(job.result_path, 'rb'), mimetype=job.mimetype,
+                                 as_attachment=True, download_name=job.filename)
+            except OSError:
+                return jsonify({'error': 'Résultat expiré'}), 404
+        if isinstance(job.result, (bytes, bytearray)):
+            return send_file(io.BytesIO(job.result), mimetype=job.mimetype,
+                             as_attachment=True, download_name=job.filename)
+        return jsonify(job.result)
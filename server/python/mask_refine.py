@@ -0,0 +1,70 @@
+"""
+Low-resolution mask inference with full-resolution refinement for rembg.
+The segmentation network only sees a downscaled copy of the image; its mask is
+brought back to full size with a fast guided filter (He & Sun, 2015): the
+edge-aware linear coefficients are solved at low resolution, upsampled, and
+applied to the full-resolution luminance in a single vectorized pass.
+"""
+import numpy as np
+from PIL import Image
+
+from warmup import import_cv2
+
+# Longest side of the copy the network and the filter work on
+DEFAULT_WORK_SIZE = 1024
+# Box radius at the working resolution and regularization (larger eps = smoother alpha)
+RADIUS = 4
+EPS = 1e-3
+
+
+def work_image(img, max_side=DEFAULT_WORK_SIZE):
+    """Downscaled copy for inference, or img itself when it is already small enough"""
+    if max(img.size) <= max_side:
+        return img
+    if img.mode not in ('RGB', 'RGBA', 'L'):
+        img = img.convert('RGB')
+    # Integer box reduction first (cheap), then a small bilinear resize
+    factor = int(max(img.size) / max_side)
+    if factor > 1:
+        img = img.reduce(factor)
+    scale = max_side / max(img.size)
+    if scale < 1:
+        size = (max(round(img.width * scale), 1), max(round(img.height * scale), 1))
+        img = img.resize(size, Image.Resampling.BILINEAR)
+    return img
+
+
+def _luminance(img):
+    return np.asarray(img.convert('L'), dtype=np.float32) / 255.0
+
+
+def _box(x, radius):
+    cv2 = import_cv2()
+    return cv2.boxFilter(x, -1, (2 * radius + 1, 2 * radius + 1), borderType=cv2.BORDER_REFLECT)
+
+
+def guided_upsample(mask, small, full, radius=RADIUS, eps=EPS):
+    """
+    Full-resolution L mask from a mask computed on `small`, guided by the edges of `full`.
+    mask and small have the same size; returns a PIL image the size of full.
+    """
+    guide = _luminance(small)
+    p = np.asarray(mask.convert('L'), dtype=np.float32) / 255.0
+
+    mean_i = _box(guide, radius)
+    mean_p = _box(p, radius)
+    var_i = _box(guide * guide, radius) - mean_i * mean_i
+    cov_ip = _box(guide * p, radius) - mean_i * mean_p
+    a = cov_ip / (var_i + eps)
+    b = mean_p - a * mean_i
+    mean_a = _box(a, radius)
+    mean_b = _box(b, radius)
+
+    # q = a * I + b on the 0-255 luminance: scaling b keeps the output in 0-255
+    cv2 = import_cv2()
+    size = full.size
+    full_guide = np.asarray(full.convert('L'))
+    q = cv2.multiply(cv2.resize(mean_a, size, interpolation=cv2.INTER_LINEAR), full_guide, dtype=cv2.CV_32F)
+    cv2.add(q, cv2.resize(mean_b * 255.0, size, interpolation=cv2.INTER_LINEAR), q)
+    np.clip(q, 0.0, 255.0, out=q)
+    return Image.fromarray(q.astype(np.uint8), mode='L')
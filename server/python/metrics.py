@@ -0,0 +1,421 @@
+"""
+Instrumentation shared by the AI servers: Prometheus text-format /metrics.
+Counters, gauges and histograms are kept in-process; init_app() wires request
+counting/latency and the /metrics endpoint.
+
+Under serve.py a server is several gunicorn workers, and a scrape lands on any
+one of them. Each process then publishes its values to AI_METRICS_DIR (one
+file per pid, rewritten every PUBLISH_SECONDS) and /metrics merges them:
+counters and histograms are summed (a worker that exited keeps counting),
+gauges are reported per process with a `worker` label (dropped with it). What
+the master measured before forking (preloaded models) is published once by the
+master instead of being inherited by every worker.
+
+Configuration:
+  AI_METRICS_DIR   directory shared by the processes of one server (set by serve.py)
+"""
+import json
+import os
+import sys
+import threading
+import time
+from contextlib import contextmanager
+
+from flask import Response, g, request
+from werkzeug.exceptions import HTTPException
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300, 600)
+
+METRICS_DIR = os.environ.get('AI_METRICS_DIR') or None
+PUBLISH_SECONDS = 1.0
+
+_service = 'unknown'
+# Model label values allowed on request metrics (None: any), set by init_app()
+_models = None
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+
+
+def _format_labels(names, values, extra=None):
+    pairs = list(zip(names, values))
+    if extra:
+        pairs.append(extra)
+    if not pairs:
+        return ''
+    return '{' + ','.join(f'{k}="{_escape(v)}"' for k, v in pairs) + '}'
+
+
+def _format_value(value):
+    if value == float('inf'):
+        return '+Inf'
+    return repr(float(value))
+
+
+class _Metric:
+    kind = None
+
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+
+    def _key(self, labels):
+        return tuple(str(labels.get(name, '')) for name in self.labelnames)
+
+    def header(self):
+        return [f'# HELP {self.name} {self.documentation}', f'# TYPE {self.name} {self.kind}']
+
+    def reset(self):
+        self._lock = threading.Lock()
+        self._values = {}
+
+    def snapshot(self):
+        """This process's values as JSON-friendly [labels, value] entries"""
+        with self._lock:
+            return [[list(k), v] for k, v in self._values.items()]
+
+
+class Counter(_Metric):
+    kind = 'counter'
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._values = {}
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def render(self, parts):
+        """parts: (worker, snapshot()) of each process, summed"""
+        totals = {}
+        for _, entries in parts:
+            for key, value in entries:
+                totals[tuple(key)] = totals.get(tuple(key), 0) + value
+        return [f'{self.name}{_format_labels(self.labelnames, k)} {_format_value(v)}' for k, v in totals.items()]
+
+
+class Gauge(_Metric):
+    """Gauge set directly or computed on scrape by callbacks returning {labels tuple: value}"""
+    kind = 'gauge'
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._values = {}
+        self._callbacks = []
+
+    def set(self, value, **labels):
+        with self._lock:
+            self._values[self._key(labels)] = value
+
+    def add_callback(self, fn):
+        self._callbacks.append(fn)
+
+    def snapshot(self):
+        with self._lock:
+            values = dict(self._values)
+        for fn in self._callbacks:
+            try:
+                values.update(fn())
+            except Exception as e:
+                print(f"⚠️ Metrics: gauge {self.name} indisponible ({e})")
+        return [[list(k), v] for k, v in values.items()]
+
+    def render(self, parts):
+        """parts: (worker, snapshot()) of each process, one series per worker (no label for a single process)"""
+        lines = []
+        for worker, entries in parts:
+            extra = ('worker', worker) if worker is not None else None
+            lines.extend(f'{self.name}{_format_labels(self.labelnames, key, extra)} {_format_value(value)}'
+                         for key, value in entries)
+        return lines
+
+
+class Histogram(_Metric):
+    kind = 'histogram'
+
+    def __init__(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets)) + (float('inf'),)
+        self._values = {}
+
+    def observe(self, value, **labels):
+        key = self._key(labels)
+        with self._lock:
+            counts, total = self._values.get(key, ([0] * len(self.buckets), 0.0))
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    counts[i] += 1
+            self._values[key] = (counts, total + value)
+
+    def snapshot(self):
+        with self._lock:
+            return [[list(k), list(c), s] for k, (c, s) in self._values.items()]
+
+    def render(self, parts):
+        """parts: (worker, snapshot()) of each process, bucket counts and sums added up"""
+        merged = {}
+        for _, entries in parts:
+            for key, counts, total in entries:
+                previous = merged.get(tuple(key))
+                if previous is not None:
+                    counts = [a + b for a, b in zip(previous[0], counts)]
+                    total += previous[1]
+                merged[tuple(key)] = (counts, total)
+        lines = []
+        for key, (counts, total) in merged.items():
+            for bound, count in zip(self.buckets, counts):
+                le = ('le', _format_value(bound) if bound != float('inf') else '+Inf')
+                lines.append(f'{self.name}_bucket{_format_labels(self.labelnames, key, le)} {count}')
+            lines.append(f'{self.name}_sum{_format_labels(self.labelnames, key)} {_format_value(total)}')
+            lines.append(f'{self.name}_count{_format_labels(self.labelnames, key)} {counts[-1]}')
+        return lines
+
+
+STAGE_SECONDS = Histogram('ai_stage_seconds', 'Processing time per pipeline stage', ('service', 'stage', 'model'))
+REQUESTS = Counter('ai_requests_total', 'HTTP requests by endpoint, model and status', ('service', 'endpoint', 'model', 'status'))
+REQUEST_SECONDS = Histogram('ai_request_seconds', 'HTTP request latency', ('service', 'endpoint'))
+MODEL_LOAD_SECONDS = Histogram('ai_model_load_seconds', 'Model load time', ('service', 'model'))
+MODEL_MEMORY_BYTES = Gauge('ai_model_memory_bytes', 'Approximate resident memory of loaded models', ('service', 'model'))
+QUEUE_DEPTH = Gauge('ai_queue_depth', 'Items waiting in internal queues', ('service', 'queue'))
+TORCH_THREADS = Gauge('ai_torch_threads', 'torch intra-op thread count', ('service',))
+COST_RATIO = Histogram('ai_cost_ratio', 'Measured over predicted inference time (calibration drift)',
+                       ('service', 'model'), buckets=(0.25, 0.5, 0.8, 1, 1.25, 2, 4))
+
+ALL_METRICS = [STAGE_SECONDS, REQUESTS, REQUEST_SECONDS, MODEL_LOAD_SECONDS, MODEL_MEMORY_BYTES, QUEUE_DEPTH, TORCH_THREADS,
+               COST_RATIO]
+
+
+class _Timer:
+    def __init__(self):
+        self.seconds = 0.0
+
+
+@contextmanager
+def stage(name, model=''):
+    """Time a block and record it in ai_stage_seconds; `.seconds` holds the duration"""
+    timer = _Timer()
+    start = time.perf_counter()
+    try:
+        yield timer
+    finally:
+        timer.seconds = time.perf_counter() - start
+        STAGE_SECONDS.observe(timer.seconds, service=_service, stage=name, model=model)
+        _ensure_publisher()
+
+
+class RssSampler:
+    """Samples resident memory in a background thread to find the peak of a run"""
+
+    def __init__(self, interval=0.02):
+        self.interval = interval
+        self.peak = 0
+        self._stop = threading.Event()
+        self._thread = None
+
+    @staticmethod
+    def current():
+        try:
+            with open('/proc/self/statm') as f:
+                return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+        except (OSError, ValueError, AttributeError):
+            pass
+        try:
+            import psutil
+            return psutil.Process().memory_info().rss
+        except ImportError:
+            import resource
+            # ru_maxrss is in KB on Linux, bytes on macOS; lifetime peak only
+            scale = 1 if sys.platform == 'darwin' else 1024
+            return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * scale
+
+    def __enter__(self):
+        self.peak = self.current()
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self._stop.set()
+        self._thread.join()
+        self.peak = max(self.peak, self.current())
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            self.peak = max(self.peak, self.current())
+
+
+def observe_model_load(model, seconds):
+    MODEL_LOAD_SECONDS.observe(seconds, service=_service, model=model)
+
+
+def observe_cost_ratio(model, ratio):
+    COST_RATIO.observe(ratio, service=_service, model=model)
+
+
+def _snapshot(gauges=True):
+    return {metric.name: metric.snapshot() for metric in ALL_METRICS if gauges or metric.kind != 'gauge'}
+
+
+def _alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except OSError:
+        # Exists, owned by someone else
+        pass
+    return True
+
+
+def _collect():
+    """(worker, snapshot) of every process of the server: this one live, the others as last published"""
+    if METRICS_DIR is None:
+        return [(None, _snapshot())]
+    pid = str(os.getpid())
+    parts = [(pid, _snapshot())]
+    try:
+        names = os.listdir(METRICS_DIR)
+    except OSError:
+        names = []
+    gauges = {metric.name for metric in ALL_METRICS if metric.kind == 'gauge'}
+    for name in names:
+        worker, ext = os.path.splitext(name)
+        if ext != '.json' or worker == pid or not worker.isdigit():
+            continue
+        try:
+            with open(os.path.join(METRICS_DIR, name), encoding='utf-8') as f:
+                snapshot = json.load(f)
+        except (OSError, ValueError):
+            continue
+        if not _alive(int(worker)):
+            # Its counts still happened; its gauges went away with it
+            snapshot = {k: v for k, v in snapshot.items() if k not in gauges}
+        parts.append((worker, snapshot))
+    return parts
+
+
+def render():
+    parts = _collect()
+    lines = []
+    for metric in ALL_METRICS:
+        lines.extend(metric.header())
+        lines.extend(metric.render([(worker, snapshot.get(metric.name, [])) for worker, snapshot in parts]))
+    return '\n'.join(lines) + '\n'
+
+
+_publisher_lock = threading.Lock()
+_publisher_pid = None
+_published = None
+
+
+def _publish(gauges=True):
+    """Write this process's values to AI_METRICS_DIR (when they changed)"""
+    global _published
+    if METRICS_DIR is None:
+        return
+    data = json.dumps(_snapshot(gauges))
+    if data == _published:
+        return
+    path = os.path.join(METRICS_DIR, f'{os.getpid()}.json')
+    try:
+        with open(path + '.tmp', 'w', encoding='utf-8') as f:
+            f.write(data)
+        os.replace(path + '.tmp', path)
+        _published = data
+    except OSError as e:
+        print(f"⚠️ Metrics: publication impossible ({e})")
+
+
+def _publish_loop():
+    while True:
+        time.sleep(PUBLISH_SECONDS)
+        _publish()
+
+
+def _ensure_publisher():
+    """Start this process's publishing thread (threads do not survive a fork: checked per pid)"""
+    global _publisher_pid
+    if METRICS_DIR is None or _publisher_pid == os.getpid():
+        return
+    with _publisher_lock:
+        if _publisher_pid != os.getpid():
+            _publisher_pid = os.getpid()
+            threading.Thread(target=_publish_loop, daemon=True, name='metrics-publisher').start()
+
+
+def _after_fork_in_child():
+    global _published, _publisher_lock
+    # The parent's values are its own to publish, not to be counted again by each child
+    for metric in ALL_METRICS:
+        metric.reset()
+    _published = None
+    _publisher_lock = threading.Lock()
+
+
+if METRICS_DIR is not None and hasattr(os, 'register_at_fork'):
+    os.makedirs(METRICS_DIR, exist_ok=True)
+    os.register_at_fork(before=lambda: _publish(gauges=False), after_in_child=_after_fork_in_child)
+
+
+def model_label(model):
+    """Label value for a client-supplied model name: unknown names share 'other'"""
+    if not model or _models is None or model in _models:
+        return model
+    return 'other'
+
+
+def init_app(app, service, registry=None, queues=None, models=None):
+    """
+    Instrument a Flask app: request metrics, gauges and the /metrics endpoint.
+    `models` lists the model names the request counter may carry as labels.
+    """
+    global _service, _models
+    _service = service
+    _models = frozenset(models) if models is not None else None
+
+    if registry is not None:
+        MODEL_MEMORY_BYTES.add_callback(lambda: {
+            (service, model): size_mb * 1024 * 1024 for model, size_mb in registry.memory_by_model().items()
+        })
+
+    for queue_name, depth_fn in (queues or {}).items():
+        QUEUE_DEPTH.add_callback(lambda q=queue_name, fn=depth_fn: {(service, q): fn()})
+
+    def torch_threads():
+        # Only reported once torch has been imported by the server
+        torch = sys.modules.get('torch')
+        return {(service,): torch.get_num_threads()} if torch else {}
+
+    TORCH_THREADS.add_callback(torch_threads)
+
+    @app.before_request
+    def _start_timer():
+        g.metrics_start = time.perf_counter()
+
+    @app.after_request
+    def _record_request(response):
+        if request.endpoint == 'metrics':
+            return response
+        endpoint = request.url_rule.rule if request.url_rule else 'unknown'
+        model = ''
+        if request.method == 'POST':
+            try:
+                model = model_label(request.form.get('model', ''))
+            except HTTPException:
+                # Body refused unread (e.g. 413 on its Content-Length)
+                pass
+        REQUESTS.inc(service=service, endpoint=endpoint, model=model, status=response.status_code)
+        if 'metrics_start' in g:
+            REQUEST_SECONDS.observe(time.perf_counter() - g.metrics_start, service=service, endpoint=endpoint)
+        _ensure_publisher()
+        return response
+
+    @app.route('/metrics', methods=['GET'])
+    def metrics():
+        return Response(render(), mimetype='text/plain; version=0.0.4')
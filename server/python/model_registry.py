@@ -0,0 +1,203 @@
+"""
+Model registry shared by the AI servers (rembg, whisper, upscale).
+Keeps loaded models in LRU order under a RAM budget, unloads idle models,
+and makes sure concurrent first requests for a model trigger a single load.
+
+Configuration (per server process):
+  AI_MODEL_MEMORY_MB      RAM budget for resident models, 0 = unlimited
+  AI_MODEL_IDLE_SECONDS   unload models unused for this long, 0 = never
+"""
+import gc
+import os
+import threading
+import time
+from collections import OrderedDict
+
+import metrics
+
+
+def _env_float(name, default):
+    try:
+        return float(os.environ.get(name, default))
+    except ValueError:
+        return default
+
+
+def estimate_size_mb(model):
+    """Approximate resident size of a torch module (parameters + buffers), None if unknown"""
+    if hasattr(model, 'size_mb'):
+        return model.size_mb()
+    tensors = []
+    if hasattr(model, 'parameters'):
+        tensors.extend(model.parameters())
+    if hasattr(model, 'buffers'):
+        tensors.extend(model.buffers())
+    if not tensors:
+        return None
+    return sum(t.numel() * t.element_size() for t in tensors) / (1024 * 1024)
+
+
+class _Entry:
+    __slots__ = ('model', 'size_mb', 'last_used', 'load_seconds')
+
+    def __init__(self, model, size_mb, load_seconds):
+        self.model = model
+        self.size_mb = size_mb
+        self.load_seconds = load_seconds
+        self.last_used = time.monotonic()
+
+
+class ModelRegistry:
+    """LRU cache of loaded models bounded by an approximate memory budget"""
+
+    def __init__(self, name, budget_mb=None, idle_seconds=None):
+        self.name = name
+        self.budget_mb = budget_mb if budget_mb is not None else _env_float('AI_MODEL_MEMORY_MB', 0)
+        self.idle_seconds = idle_seconds if idle_seconds is not None else _env_float('AI_MODEL_IDLE_SECONDS', 0)
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self._load_locks = {}
+        self._reaper_pid = None
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, key, loader, size_mb=None):
+        """
+        Return the model for `key`, calling `loader()` on a miss.
+        `size_mb` is the expected footprint, used to make room before loading;
+        the real size is measured after loading when possible.
+        """
+        self._ensure_reaper()
+        model = self._lookup(key)
+        if model is not None:
+            return model
+
+        with self._lock:
+            load_lock = self._load_locks.setdefault(key, threading.Lock())
+
+        # Single flight: concurrent first requests wait for the same load
+        with load_lock:
+            model = self._lookup(key)
+            if model is not None:
+                return model
+
+            with self._lock:
+                self.misses += 1
+                evicted = self._evict_for(size_mb) if size_mb else False
+            if evicted:
+                gc.collect()
+
+            start = time.monotonic()
+            model = loader()
+            load_seconds = time.monotonic() - start
+            metrics.observe_model_load(self._label(key), load_seconds)
+            measured = estimate_size_mb(model)
+
+            with self._lock:
+                entry = _Entry(model, measured or size_mb or 0, load_seconds)
+                self._entries[key] = entry
+                evicted = self._evict_for(0, keep=key)
+            if evicted:
+                gc.collect()
+            print(f"📦 [{self.name}] Modèle {self._label(key)} chargé en {load_seconds:.1f}s "
+                  f"(~{entry.size_mb:.0f}MB, total {self.resident_mb():.0f}MB)")
+            return model
+
+    def peek(self, key):
+        """Return the model if it is resident, without loading or touching LRU order"""
+        with self._lock:
+            entry = self._entries.get(key)
+            return entry.model if entry else None
+
+    def unload(self, key):
+        with self._lock:
+            removed = self._entries.pop(key, None) is not None
+        # Outside the lock: a full collection must not stall the other requests' lookups
+        if removed:
+            gc.collect()
+        return removed
+
+    def memory_by_model(self):
+        with self._lock:
+            return {self._label(k): e.size_mb for k, e in self._entries.items()}
+
+    def resident_mb(self):
+        return sum(e.size_mb for e in self._entries.values())
+
+    def stats(self):
+        with self._lock:
+            now = time.monotonic()
+            return {
+                'budget_mb': self.budget_mb,
+                'resident_mb': round(self.resident_mb(), 1),
+                'idle_unload_seconds': self.idle_seconds,
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'loaded': [
+                    {
+                        'model': self._label(key),
+                        'size_mb': round(e.size_mb, 1),
+                        'load_seconds': round(e.load_seconds, 2),
+                        'idle_seconds': round(now - e.last_used, 1)
+                    }
+                    for key, e in self._entries.items()
+                ]
+            }
+
+    def _lookup(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            self._entries.move_to_end(key)
+            entry.last_used = time.monotonic()
+            self.hits += 1
+            return entry.model
+
+    def _evict_for(self, incoming_mb, keep=None):
+        """
+        Evict least recently used models until incoming_mb fits the budget (lock held).
+        Returns whether anything was evicted: the caller runs gc.collect() once the lock is released.
+        """
+        if not self.budget_mb:
+            return False
+        evicted = False
+        for key in list(self._entries):
+            if self.resident_mb() + incoming_mb <= self.budget_mb:
+                break
+            if key == keep:
+                continue
+            entry = self._entries.pop(key)
+            self.evictions += 1
+            evicted = True
+            print(f"♻️ [{self.name}] Déchargement de {self._label(key)} (~{entry.size_mb:.0f}MB, budget {self.budget_mb:.0f}MB)")
+        return evicted
+
+    def _ensure_reaper(self):
+        # Started lazily and per process so it survives a fork of the server
+        if not self.idle_seconds or self._reaper_pid == os.getpid():
+            return
+        self._reaper_pid = os.getpid()
+        threading.Thread(target=self._reap_idle, daemon=True, name=f"{self.name}-reaper").start()
+
+    def _reap_idle(self):
+        interval = max(min(self.idle_seconds / 2, 60), 1)
+        while True:
+            time.sleep(interval)
+            now = time.monotonic()
+            with self._lock:
+                idle = [k for k, e in self._entries.items() if now - e.last_used > self.idle_seconds]
+                for key in idle:
+                    self._entries.pop(key)
+                    self.evictions += 1
+                    print(f"💤 [{self.name}] Déchargement de {self._label(key)} (inactif)")
+            if idle:
+                gc.collect()
+
+    @staticmethod
+    def _label(key):
+        if isinstance(key, tuple):
+            return '-'.join(str(k) for k in key)
+        return str(key)
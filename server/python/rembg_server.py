@@ -19,8 +19,8 @@ os.environ['ORT_DISABLE_ALL_CUDA'] = '1'
 
 from flask import Flask, request, send_file, jsonify
 from flask_cors import CORS
-import sys
 import io
+import zipfile
 
 # Force UTF-8 for Windows console
 # if sys.platform == 'win32':
@@ -28,42 +28,240 @@ import io
 #     sys.stdout = codecs.getwriter("utf-8")(sys.stdout.detach())
 #     sys.stderr = codecs.getwriter("utf-8")(sys.stderr.detach())
 
-try:
-    from rembg import remove, new_session
-    from PIL import Image
-except ImportError as e:
-    print(f"Erreur import: {e}")
-    print("Installez: pip install rembg flask flask-cors pillow")
-    sys.exit(1)
-
-import torch
-# Optimize CPU threads - allow override via env
-num_cores = os.cpu_count() or 4
-env_threads = os.environ.get('AI_THREADS')
-if env_threads:
-    try:
-        torch.set_num_threads(int(env_threads))
-        print(f"🧵 Thread count set from AI_THREADS: {env_threads}")
-    except ValueError:
-        torch.set_num_threads(num_cores)
-else:
-    torch.set_num_threads(num_cores)
+from PIL import Image
+import numpy as np
+
+from batching import MicroBatcher
+from model_registry import ModelRegistry
+from result_cache import ResultCache, make_key
+from image_io import encode, encode_animation, parse_output_format, stream_response
+from mask_refine import work_image, guided_upsample, DEFAULT_WORK_SIZE
+from warmup import Warmup, register_ready_route
+from cpu_scheduler import CpuScheduler
+import frames as frame_seq
+import metrics
 
 app = Flask(__name__)
 CORS(app)
 
 MAX_SIZE_MB = 10
-ALLOWED_EXTENSIONS = {'png', 'jpg', 'jpeg', 'webp', 'gif', 'bmp'}
+ALLOWED_EXTENSIONS = {'png', 'jpg', 'jpeg', 'webp', 'gif', 'bmp'} | frame_seq.VIDEO_EXTENSIONS
+# Videos (decoded by ffmpeg, single /remove only) get a larger limit
+MAX_VIDEO_SIZE_MB = int(os.environ.get('REMBG_MAX_VIDEO_MB', 50))
+
+MAX_BATCH_FILES = 50
+
+# Micro-batching: concurrent requests for the same model share one ONNX run
+BATCH_SIZE = int(os.environ.get('REMBG_BATCH_SIZE', 8))
+BATCH_WAIT_MS = float(os.environ.get('REMBG_BATCH_WAIT_MS', 10))
+
+# Mask refinement: 'none' resizes the network mask to full size, 'guided' runs
+# the network on a copy downscaled to REMBG_WORK_SIZE and refines the mask
+# against the full-resolution image
+REFINE_MODES = ('none', 'guided')
+DEFAULT_REFINE = os.environ.get('REMBG_REFINE', 'none')
+WORK_SIZE = int(os.environ.get('REMBG_WORK_SIZE', DEFAULT_WORK_SIZE))
+
+# Preprocessing used by rembg's own predict(): (mean, std, input size)
+BATCH_NORMALIZATION = {
+    'u2net': ((0.485, 0.456, 0.406), (0.229, 0.224, 0.225), (320, 320)),
+    'u2netp': ((0.485, 0.456, 0.406), (0.229, 0.224, 0.225), (320, 320)),
+    'u2net_human_seg': ((0.485, 0.456, 0.406), (0.229, 0.224, 0.225), (320, 320)),
+    'silueta': ((0.485, 0.456, 0.406), (0.229, 0.224, 0.225), (320, 320)),
+    'isnet-general-use': ((0.5, 0.5, 0.5), (1.0, 1.0, 1.0), (1024, 1024)),
+}
 
-# Global sessions cache
-sessions = {}
+# Approximate resident size of each ONNX session
+MODEL_SIZES_MB = {
+    'u2net': 350,
+    'u2netp': 20,
+    'u2net_human_seg': 350,
+    'isnet-general-use': 360,
+    'silueta': 90
+}
+
+# Global sessions cache (LRU under AI_MODEL_MEMORY_MB)
+registry = ModelRegistry('rembg')
+
+# Cached outputs, next to the models folder (models/cache/rembg)
+result_cache = ResultCache(os.path.join(os.path.dirname(MODELS_DIR), "cache", "rembg"))
+
+
+def import_rembg():
+    """rembg (onnxruntime, pymatting/numba) takes seconds to import: loaded on first use"""
+    try:
+        import rembg.bg
+    except ImportError as e:
+        print(f"Erreur import: {e}")
+        print("Installez: pip install rembg flask flask-cors pillow")
+        raise
+    return rembg.bg
 
 
 def get_session(model_name):
-    if model_name not in sessions:
+    def load():
+        import_rembg()
+        from rembg import new_session
         print(f"Initialisation de la session pour le modele: {model_name}...")
-        sessions[model_name] = new_session(model_name, providers=["CPUExecutionProvider"])
-    return sessions[model_name]
+        return new_session(model_name, providers=["CPUExecutionProvider"])
+
+    return registry.get(model_name, load, size_mb=MODEL_SIZES_MB.get(model_name, 350))
+
+
+def supports_batching(model_name, session):
+    """True when the model has known preprocessing and a dynamic batch axis"""
+    if model_name not in BATCH_NORMALIZATION:
+        return False
+    batch_dim = session.inner_session.get_inputs()[0].shape[0]
+    return not isinstance(batch_dim, int)
+
+
+def predict_masks(model_name, images):
+    """Segmentation masks for a list of PIL images, in one ONNX run when possible"""
+    session = get_session(model_name)
+    if len(images) == 1 or not supports_batching(model_name, session):
+        with cpu_scheduler.slot(model_name, cost=len(images)), metrics.stage('inference', model_name):
+            return [session.predict(img)[0] for img in images]
+
+    mean, std, size = BATCH_NORMALIZATION[model_name]
+    input_name = session.inner_session.get_inputs()[0].name
+    with metrics.stage('prep', model_name):
+        inputs = np.concatenate([session.normalize(img, mean, std, size)[input_name] for img in images])
+    with cpu_scheduler.slot(model_name, cost=len(images)), metrics.stage('inference', model_name):
+        preds = session.inner_session.run(None, {input_name: inputs})[0][:, 0, :, :]
+
+    masks = []
+    for img, pred in zip(images, preds):
+        # Same per-image min/max normalization as rembg's predict()
+        ma, mi = np.max(pred), np.min(pred)
+        pred = (pred - mi) / (ma - mi)
+        mask = Image.fromarray((pred.clip(0, 1) * 255).astype("uint8"), mode="L")
+        masks.append(mask.resize(img.size, Image.Resampling.LANCZOS))
+    return masks
+
+
+def load_image(data):
+    """Decode an upload the way rembg.remove() does (EXIF orientation applied)"""
+    with metrics.stage('decode'):
+        img = Image.open(io.BytesIO(data))
+        img.load()
+        return import_rembg().fix_image_orientation(img)
+
+
+def submit_mask(model_name, img, refine):
+    """Queue mask inference (on a downscaled copy in 'guided' mode), returns (future, inference image)"""
+    small = work_image(img, WORK_SIZE) if refine == 'guided' else img
+    return batcher.submit(model_name, small), small
+
+
+def full_mask(img, small, mask):
+    """Mask at the size of img from the mask computed on small"""
+    if small is img:
+        return mask
+    with metrics.stage('refine'):
+        return guided_upsample(mask, small, img)
+
+
+def cache_params(model_name, refine, output, animated=False):
+    params = {'op': 'remove', 'model': model_name, **output.cache_params()}
+    if refine != 'none':
+        params.update(refine=refine, work_size=WORK_SIZE)
+    if animated:
+        params.update(frames=frame_seq.MAX_FRAMES, pixels=frame_seq.MAX_PIXELS, reuse=frame_seq.FRAME_REUSE)
+    return params
+
+
+def cutout(img, mask):
+    with metrics.stage('cutout'):
+        return import_rembg().naive_cutout(img, mask)
+
+
+def sequence_kind(filename, data):
+    """'video', 'animation' (animated GIF/WebP/PNG) or None for a still image"""
+    if frame_seq.is_video(filename):
+        return 'video'
+    try:
+        return 'animation' if getattr(Image.open(io.BytesIO(data)), 'is_animated', False) else None
+    except Exception:
+        # Unreadable: left to load_image for the error message
+        return None
+
+
+def load_frames(filename, data, kind):
+    """(frames, loop) of a video or an animated image, frames yielding (frame, duration in ms) as decoded"""
+    if kind == 'video':
+        return frame_seq.video_frames(data, os.path.splitext(filename)[1] or '.mp4'), 0
+    img = Image.open(io.BytesIO(data))
+    return frame_seq.animation_frames(img), img.info.get('loop', 0)
+
+
+def remove_frames(frames, model_name, refine):
+    """
+    Cutouts of a frame stream of (frame, duration) pairs. The model only runs on the keyframes,
+    the other frames reuse or propagate the last keyframe's mask. Frames wait in chunks for
+    their keyframes' masks (one batch per chunk) and are released once cut out.
+    Returns (cutouts, durations, counts per action).
+    """
+    planner = frame_seq.Planner()
+    counts = {'infer': 0, 'reuse': 0, 'propagate': 0}
+    cutouts, durations, pending = [], [], []
+    key_mask = None
+
+    def emit(frame, action):
+        mask = key_mask
+        if action == 'propagate':
+            with metrics.stage('propagate', model_name):
+                mask = frame_seq.propagate(key_mask, frame)
+        cutouts.append(cutout(frame, mask))
+
+    def flush():
+        nonlocal key_mask
+        keys = [frame for frame, action in pending if action == 'infer']
+        smalls = [work_image(frame, WORK_SIZE) if refine == 'guided' else frame for frame in keys]
+        futures = batcher.submit_many(model_name, smalls)
+        masks = (full_mask(frame, small, future.result()) for frame, small, future in zip(keys, smalls, futures))
+        for frame, action in pending:
+            if action == 'infer':
+                key_mask = next(masks)
+            emit(frame, action)
+        pending.clear()
+
+    frames = iter(frames)
+    while True:
+        with metrics.stage('decode'):
+            item = next(frames, None)
+        if item is None:
+            break
+        frame, duration = item
+        durations.append(duration)
+        with metrics.stage('frame_diff', model_name):
+            action = planner.next(frame)
+        counts[action] += 1
+        if action != 'infer' and not pending:
+            # Its keyframe's mask is already known
+            emit(frame, action)
+            continue
+        pending.append((frame, action))
+        if len(pending) >= frame_seq.FRAME_CHUNK:
+            flush()
+    flush()
+    return cutouts, durations, counts
+
+
+# Decoding and encoding stay on the request threads, only inference is batched
+batcher = MicroBatcher(predict_masks, max_batch_size=BATCH_SIZE, max_wait_ms=BATCH_WAIT_MS)
+
+# ONNX sessions keep their thread count: the scheduler bounds concurrent runs across models
+cpu_scheduler = CpuScheduler('rembg')
+
+# Prometheus metrics on /metrics
+metrics.init_app(app, 'rembg', registry=registry, queues={'batch': batcher.depth, 'cpu': cpu_scheduler.depth},
+                 models=MODEL_SIZES_MB)
+
+
+# Imports and default session in the background: the port is bound right away
+warmup = Warmup('rembg').add('imports', import_rembg).add('u2net', lambda: get_session('u2net'))
+register_ready_route(app, warmup)
 
 
 def allowed_file(filename):
@@ -72,49 +270,203 @@ def allowed_file(filename):
 
 @app.route('/health', methods=['GET'])
 def health_check():
-    return jsonify({'status': 'ok', 'service': 'rembg'})
+    return jsonify({
+        'status': 'ok',
+        'service': 'rembg',
+        'ready': warmup.ready,
+        'batching': batcher.stats(),
+        'models': registry.stats(),
+        'cache': result_cache.stats(),
+        'scheduler': cpu_scheduler.stats()
+    })
 
 
-@app.route('/remove', methods=['POST'])
-def remove_background():
-    if 'file' not in request.files:
-        return jsonify({'error': 'Aucun fichier fourni'}), 400
+# Cutouts need an alpha channel: no JPEG
+OUTPUT_FORMATS = ('png', 'webp')
 
-    file = request.files['file']
-    model_name = request.form.get('model', 'u2net')
-    
+
+def parse_model(form):
+    """Model from the form, returns (model, error message); unknown names never reach the batcher"""
+    model_name = form.get('model', 'u2net') or 'u2net'
+    if model_name not in MODEL_SIZES_MB:
+        return None, f"Modele inconnu: {model_name} ({', '.join(MODEL_SIZES_MB)})"
+    return model_name, None
+
+
+def parse_refine(form):
+    """Refinement mode from the form, returns (mode, error message)"""
+    refine = form.get('refine', DEFAULT_REFINE) or 'none'
+    if refine not in REFINE_MODES:
+        return None, f"Mode de raffinement inconnu: {refine} ({', '.join(REFINE_MODES)})"
+    return refine, None
+
+
+def check_upload(file, allow_video=False):
+    """Validate one uploaded image (or video), returns an error message or None"""
     if file.filename == '':
-        return jsonify({'error': 'Nom de fichier vide'}), 400
+        return 'Nom de fichier vide'
 
     if not allowed_file(file.filename):
-        return jsonify({'error': 'Extension non autorisee'}), 400
+        return 'Extension non autorisee'
+
+    video = frame_seq.is_video(file.filename)
+    if video and not allow_video:
+        return 'Videos non supportees en lot'
 
     file.seek(0, os.SEEK_END)
     size_mb = file.tell() / (1024 * 1024)
     file.seek(0)
-    
-    if size_mb > MAX_SIZE_MB:
-        return jsonify({'error': f'Fichier trop volumineux ({size_mb:.1f}MB)'}), 400
+
+    if size_mb > (MAX_VIDEO_SIZE_MB if video else MAX_SIZE_MB):
+        return f'Fichier trop volumineux ({size_mb:.1f}MB)'
+    return None
+
+
+@app.route('/remove', methods=['POST'])
+def remove_background():
+    if 'file' not in request.files:
+        return jsonify({'error': 'Aucun fichier fourni'}), 400
+
+    file = request.files['file']
+    model_name, error = parse_model(request.form)
+    if error:
+        return jsonify({'error': error}), 400
+    refine, error = parse_refine(request.form)
+    if error:
+        return jsonify({'error': error}), 400
+    output, error = parse_output_format(request.form, OUTPUT_FORMATS)
+    if error:
+        return jsonify({'error': error}), 400
+
+    error = check_upload(file, allow_video=True)
+    if error:
+        return jsonify({'error': error}), 400
 
     try:
         input_data = file.read()
-        print(f"Traitement de {file.filename} avec le modele {model_name} sur CPU...")
-        
-        # Use specific model session
-        session = get_session(model_name)
-        output_data = remove(input_data, session=session)
-        
-        output_buffer = io.BytesIO(output_data)
-        output_buffer.seek(0)
-        
-        print(f"Arriere-plan supprime avec {model_name}!")
-        
-        return send_file(
-            output_buffer,
-            mimetype='image/png',
+        kind = sequence_kind(file.filename, input_data)
+        cache_key = make_key(input_data, **cache_params(model_name, refine, output, animated=kind is not None))
+        output_data = result_cache.get(cache_key)
+        download_name = f"nobg-{os.path.splitext(file.filename)[0]}.{output.extension}"
+
+        if output_data is None and kind is not None:
+            frames, loop = load_frames(file.filename, input_data, kind)
+            print(f"Traitement de {file.filename} avec le modele {model_name} sur CPU...")
+            cutouts, durations, counts = remove_frames(frames, model_name, refine)
+            print(f"Arriere-plan supprime sur {len(cutouts)} images "
+                  f"({counts['infer']} inferences, {counts['reuse']} reprises, {counts['propagate']} propagations)")
+
+            # Animated PNG / WebP, built in one piece from the cutouts: no streaming
+            output_data = encode_animation(cutouts, output, durations, loop)
+            result_cache.put(cache_key, output_data)
+            response = send_file(
+                io.BytesIO(output_data),
+                mimetype=output.mimetype,
+                as_attachment=True,
+                download_name=download_name
+            )
+            response.headers['X-Cache'] = 'MISS'
+            response.headers['X-Frames'] = str(len(cutouts))
+            response.headers['X-Frames-Inferred'] = str(counts['infer'])
+            response.headers['X-Frames-Reused'] = str(counts['reuse'])
+            response.headers['X-Frames-Propagated'] = str(counts['propagate'])
+            return response
+
+        if output_data is None:
+            img = load_image(input_data)
+            print(f"Traitement de {file.filename} avec le modele {model_name} sur CPU...")
+
+            # Queued with concurrent requests for the same model session
+            future, small = submit_mask(model_name, img, refine)
+            mask = full_mask(img, small, future.result())
+            print(f"Arriere-plan supprime avec {model_name}!")
+
+            # Sent while it is being encoded, cached once complete
+            response = stream_response(cutout(img, mask), output, download_name,
+                                       on_complete=lambda data: result_cache.put(cache_key, data))
+            response.headers['X-Cache'] = 'MISS'
+            return response
+
+        print(f"Resultat en cache pour {file.filename} ({model_name})")
+        response = send_file(
+            io.BytesIO(output_data),
+            mimetype=output.mimetype,
+            as_attachment=True,
+            download_name=download_name
+        )
+        response.headers['X-Cache'] = 'HIT'
+        return response
+
+    except Exception as e:
+        print(f"Erreur: {str(e)}")
+        return jsonify({'error': f'Erreur de traitement: {str(e)}'}), 500
+
+
+@app.route('/remove/batch', methods=['POST'])
+def remove_background_batch():
+    files = request.files.getlist('files')
+    model_name, error = parse_model(request.form)
+    if error:
+        return jsonify({'error': error}), 400
+    refine, error = parse_refine(request.form)
+    if error:
+        return jsonify({'error': error}), 400
+    output, error = parse_output_format(request.form, OUTPUT_FORMATS)
+    if error:
+        return jsonify({'error': error}), 400
+
+    if not files:
+        return jsonify({'error': 'Aucun fichier fourni'}), 400
+
+    if len(files) > MAX_BATCH_FILES:
+        return jsonify({'error': f'Trop de fichiers (max {MAX_BATCH_FILES})'}), 400
+
+    for file in files:
+        error = check_upload(file)
+        if error:
+            return jsonify({'error': f'{file.filename}: {error}'}), 400
+
+    try:
+        print(f"Traitement par lot de {len(files)} images avec le modele {model_name}...")
+        payloads = [file.read() for file in files]
+        keys = [make_key(data, **cache_params(model_name, refine, output)) for data in payloads]
+        cached = [result_cache.get(key) for key in keys]
+
+        # Only the images missing from the cache go through the model
+        images = [load_image(data) if out is None else None for data, out in zip(payloads, cached)]
+        submitted = [submit_mask(model_name, img, refine) if img is not None else (None, None) for img in images]
+
+        # PNG/WebP output is already compressed: store it as is in the archive
+        archive = io.BytesIO()
+        with zipfile.ZipFile(archive, 'w', zipfile.ZIP_STORED) as zf:
+            used_names = set()
+            counters = {}
+            for file, img, (future, small), key, output_data in zip(files, images, submitted, keys, cached):
+                stem = os.path.splitext(file.filename)[0]
+                name = f"nobg-{stem}.{output.extension}"
+                # Numbered per stem until free: "x.png" twice and "1-x.png" must not share an entry
+                while name in used_names:
+                    counters[stem] = counters.get(stem, 0) + 1
+                    name = f"nobg-{counters[stem]}-{stem}.{output.extension}"
+                used_names.add(name)
+                if output_data is None:
+                    output_data = encode(cutout(img, full_mask(img, small, future.result())), output)
+                    result_cache.put(key, output_data)
+                zf.writestr(name, output_data)
+        archive.seek(0)
+
+        print(f"Lot termine: {len(files)} images avec {model_name}!")
+
+        response = send_file(
+            archive,
+            mimetype='application/zip',
             as_attachment=True,
-            download_name=f"nobg-{os.path.splitext(file.filename)[0]}.png"
+            download_name='nobg-batch.zip'
         )
+        hits = sum(1 for out in cached if out is not None)
+        response.headers['X-Cache'] = 'HIT' if hits == len(files) else 'MISS'
+        response.headers['X-Cache-Hits'] = str(hits)
+        return response
 
     except Exception as e:
         print(f"Erreur: {str(e)}")
@@ -126,6 +478,15 @@ def get_info():
     return jsonify({
         'service': 'REMBG Background Remover (CPU)',
         'max_size_mb': MAX_SIZE_MB,
+        'max_video_size_mb': MAX_VIDEO_SIZE_MB,
+        'max_frames': frame_seq.MAX_FRAMES,
+        'max_megapixels': frame_seq.MAX_PIXELS / 1_000_000,
+        'frame_reuse': frame_seq.FRAME_REUSE,
+        'video_extensions': sorted(frame_seq.VIDEO_EXTENSIONS),
+        'max_batch_files': MAX_BATCH_FILES,
+        'refine_modes': list(REFINE_MODES),
+        'default_refine': DEFAULT_REFINE,
+        'output_formats': list(OUTPUT_FORMATS),
         'allowed_extensions': list(ALLOWED_EXTENSIONS),
         'status': 'ready',
         'available_models': [
@@ -140,6 +501,6 @@ def get_info():
 
 if __name__ == '__main__':
     print("REMBG Server (CPU) starting on http://localhost:5100")
-    # Pre-load default model for instant use
-    get_session('u2net')
+    # Default model loaded in the background, /ready tells when it is done
+    warmup.start()
     app.run(host='0.0.0.0', port=5100, debug=False)
@@ -0,0 +1,241 @@
+"""
+Content-addressed result cache shared by the AI servers.
+Outputs are stored on disk under a key derived from the input bytes and the
+processing parameters, with size-bounded LRU eviction.
+The worker processes of a server share the directory: every new entry re-reads
+it (sizes, and recency from the mtimes that reads refresh) under a file lock
+before evicting, so the budget holds for the server as a whole.
+
+Configuration:
+  AI_RESULT_CACHE_MB   maximum cache size on disk per service, 0 = disabled
+"""
+import hashlib
+import json
+import os
+import tempfile
+import threading
+from collections import OrderedDict
+from contextlib import contextmanager
+
+try:
+    import fcntl
+except ImportError:
+    # Windows: the servers run as a single process there
+    fcntl = None
+
+DEFAULT_MAX_MB = 1024
+SUFFIX = '.bin'
+LOCK_NAME = '.lock'
+
+
+@contextmanager
+def _dir_lock(directory):
+    """Exclusive lock shared by every process using the directory"""
+    if fcntl is None:
+        yield
+        return
+    with open(os.path.join(directory, LOCK_NAME), 'a') as f:
+        fcntl.flock(f, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(f, fcntl.LOCK_UN)
+
+
+def make_key(data, **params):
+    """
+    sha256 over the input and the (sorted) processing parameters. The input is
+    bytes or a seekable file, hashed from the start in chunks and rewound.
+    """
+    if hasattr(data, 'read'):
+        data.seek(0)
+        digest = hashlib.sha256()
+        for chunk in iter(lambda: data.read(1024 * 1024), b''):
+            digest.update(chunk)
+        data.seek(0)
+    else:
+        digest = hashlib.sha256(data)
+    digest.update(json.dumps(params, sort_keys=True, default=str).encode('utf-8'))
+    return digest.hexdigest()
+
+
+class ResultCache:
+    """Disk-backed LRU cache of processing results"""
+
+    def __init__(self, directory, max_mb=None):
+        if max_mb is None:
+            try:
+                max_mb = float(os.environ.get('AI_RESULT_CACHE_MB', DEFAULT_MAX_MB))
+            except ValueError:
+                max_mb = DEFAULT_MAX_MB
+        self.directory = directory
+        self.max_bytes = int(max_mb * 1024 * 1024)
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self._index = OrderedDict()
+        self._total = 0
+        if self.enabled:
+            os.makedirs(directory, exist_ok=True)
+            self._load_index()
+
+    @property
+    def enabled(self):
+        return self.max_bytes > 0
+
+    def get(self, key):
+        """Cached bytes for key, or None"""
+        f = self.open(key)
+        if f is None:
+            return None
+        with f:
+            return f.read()
+
+    def open(self, key):
+        """Cached entry as a binary file to read in chunks (the caller closes it), or None"""
+        if not self.enabled:
+            return None
+        path = self._path(key)
+        try:
+            f = open(path, 'rb')
+            size = os.fstat(f.fileno()).st_size
+            os.utime(path)
+        except OSError:
+            with self._lock:
+                self._forget(key)
+                self.misses += 1
+            return None
+        with self._lock:
+            if key not in self._index:
+                self._index[key] = size
+                self._total += size
+            self._index.move_to_end(key)
+            self.hits += 1
+        return f
+
+    def put(self, key, data):
+        """Store bytes atomically (write to a temp file, then rename)"""
+        if not self.enabled or len(data) > self.max_bytes:
+            return
+        writer = self.writer(key)
+        writer.write(data)
+        writer.commit()
+
+    def writer(self, key):
+        """Incremental put(): write() the entry chunk by chunk, then commit() (or abort())"""
+        return _Writer(self, key)
+
+    def stats(self):
+        return {
+            'enabled': self.enabled,
+            'entries': len(self._index),
+            'size_mb': round(self._total / (1024 * 1024), 1),
+            'max_mb': round(self.max_bytes / (1024 * 1024), 1),
+            'hits': self.hits,
+            'misses': self.misses
+        }
+
+    def _path(self, key):
+        return os.path.join(self.directory, key + SUFFIX)
+
+    def _load_index(self):
+        # Before the workers are forked: leftovers of interrupted writes can go
+        for name in os.listdir(self.directory):
+            if name.endswith('.tmp'):
+                try:
+                    os.unlink(os.path.join(self.directory, name))
+                except OSError:
+                    pass
+        with self._lock, _dir_lock(self.directory):
+            self._sync()
+            self._evict()
+
+    def _sync(self):
+        """Index rebuilt from the directory, oldest first: it includes the other processes' entries"""
+        entries = []
+        for name in os.listdir(self.directory):
+            if not name.endswith(SUFFIX):
+                continue
+            try:
+                st = os.stat(os.path.join(self.directory, name))
+            except OSError:
+                continue
+            entries.append((st.st_mtime, name[:-len(SUFFIX)], st.st_size))
+        self._index = OrderedDict((key, size) for _, key, size in sorted(entries))
+        self._total = sum(self._index.values())
+
+    def _added(self):
+        with self._lock, _dir_lock(self.directory):
+            self._sync()
+            self._evict()
+
+    def _forget(self, key):
+        size = self._index.pop(key, None)
+        if size is not None:
+            self._total -= size
+
+    def _evict(self):
+        while self._total > self.max_bytes and self._index:
+            key, size = self._index.popitem(last=False)
+            self._total -= size
+            try:
+                os.unlink(self._path(key))
+            except OSError:
+                pass
+
+
+class _Writer:
+    """Entry written to a temp file as it comes, renamed into place by commit()"""
+
+    def __init__(self, cache, key):
+        self.cache = cache
+        self.key = key
+        self.size = 0
+        self.file = None
+        self.tmp_path = None
+        if cache.enabled:
+            try:
+                fd, self.tmp_path = tempfile.mkstemp(dir=cache.directory, suffix='.tmp')
+                self.file = os.fdopen(fd, 'wb')
+            except OSError as e:
+                print(f"⚠️ Cache: écriture impossible ({e})")
+
+    def write(self, data):
+        if self.file is None:
+            return
+        self.size += len(data)
+        if self.size > self.cache.max_bytes:
+            # Larger than the whole cache: not worth keeping
+            self.abort()
+            return
+        try:
+            self.file.write(data)
+        except OSError as e:
+            print(f"⚠️ Cache: écriture impossible ({e})")
+            self.abort()
+
+    def commit(self):
+        """True once the entry is in the cache"""
+        if self.file is None:
+            return False
+        try:
+            self.file.close()
+            self.file = None
+            os.replace(self.tmp_path, self.cache._path(self.key))
+        except OSError as e:
+            print(f"⚠️ Cache: écriture impossible ({e})")
+            self.abort()
+            return False
+        self.cache._added()
+        return True
+
+    def abort(self):
+        if self.file is not None:
+            self.file.close()
+            self.file = None
+        if self.tmp_path:
+            try:
+                os.unlink(self.tmp_path)
+            except OSError:
+                pass
+            self.tmp_path = None
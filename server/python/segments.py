@@ -0,0 +1,76 @@
+"""
+Segments of a Whisper result: JSON-ready formatting (with optional word
+timestamps) and SRT / WebVTT rendering of a finished transcription.
+"""
+import textwrap
+
+SUBTITLE_FORMATS = {
+    'srt': 'application/x-subrip',
+    'vtt': 'text/vtt'
+}
+# Usual subtitle line length: longer cue texts are wrapped
+LINE_WIDTH = 42
+
+
+def words_enabled(value=None):
+    return str(value or '').lower() in ('1', 'true', 'yes', 'on')
+
+
+def _shift(t, offset, cut):
+    return round(offset + (min(t, cut) if cut is not None else t), 2)
+
+
+def clean_segments(raw, offset=0.0, cut=None, first_id=0):
+    """
+    Segments of a Whisper result as {id, start, end, text[, words]}, times shifted by
+    offset and clamped to cut (seconds into the transcribed audio).
+    """
+    segments = []
+    for i, seg in enumerate(raw):
+        segment = {
+            'id': first_id + i,
+            'start': round(offset + seg['start'], 2),
+            'end': _shift(seg['end'], offset, cut),
+            'text': seg['text'].strip()
+        }
+        if 'words' in seg:
+            # Present when transcribed with word_timestamps=True
+            segment['words'] = [{
+                'word': word['word'].strip(),
+                'start': _shift(word['start'], offset, cut),
+                'end': _shift(word['end'], offset, cut),
+                'probability': round(float(word.get('probability', 0.0)), 3)
+            } for word in seg['words']]
+        segments.append(segment)
+    return segments
+
+
+def _timestamp(seconds, separator):
+    ms = int(round(max(seconds, 0.0) * 1000))
+    hours, ms = divmod(ms, 3600000)
+    minutes, ms = divmod(ms, 60000)
+    secs, ms = divmod(ms, 1000)
+    return f"{hours:02d}:{minutes:02d}:{secs:02d}{separator}{ms:03d}"
+
+
+def _cues(segments):
+    for seg in segments:
+        text = seg['text'].strip()
+        if text and seg['end'] > seg['start']:
+            yield seg['start'], seg['end'], '\n'.join(textwrap.wrap(text, LINE_WIDTH)) or text
+
+
+def to_srt(segments):
+    blocks = [f"{i}\n{_timestamp(start, ',')} --> {_timestamp(end, ',')}\n{text}\n"
+              for i, (start, end, text) in enumerate(_cues(segments), 1)]
+    return '\n'.join(blocks)
+
+
+def to_vtt(segments):
+    blocks = [f"{_timestamp(start, '.')} --> {_timestamp(end, '.')}\n{text}\n" for start, end, text in _cues(segments)]
+    return 'WEBVTT\n\n' + '\n'.join(blocks)
+
+
+def render(segments, fmt):
+    """Subtitle file text in one of SUBTITLE_FORMATS"""
+    return to_srt(segments) if fmt == 'srt' else to_vtt(segments)
@@ -0,0 +1,157 @@
+"""
+Production launcher for the AI servers (gunicorn, Linux/macOS).
+The master process imports the (lightweight) server module and forks the
+workers, which bind right away and warm up in the background (see /ready).
+Each worker gets its share of the CPU cores, and on Linux is pinned to its own
+slice of them: what it starts (the Whisper batch replicas) splits that slice
+instead of the whole machine.
+
+With --preload the master loads the default model before forking instead: the
+weights are shared copy-on-write rather than loaded N times, but the port is
+only bound once the model is loaded.
+
+  python serve.py whisper --workers 2 --threads 4 --preload
+
+Configuration (command-line options take precedence):
+  AI_WORKERS              worker processes (default 2)
+  AI_THREADS_PER_WORKER   torch/ONNX threads per worker (default cores // workers)
+  AI_WORKER_CONNECTIONS   requests served concurrently by one worker (default 4)
+  AI_PRELOAD              1 to preload the default model in the master (set by docker-compose)
+
+ONNX Runtime sessions (rembg, UPSCALE_BACKEND=onnx*) do not survive a fork,
+so those are only downloaded/exported by the master and opened by each worker.
+"""
+import argparse
+import gc
+import os
+import shutil
+import sys
+import tempfile
+
+
+def _download_rembg(module):
+    from rembg.sessions import sessions_class
+    for cls in sessions_class:
+        if cls.name() == 'u2net':
+            cls.download_models()
+
+
+def _preload_upscale(module):
+    module.get_model('pan', 4, backend='torch')
+
+
+# name: (module, port, preload in the master with --preload)
+# Each worker then runs the module's own warm-up, which finds the preloaded model
+SERVERS = {
+    'rembg': ('rembg_server', 5100, _download_rembg),
+    'whisper': ('whisper_server', 5200, lambda m: m.get_model('base')),
+    'upscale': ('upscale_server', 5300, _preload_upscale)
+}
+
+
+def _env_int(name, default):
+    try:
+        return int(os.environ.get(name, default))
+    except ValueError:
+        return default
+
+
+def _worker_cores(cores, slot, workers):
+    """Slice of the master's cores for the worker in `slot`, every core when there are fewer cores than workers"""
+    per_worker = len(cores) // workers
+    if per_worker < 1:
+        return cores
+    start = (slot % workers) * per_worker
+    return cores[start:start + per_worker]
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Serve an AI server with pre-forked gunicorn workers')
+    parser.add_argument('server', choices=sorted(SERVERS))
+    parser.add_argument('--workers', type=int, default=_env_int('AI_WORKERS', 2))
+    parser.add_argument('--threads', type=int, default=None, help='Threads per worker (default: cores // workers)')
+    parser.add_argument('--connections', type=int, default=_env_int('AI_WORKER_CONNECTIONS', 4))
+    parser.add_argument('--bind', default=None, help='Default: 0.0.0.0:<server port>')
+    parser.add_argument('--preload', action='store_true', default=_env_int('AI_PRELOAD', 0) == 1,
+                        help='Load the default model in the master (shared weights, slower start)')
+    args = parser.parse_args()
+
+    try:
+        from gunicorn.app.base import BaseApplication
+    except ImportError:
+        print("❌ gunicorn n'est pas installé (pip install gunicorn, Linux/macOS uniquement).")
+        print(f"   Sous Windows, lancez directement: python {SERVERS[args.server][0]}.py")
+        sys.exit(1)
+
+    module_name, port, preload = SERVERS[args.server]
+    cores = os.cpu_count() or 4
+    workers = max(args.workers, 1)
+    threads = args.threads or _env_int('AI_THREADS_PER_WORKER', 0) or max(cores // workers, 1)
+
+    # Read by the server module at import time (torch) and by ONNX Runtime sessions
+    os.environ['AI_THREADS'] = str(threads)
+    os.environ['AI_WORKERS'] = str(workers)
+    os.environ['OMP_NUM_THREADS'] = str(threads)
+    # Jobs are published here so any worker can answer GET /jobs/<id>
+    job_dir = tempfile.mkdtemp(prefix=f'{args.server}-jobs-')
+    os.environ['AI_JOB_DIR'] = job_dir
+    # Each process publishes its metrics here so any worker's /metrics covers them all
+    metrics_dir = tempfile.mkdtemp(prefix=f'{args.server}-metrics-')
+    os.environ['AI_METRICS_DIR'] = metrics_dir
+
+    module = __import__(module_name)
+    if args.preload:
+        preload(module)
+    # Keep the preloaded objects out of the GC's reach so it doesn't dirty their pages
+    gc.collect()
+    gc.freeze()
+
+    # Master's cores, split between the workers
+    cores_set = sorted(os.sched_getaffinity(0)) if hasattr(os, 'sched_getaffinity') else []
+
+    def pre_fork(server, worker):
+        # Lowest free slot: a replacement worker takes over the slice of the one it replaces
+        taken = {getattr(w, 'slot', None) for w in server.WORKERS.values()}
+        worker.slot = next(i for i in range(len(taken) + 1) if i not in taken)
+
+    def post_fork(server, worker):
+        if cores_set and hasattr(os, 'sched_setaffinity'):
+            mine = _worker_cores(cores_set, worker.slot, workers)
+            os.sched_setaffinity(0, mine)
+            print(f"🧵 Worker {worker.slot}: cœurs {mine[0]}-{mine[-1]}")
+        torch = sys.modules.get('torch')
+        if torch:
+            torch.set_num_threads(threads)
+        module.warmup.start()
+
+    def on_exit(server):
+        shutil.rmtree(job_dir, ignore_errors=True)
+        shutil.rmtree(metrics_dir, ignore_errors=True)
+
+    options = {
+        'bind': args.bind or f'0.0.0.0:{port}',
+        'workers': workers,
+        'worker_class': 'gthread',
+        'threads': max(args.connections, 1),
+        # Large uploads and synchronous transcriptions can take minutes
+        'timeout': 600,
+        'graceful_timeout': 30,
+        'pre_fork': pre_fork,
+        'post_fork': post_fork,
+        'on_exit': on_exit
+    }
+
+    class Launcher(BaseApplication):
+        def load_config(self):
+            for key, value in options.items():
+                self.cfg.set(key, value)
+
+        def load(self):
+            return module.app
+
+    print(f"🚀 {module_name}: {workers} worker(s) x {threads} thread(s) sur {options['bind']} ({cores} cœurs)")
+    Launcher().run()
+
+
+if __name__ == '__main__':
+    main()
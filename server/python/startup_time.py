@@ -0,0 +1,141 @@
+"""
+Cold-start measurement for the AI servers.
+For each server: the import time of its module (python -X importtime, with the
+heaviest packages), then the time from launching `python <server>.py` until
+/health answers and until /ready reports the warm-up as finished.
+
+Usage:
+  python startup_time.py                       # all servers
+  python startup_time.py --services whisper --imports-only
+  python startup_time.py --output startup.json
+"""
+import argparse
+import json
+import os
+import subprocess
+import sys
+import time
+import urllib.error
+import urllib.request
+
+from serve import SERVERS
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+
+
+def import_time(module_name, top=8):
+    """Wall time of `import module_name` in a fresh interpreter and its heaviest top-level packages"""
+    start = time.perf_counter()
+    proc = subprocess.run([sys.executable, '-X', 'importtime', '-c', f'import {module_name}'],
+                          cwd=HERE, capture_output=True, text=True, encoding='utf-8', errors='replace')
+    wall = time.perf_counter() - start
+    if proc.returncode != 0:
+        raise RuntimeError(f"import {module_name} a échoué: {proc.stderr.strip().splitlines()[-1:]}")
+
+    # Lines look like "import time:   self [us] |  cumulative | imported package"
+    packages = {}
+    for line in proc.stderr.splitlines():
+        if not line.startswith('import time:') or '|' not in line:
+            continue
+        parts = line[len('import time:'):].split('|')
+        try:
+            cumulative = int(parts[1])
+        except ValueError:
+            continue
+        # A package is as heavy as its slowest (outermost) import, wherever it was first imported
+        package = parts[2].strip().split('.')[0]
+        if package != module_name:
+            packages[package] = max(packages.get(package, 0), cumulative)
+    heaviest = sorted(packages.items(), key=lambda item: item[1], reverse=True)[:top]
+    return {
+        'wall_seconds': round(wall, 3),
+        'heaviest': [{'package': name, 'seconds': round(us / 1e6, 3)} for name, us in heaviest]
+    }
+
+
+def _get(url):
+    """(status, JSON body) or (None, None) when the server does not answer yet"""
+    try:
+        with urllib.request.urlopen(url, timeout=1) as response:
+            status, body = response.status, response.read()
+    except urllib.error.HTTPError as e:
+        status, body = e.code, e.read()
+    except (urllib.error.URLError, ConnectionError, TimeoutError):
+        return None, None
+    try:
+        return status, json.loads(body or b'{}')
+    except ValueError:
+        return status, {}
+
+
+def serve_time(module_name, port, timeout):
+    """Seconds until /health answers and until /ready returns 200 for a freshly launched server"""
+    base = f'http://127.0.0.1:{port}'
+    start = time.perf_counter()
+    proc = subprocess.Popen([sys.executable, f'{module_name}.py'], cwd=HERE,
+                            stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    result = {'health_seconds': None, 'ready_seconds': None}
+    try:
+        while time.perf_counter() - start < timeout:
+            if proc.poll() is not None:
+                raise RuntimeError(f"{module_name} s'est arrêté (code {proc.returncode})")
+            if result['health_seconds'] is None:
+                status, _ = _get(f'{base}/health')
+                if status == 200:
+                    result['health_seconds'] = round(time.perf_counter() - start, 3)
+            if result['health_seconds'] is not None:
+                status, body = _get(f'{base}/ready')
+                if status == 200:
+                    result['ready_seconds'] = round(time.perf_counter() - start, 3)
+                    result['warmup'] = body
+                    break
+                if body and body.get('state') == 'failed':
+                    result['warmup'] = body
+                    break
+            time.sleep(0.05)
+    finally:
+        proc.terminate()
+        try:
+            proc.wait(timeout=10)
+        except subprocess.TimeoutExpired:
+            proc.kill()
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Measure import and cold-start time of the AI servers')
+    parser.add_argument('--services', default=','.join(SERVERS))
+    parser.add_argument('--imports-only', action='store_true', help='Do not launch the servers')
+    parser.add_argument('--timeout', type=float, default=300, help='Seconds to wait for /ready')
+    parser.add_argument('--output', help='Write results JSON to this file')
+    args = parser.parse_args()
+
+    results = []
+    for service in args.services.split(','):
+        if service not in SERVERS:
+            parser.error(f"Service inconnu: {service}")
+        module_name, port = SERVERS[service][:2]
+        print(f"⏱️ Démarrage de {service}...")
+        result = {'service': service, 'import': import_time(module_name)}
+        if not args.imports_only:
+            result.update(serve_time(module_name, port, args.timeout))
+        results.append(result)
+
+    for r in results:
+        line = f"  {r['service']:<8} import {r['import']['wall_seconds']:>6.2f}s"
+        if not args.imports_only:
+            health = f"{r['health_seconds']:.2f}s" if r['health_seconds'] is not None else 'timeout'
+            ready = f"{r['ready_seconds']:.2f}s" if r['ready_seconds'] is not None else 'non prêt'
+            line += f"  /health {health:>8}  /ready {ready:>8}"
+        print(line)
+        heaviest = ', '.join(f"{p['package']} {p['seconds']:.2f}s" for p in r['import']['heaviest'][:5])
+        print(f"           {heaviest}")
+
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump({'timestamp': time.time(), 'results': results}, f, indent=2)
+        print(f"💾 Résultats écrits dans {args.output}")
+
+
+if __name__ == '__main__':
+    main()
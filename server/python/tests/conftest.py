@@ -0,0 +1,7 @@
+"""Tests for the AI servers: modules are imported by plain name, as the servers do"""
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+# Tests never write to the shared result cache
+os.environ.setdefault('AI_RESULT_CACHE_MB', '0')
@@ -0,0 +1,92 @@
+import threading
+import time
+
+import torch
+
+import cpu_scheduler
+from cpu_scheduler import CpuScheduler
+
+
+def wait_until(condition, timeout=5.0):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        assert time.monotonic() < deadline, 'timeout'
+        time.sleep(0.005)
+
+
+def queue_behind(scheduler, jobs, pause=0.0):
+    """Queue `jobs` (model, cost) `pause` seconds apart while one slot is held, returns the admission order"""
+    order = []
+    holder = scheduler.slot('upscale', cost=1)
+    holder.__enter__()
+
+    def run(model, cost):
+        with scheduler.slot(model, cost=cost):
+            order.append((model, cost))
+
+    threads = []
+    for model, cost in jobs:
+        if threads:
+            time.sleep(pause)
+        thread = threading.Thread(target=run, args=(model, cost))
+        thread.start()
+        threads.append(thread)
+        wait_until(lambda: scheduler.depth() == len(threads))
+    holder.__exit__(None, None, None)
+    for thread in threads:
+        thread.join()
+    return order
+
+
+def test_cheapest_waiting_request_is_admitted_first():
+    scheduler = CpuScheduler('upscale', cores=4, max_active=1)
+    order = queue_behind(scheduler, [('a', 5), ('b', 1), ('c', 3)])
+    assert order == [('b', 1), ('c', 3), ('a', 5)]
+    assert scheduler.admitted == 4
+
+
+def test_aging_lets_a_large_job_through(monkeypatch):
+    monkeypatch.setattr(cpu_scheduler, 'AGING_SECONDS', 0.01)
+    scheduler = CpuScheduler('upscale', cores=4, max_active=1)
+    # The large job waited 0.2s more (20 aging periods): 10 / 21 beats a fresh job of cost 1
+    order = queue_behind(scheduler, [('large', 10), ('small', 1)], pause=0.2)
+    assert order[0] == ('large', 10)
+
+
+def test_cores_are_split_between_running_requests():
+    scheduler = CpuScheduler('upscale', cores=8, max_active=4)
+    first = scheduler.slot('upscale', cost=1)
+    assert first.__enter__() == 8
+    assert scheduler.refresh() == 8
+    assert torch.get_num_threads() == 8
+
+    granted = []
+    admitted, release = threading.Event(), threading.Event()
+
+    def second():
+        with scheduler.slot('upscale', cost=1) as threads:
+            granted.append((threads, torch.get_num_threads()))
+            admitted.set()
+            release.wait()
+
+    thread = threading.Thread(target=second)
+    thread.start()
+    admitted.wait(5)
+    # Set on the admitted request's own thread
+    assert granted == [(4, 4)]
+    # The running request only sees the new share once it asks for it
+    assert scheduler.refresh() == 4
+    assert torch.get_num_threads() == 4
+
+    release.set()
+    thread.join()
+    assert scheduler.refresh() == 8
+    first.__exit__(None, None, None)
+    assert scheduler.refresh() is None
+
+
+def test_threads_are_capped_by_the_model_scaling():
+    scheduler = CpuScheduler('whisper', cores=16, max_active=2)
+    with scheduler.slot('tiny', cost=1) as threads:
+        assert threads == cpu_scheduler.useful_threads(cpu_scheduler.PARALLEL_FRACTION['tiny'], 16)
+        assert threads < 16
@@ -0,0 +1,46 @@
+import numpy as np
+import pytest
+
+import denoise
+
+
+def gradient(height=240, width=200):
+    """Smooth RGB ramps: no edges, nothing for a noise estimator to pick up"""
+    y, x = np.mgrid[0:height, 0:width].astype(np.float32)
+    channels = [60 + 120 * x / width, 60 + 120 * y / height, 90 + 60 * (x + y) / (width + height)]
+    return np.stack(channels, axis=-1).round().astype(np.uint8)
+
+
+def noisy(sigma, seed=0):
+    rng = np.random.default_rng(seed)
+    array = gradient().astype(np.float32) + rng.normal(0, sigma, gradient().shape)
+    return np.clip(array, 0, 255).round().astype(np.uint8)
+
+
+@pytest.mark.parametrize('method', sorted(denoise.FILTERS))
+def test_strips_match_the_whole_image(monkeypatch, method):
+    monkeypatch.setattr(denoise, 'MIN_PARALLEL_PIXELS', 0)
+    fn, margin = denoise.FILTERS[method]
+    array = noisy(10)
+    whole = fn(array, 10.0)
+    strips = denoise._apply(fn, margin, array, 10.0, threads=4)
+    assert np.array_equal(strips, whole)
+
+
+@pytest.mark.parametrize('sigma', [5, 10, 20])
+def test_noise_estimate_is_close_to_the_added_noise(sigma):
+    # The integer rounding adds its own ~0.3 of noise
+    assert denoise.estimate_noise(noisy(sigma)) == pytest.approx(sigma, abs=0.15 * sigma + 0.5)
+
+
+def test_auto_leaves_clean_images_alone():
+    array = gradient()
+    result, info = denoise.denoise(array, 'auto', threads=2)
+    assert result is array
+    assert info['method'] == 'none'
+    assert info['sigma'] < denoise.CLEAN_SIGMA
+
+
+def test_auto_picks_the_filter_from_the_noise_level():
+    assert denoise.denoise(noisy(6), 'auto')[1]['method'] == 'guided'
+    assert denoise.denoise(noisy(25), 'auto')[1]['method'] == 'nlmeans'
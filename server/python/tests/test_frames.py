@@ -0,0 +1,157 @@
+import io
+import subprocess
+from concurrent.futures import Future
+
+import numpy as np
+import pytest
+from PIL import Image
+
+import frames as frame_seq
+import rembg_server
+from audio import find_ffmpeg
+
+needs_ffmpeg = pytest.mark.skipif(find_ffmpeg() is None, reason='ffmpeg introuvable')
+
+
+def moving_square(count, size=(320, 240)):
+    """Frames of a square moving across a plain background: every frame differs"""
+    frames = []
+    for i in range(count):
+        pixels = np.full((size[1], size[0], 3), 200, dtype=np.uint8)
+        x = (i * 37) % (size[0] - 60)
+        pixels[80:140, x:x + 60] = (30, 40, 50)
+        frames.append(Image.fromarray(pixels))
+    return frames
+
+
+def test_animation_is_scaled_to_the_pixel_budget(monkeypatch):
+    monkeypatch.setattr(frame_seq, 'MAX_PIXELS', 10 * 20000)
+    buffer = io.BytesIO()
+    frames = moving_square(10)
+    frames[0].save(buffer, 'GIF', save_all=True, append_images=frames[1:], duration=40, loop=0)
+
+    decoded = list(frame_seq.animation_frames(Image.open(buffer)))
+    assert len(decoded) == 10
+    assert all(frame.width * frame.height <= 20000 for frame, _ in decoded)
+    assert all(duration == 40 for _, duration in decoded)
+
+
+@needs_ffmpeg
+def test_video_is_scaled_to_the_pixel_budget(monkeypatch, tmp_path):
+    path = tmp_path / 'clip.mp4'
+    subprocess.run([find_ffmpeg(), '-y', '-loglevel', 'error', '-f', 'lavfi', '-i', 'testsrc=size=1280x720:rate=10',
+                    '-t', '2', '-pix_fmt', 'yuv420p', str(path)], check=True)
+    monkeypatch.setattr(frame_seq, 'MAX_PIXELS', 20 * 50000)
+
+    decoded = list(frame_seq.video_frames(path.read_bytes()))
+    assert len(decoded) == 20
+    width, height = decoded[0][0].size
+    assert width * height <= 50000
+    assert abs(width / height - 16 / 9) < 0.05
+    assert decoded[0][1] == 100
+
+
+def test_frames_are_released_in_chunks(monkeypatch):
+    monkeypatch.setattr(frame_seq, 'FRAME_CHUNK', 4)
+    done = []
+
+    def submit_many(model_name, images):
+        futures = []
+        for img in images:
+            future = Future()
+            future.set_result(Image.new('L', img.size, 255))
+            futures.append(future)
+        return futures
+
+    def cutout(img, mask):
+        done.append(img.size)
+        return img.convert('RGBA')
+
+    monkeypatch.setattr(rembg_server.batcher, 'submit_many', submit_many)
+    monkeypatch.setattr(rembg_server, 'cutout', cutout)
+
+    def stream():
+        for i, frame in enumerate(moving_square(20)):
+            # Never more than a chunk of decoded frames waiting for their cutout
+            assert i - len(done) <= frame_seq.FRAME_CHUNK
+            yield frame, 50
+
+    cutouts, durations, counts = rembg_server.remove_frames(stream(), 'u2net', 'none')
+    assert len(cutouts) == 20
+    assert durations == [50] * 20
+    assert counts['infer'] == 20
+
+
+def near_static(count, size=(320, 240)):
+    """A still scene where a small square starts drifting after a third of the frames"""
+    frames = []
+    for i in range(count):
+        pixels = np.full((size[1], size[0], 3), 200, dtype=np.uint8)
+        pixels[:, :size[0] // 2] = (90, 120, 160)
+        x = 200 + 4 * max(i - count // 3, 0)
+        pixels[100:124, x:x + 24] = (30, 40, 50)
+        frames.append(Image.fromarray(pixels))
+    return frames
+
+
+def test_near_static_clip_runs_the_model_once(monkeypatch):
+    submitted = []
+
+    def submit_many(model_name, images):
+        submitted.extend(images)
+        futures = []
+        for img in images:
+            future = Future()
+            future.set_result(Image.new('L', img.size, 255))
+            futures.append(future)
+        return futures
+
+    monkeypatch.setattr(rembg_server.batcher, 'submit_many', submit_many)
+    monkeypatch.setattr(rembg_server, 'cutout', lambda img, mask: img.convert('RGBA'))
+
+    frames = near_static(30)
+    cutouts, _, counts = rembg_server.remove_frames(((frame, 50) for frame in frames), 'u2net', 'none')
+    assert len(cutouts) == 30
+    assert counts['infer'] == 1 and len(submitted) == 1
+    assert counts['reuse'] > 0 and counts['propagate'] > 0
+    assert sum(counts.values()) == 30
+
+
+def changed_frame(changed, delta=100):
+    """A THUMB_SIZE square frame (its own thumbnail) with `changed` pixels brightened by `delta`"""
+    pixels = np.full(frame_seq.THUMB_SIZE * frame_seq.THUMB_SIZE, 100, dtype=np.uint8)
+    pixels[:changed] += delta
+    return Image.fromarray(pixels.reshape(frame_seq.THUMB_SIZE, frame_seq.THUMB_SIZE))
+
+
+def test_planner_thresholds():
+    total = frame_seq.THUMB_SIZE * frame_seq.THUMB_SIZE
+    reuse_limit = int(frame_seq.REUSE_CHANGED * total)
+    propagate_limit = int(frame_seq.PROPAGATE_CHANGED * total)
+
+    planner = frame_seq.Planner(reuse=True)
+    assert planner.next(changed_frame(0)) == 'infer'
+    assert planner.next(changed_frame(reuse_limit)) == 'reuse'
+    assert planner.next(changed_frame(reuse_limit + 1)) == 'propagate'
+    assert planner.next(changed_frame(propagate_limit)) == 'propagate'
+    # Still compared with the first keyframe: changes add up until a new one is taken
+    assert planner.next(changed_frame(propagate_limit + 1)) == 'infer'
+    assert planner.next(changed_frame(propagate_limit + 1)) == 'reuse'
+
+
+def test_planner_ignores_small_pixel_deltas():
+    planner = frame_seq.Planner(reuse=True)
+    planner.next(changed_frame(0))
+    total = frame_seq.THUMB_SIZE * frame_seq.THUMB_SIZE
+    assert planner.next(changed_frame(total, delta=frame_seq.PIXEL_DELTA)) == 'reuse'
+    assert planner.next(changed_frame(total, delta=frame_seq.PIXEL_DELTA + 1)) == 'infer'
+
+
+def test_planner_infers_on_resize_or_when_disabled():
+    planner = frame_seq.Planner(reuse=True)
+    planner.next(changed_frame(0))
+    # Another aspect ratio (a new video stream): the thumbnails cannot be compared
+    assert planner.next(changed_frame(0).resize((96, 48))) == 'infer'
+
+    planner = frame_seq.Planner(reuse=False)
+    assert [planner.next(changed_frame(0)) for _ in range(3)] == ['infer'] * 3
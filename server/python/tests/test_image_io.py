@@ -0,0 +1,46 @@
+import pytest
+from flask import Flask
+from PIL import Image
+
+import image_io
+
+
+class FailingImage:
+    """Encoder that writes `written` bytes, then fails"""
+    mode = 'RGB'
+
+    def __init__(self, written):
+        self.written = written
+
+    def save(self, fp, fmt, **params):
+        if self.written:
+            fp.write(b'x' * self.written)
+        raise OSError('encoder failure')
+
+
+@pytest.fixture
+def context():
+    with Flask('test').test_request_context():
+        yield
+
+
+def test_streamed_output_is_cached_once_complete(context):
+    stored = []
+    img = Image.new('RGB', (64, 64), (10, 20, 30))
+    response = image_io.stream_response(img, image_io.OutputFormat('png'), 'a.png', on_complete=stored.append)
+    body = b''.join(response.response)
+    assert stored == [body] and body == image_io.encode(img, image_io.OutputFormat('png'))
+
+
+def test_encoder_failure_before_any_byte_raises_before_headers(context):
+    with pytest.raises(OSError):
+        image_io.stream_response(FailingImage(0), image_io.OutputFormat('png'), 'a.png')
+
+
+def test_encoder_failure_mid_stream_is_not_cached(context):
+    stored = []
+    response = image_io.stream_response(FailingImage(10), image_io.OutputFormat('png'), 'a.png',
+                                        on_complete=stored.append)
+    with pytest.raises(OSError):
+        b''.join(response.response)
+    assert stored == []
@@ -0,0 +1,31 @@
+import os
+import time
+
+from flask import Flask
+
+from jobs import JobManager, register_job_routes
+
+
+def wait(job):
+    for _ in range(100):
+        if job.state in ('done', 'error'):
+            return
+        time.sleep(0.02)
+
+
+def test_binary_result_is_served_from_disk_and_purged():
+    manager = JobManager('test', ttl_seconds=1)
+    app = Flask('test')
+    register_job_routes(app, manager)
+    job = manager.submit('x', lambda job: (b'result', 'image/png', 'out.png'))
+    wait(job)
+    assert job.result is None and os.path.exists(job.result_path)
+
+    response = app.test_client().get(f'/jobs/{job.id}/result')
+    assert response.status_code == 200 and response.data == b'result'
+    response.close()
+
+    # The reaper purges the job without another submit
+    time.sleep(2.5)
+    assert manager.get(job.id) is None
+    assert not os.path.exists(job.result_path)
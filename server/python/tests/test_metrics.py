@@ -0,0 +1,72 @@
+import json
+import os
+import subprocess
+import sys
+
+import metrics
+
+
+def fresh_metrics(monkeypatch, tmp_path):
+    counter = metrics.Counter('t_requests_total', 'Requests', ('endpoint',))
+    histogram = metrics.Histogram('t_seconds', 'Latency', ('endpoint',), buckets=(1, 5))
+    gauge = metrics.Gauge('t_queue_depth', 'Queue', ('queue',))
+    monkeypatch.setattr(metrics, 'ALL_METRICS', [counter, histogram, gauge])
+    monkeypatch.setattr(metrics, 'METRICS_DIR', str(tmp_path))
+    return counter, histogram, gauge
+
+
+def dead_pid():
+    process = subprocess.Popen([sys.executable, '-c', 'pass'])
+    process.wait()
+    return process.pid
+
+
+def publish_as(tmp_path, pid, snapshot):
+    with open(tmp_path / f'{pid}.json', 'w', encoding='utf-8') as f:
+        json.dump(snapshot, f)
+
+
+def test_single_process_renders_its_own_values(monkeypatch, tmp_path):
+    counter, _, gauge = fresh_metrics(monkeypatch, tmp_path)
+    monkeypatch.setattr(metrics, 'METRICS_DIR', None)
+    counter.inc(endpoint='/a')
+    gauge.set(3, queue='jobs')
+    text = metrics.render()
+    assert 't_requests_total{endpoint="/a"} 1.0' in text
+    assert 't_queue_depth{queue="jobs"} 3.0' in text
+
+
+def test_workers_are_summed_and_gauges_labelled(monkeypatch, tmp_path):
+    counter, histogram, gauge = fresh_metrics(monkeypatch, tmp_path)
+    counter.inc(2, endpoint='/a')
+    histogram.observe(0.5, endpoint='/a')
+    gauge.set(1, queue='jobs')
+    other = os.getppid()
+    publish_as(tmp_path, other, {
+        't_requests_total': [[['/a'], 3]],
+        't_seconds': [[['/a'], [0, 1, 1], 3.0]],
+        't_queue_depth': [[['jobs'], 4]]
+    })
+    # Exited worker: its requests still count, its queue is gone
+    gone = dead_pid()
+    publish_as(tmp_path, gone, {'t_requests_total': [[['/a'], 10]], 't_queue_depth': [[['jobs'], 7]]})
+
+    text = metrics.render()
+    assert 't_requests_total{endpoint="/a"} 15.0' in text
+    assert 't_seconds_count{endpoint="/a"} 2' in text
+    assert 't_seconds_sum{endpoint="/a"} 3.5' in text
+    assert 't_seconds_bucket{endpoint="/a",le="1.0"} 1' in text
+    assert f't_queue_depth{{queue="jobs",worker="{os.getpid()}"}} 1.0' in text
+    assert f't_queue_depth{{queue="jobs",worker="{other}"}} 4.0' in text
+    assert f'worker="{gone}"' not in text
+
+
+def test_publish_writes_this_process_snapshot(monkeypatch, tmp_path):
+    counter, _, gauge = fresh_metrics(monkeypatch, tmp_path)
+    monkeypatch.setattr(metrics, '_published', None)
+    counter.inc(endpoint='/b')
+    gauge.add_callback(lambda: {('cpu',): 2})
+    metrics._publish(gauges=False)
+    with open(tmp_path / f'{os.getpid()}.json', encoding='utf-8') as f:
+        snapshot = json.load(f)
+    assert snapshot == {'t_requests_total': [[['/b'], 1]], 't_seconds': []}
@@ -0,0 +1,91 @@
+import threading
+import time
+
+import model_registry
+from model_registry import ModelRegistry
+
+
+class FakeModel:
+    def __init__(self, name, size_mb):
+        self.name = name
+        self._size_mb = size_mb
+
+    def size_mb(self):
+        return self._size_mb
+
+
+def loader(name, size_mb=100, calls=None, delay=0.0):
+    def load():
+        if calls is not None:
+            calls.append(name)
+        time.sleep(delay)
+        return FakeModel(name, size_mb)
+    return load
+
+
+def test_least_recently_used_model_is_evicted_first():
+    registry = ModelRegistry('test', budget_mb=250, idle_seconds=0)
+    registry.get('a', loader('a'))
+    registry.get('b', loader('b'))
+    # 'a' used again: 'b' becomes the least recently used
+    registry.get('a', loader('a'))
+    registry.get('c', loader('c'))
+
+    assert registry.peek('b') is None
+    assert registry.peek('a') is not None and registry.peek('c') is not None
+    assert registry.evictions == 1
+    assert registry.hits == 1 and registry.misses == 3
+
+
+def test_eviction_makes_room_before_loading():
+    registry = ModelRegistry('test', budget_mb=300, idle_seconds=0)
+    registry.get('a', loader('a'))
+    registry.get('b', loader('b'))
+    resident = []
+    # The expected size frees the budget before the loader runs
+    registry.get('big', lambda: resident.append(registry.resident_mb()) or FakeModel('big', 200), size_mb=200)
+
+    assert resident == [100]
+    assert registry.resident_mb() <= registry.budget_mb
+    assert list(registry.memory_by_model()) == ['b', 'big']
+
+
+def test_oversized_model_stays_loaded_alone():
+    registry = ModelRegistry('test', budget_mb=150, idle_seconds=0)
+    registry.get('a', loader('a'))
+    model = registry.get('huge', loader('huge', size_mb=400))
+
+    assert registry.peek('huge') is model
+    assert registry.peek('a') is None
+
+
+def test_concurrent_first_requests_load_once():
+    registry = ModelRegistry('test', budget_mb=0, idle_seconds=0)
+    calls = []
+    results = []
+    barrier = threading.Barrier(8)
+
+    def request():
+        barrier.wait()
+        results.append(registry.get('a', loader('a', calls=calls, delay=0.1)))
+
+    threads = [threading.Thread(target=request) for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert calls == ['a']
+    assert len(results) == 8 and all(model is results[0] for model in results)
+    assert registry.misses == 1 and registry.hits == 7
+
+
+def test_collection_runs_outside_the_lock(monkeypatch):
+    registry = ModelRegistry('test', budget_mb=150, idle_seconds=0)
+    held = []
+    monkeypatch.setattr(model_registry.gc, 'collect', lambda: held.append(registry._lock.locked()))
+    registry.get('a', loader('a'))
+    registry.get('b', loader('b'), size_mb=100)
+    registry.unload('b')
+
+    assert held == [False, False]
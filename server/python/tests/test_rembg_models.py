@@ -0,0 +1,38 @@
+import io
+import zipfile
+
+from PIL import Image
+
+import rembg_server
+from benchmark import StubRembgSession
+
+
+def test_unknown_model_is_rejected_before_batching():
+    client = rembg_server.app.test_client()
+    for path, field in (('/remove', 'file'), ('/remove/batch', 'files')):
+        response = client.post(path, data={field: (io.BytesIO(b'x'), 'a.png'), 'model': 'no-such-model'})
+        assert response.status_code == 400
+        assert 'Modele inconnu' in response.json['error']
+    assert 'no-such-model' not in rembg_server.batcher._queues
+
+
+def test_unknown_model_is_not_a_metrics_label():
+    client = rembg_server.app.test_client()
+    client.post('/remove', data={'file': (io.BytesIO(b'x'), 'a.png'), 'model': 'label-flood-1234'})
+    text = client.get('/metrics').get_data(as_text=True)
+    assert 'label-flood-1234' not in text
+    assert 'model="other"' in text
+
+
+def test_batch_archive_names_are_unique():
+    rembg_server.registry.get('u2netp', StubRembgSession)
+    png = io.BytesIO()
+    Image.new('RGB', (32, 32), (200, 10, 10)).save(png, 'PNG')
+    names = ['x.png', 'x.png', '1-x.png', 'x.jpg']
+    client = rembg_server.app.test_client()
+    response = client.post('/remove/batch', data={'model': 'u2netp',
+                                                  'files': [(io.BytesIO(png.getvalue()), name) for name in names]})
+    assert response.status_code == 200
+    entries = zipfile.ZipFile(io.BytesIO(response.get_data())).namelist()
+    assert len(entries) == len(set(entries)) == 4
+    assert entries[:3] == ['nobg-x.png', 'nobg-1-x.png', 'nobg-1-1-x.png']
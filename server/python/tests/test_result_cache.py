@@ -0,0 +1,39 @@
+import os
+import time
+
+from result_cache import ResultCache, SUFFIX
+
+
+def disk_bytes(directory):
+    return sum(os.path.getsize(os.path.join(directory, name)) for name in os.listdir(directory)
+               if name.endswith(SUFFIX))
+
+
+def test_budget_holds_across_processes_sharing_the_directory(tmp_path):
+    # Two workers of one server: each sees the other's entries before evicting
+    first = ResultCache(str(tmp_path), max_mb=1)
+    second = ResultCache(str(tmp_path), max_mb=1)
+    chunk = b'x' * (300 * 1024)
+    for i in range(6):
+        (first if i % 2 else second).put(f'key{i}', chunk)
+        time.sleep(0.01)
+    assert disk_bytes(tmp_path) <= 1024 * 1024
+    # Oldest entries went first, whichever worker wrote them
+    assert first.get('key0') is None
+    assert second.get('key5') == chunk
+
+
+def test_reads_keep_entries_fresh_for_the_other_processes(tmp_path):
+    first = ResultCache(str(tmp_path), max_mb=1)
+    second = ResultCache(str(tmp_path), max_mb=1)
+    chunk = b'x' * (400 * 1024)
+    first.put('old', chunk)
+    time.sleep(0.01)
+    first.put('recent', chunk)
+    time.sleep(0.01)
+    # Read by the other worker: now the most recently used
+    assert second.get('old') == chunk
+    time.sleep(0.01)
+    second.put('new', chunk)
+    assert first.get('recent') is None
+    assert first.get('old') == chunk
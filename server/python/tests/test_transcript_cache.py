@@ -0,0 +1,65 @@
+import os
+
+import numpy as np
+
+from result_cache import ResultCache
+from transcript_cache import TranscriptCache, pcm_fingerprint
+
+
+def make_cache(tmp_path):
+    cache = TranscriptCache(str(tmp_path))
+    cache.audio = ResultCache(str(tmp_path / 'audio'), max_mb=16)
+    cache.transcripts = ResultCache(str(tmp_path / 'transcripts'), max_mb=16)
+    return cache
+
+
+def test_collect_spills_and_fingerprints_incrementally(tmp_path):
+    cache = make_cache(tmp_path)
+    chunks = [np.random.default_rng(i).random(1000, dtype=np.float32) for i in range(5)]
+    recording = cache.open(b'upload')
+    assert [len(c) for c in recording.collect(iter(chunks))] == [1000] * 5
+
+    pcm = np.concatenate(chunks)
+    assert recording.fingerprint == pcm_fingerprint(pcm)
+    assert cache.audio.get(recording.upload) == pcm.tobytes()
+    # A second upload of the same file finds the link and the audio
+    again = cache.open(b'upload')
+    assert again.fingerprint == recording.fingerprint
+    assert np.array_equal(again.pcm(lambda data: None), pcm)
+
+
+def test_interrupted_collect_leaves_nothing(tmp_path):
+    cache = make_cache(tmp_path)
+    recording = cache.open(b'upload')
+    stream = recording.collect(iter([np.zeros(1000, dtype=np.float32)] * 3))
+    next(stream)
+    stream.close()
+    assert recording.fingerprint is None
+    assert cache.audio.get(recording.upload) is None
+    assert not [f for f in os.listdir(tmp_path / 'audio') if f.endswith('.tmp')]
+
+
+def test_stream_reads_the_cached_audio_back_in_chunks(tmp_path):
+    cache = make_cache(tmp_path)
+    pcm = np.random.default_rng(0).random(10_000, dtype=np.float32)
+    first = cache.open(b'upload')
+    list(first.collect(iter([pcm])))
+
+    def decoder():
+        raise AssertionError('decoded again')
+
+    again = cache.open(b'upload')
+    chunks = list(again.stream(decoder, chunk_samples=3000))
+    assert [len(c) for c in chunks] == [3000, 3000, 3000, 1000]
+    assert np.array_equal(np.concatenate(chunks), pcm)
+    assert again.status['audio'] == 'HIT'
+
+
+def test_stream_decodes_and_fingerprints_when_nothing_is_cached(tmp_path):
+    cache = make_cache(tmp_path)
+    pcm = np.ones(5000, dtype=np.float32)
+    recording = cache.open(b'upload')
+    chunks = list(recording.stream(lambda: iter([pcm[:2500], pcm[2500:]])))
+    assert len(chunks) == 2
+    assert recording.fingerprint == pcm_fingerprint(pcm)
+    assert recording.status['audio'] == 'MISS'
@@ -0,0 +1,38 @@
+from upscale_cost import CostModel, coefficient_key
+
+
+def calibrated(*models, scale=4):
+    """Coefficients as calibrate_upscale.py writes them, for the given models at one scale"""
+    figures = {'pan': 10.0, 'edsr': 50.0, 'msrn': 200.0, 'drln': 1000.0}
+    return {coefficient_key(model, scale, 'torch'): {'seconds_per_mp': figures[model], 'mb_per_mp': 1000.0,
+                                                      'overhead': 0.1}
+            for model in models}
+
+
+def test_uncalibrated_jobs_run_as_requested():
+    # 1MP with msrn: ~240s on the default guesses, over a 100s budget
+    estimate, tried = CostModel({}).route(1000, 1000, 'msrn', 4, max_seconds=100, max_memory_mb=1e6)
+    assert (estimate.strategy, estimate.model, estimate.scale) == ('direct', 'msrn', 4)
+    assert not estimate.calibrated
+    assert len(tried) == 1
+
+
+def test_uncalibrated_jobs_are_still_tiled():
+    estimate, _ = CostModel({}).route(2000, 2000, 'pan', 4, max_seconds=1e6, max_memory_mb=2000)
+    assert estimate.strategy == 'tiled'
+    assert estimate.model == 'pan'
+
+
+def test_calibrated_jobs_switch_to_a_calibrated_lighter_model():
+    cost_model = CostModel(calibrated('pan', 'edsr', 'msrn'))
+    estimate, _ = cost_model.route(1000, 1000, 'msrn', 4, max_seconds=100, max_memory_mb=1e6)
+    assert (estimate.strategy, estimate.model) == ('lighter', 'edsr')
+    assert estimate.calibrated
+
+
+def test_lighter_models_need_their_own_calibration():
+    # edsr would fit on its default guess (60s) but only msrn was measured
+    estimate, tried = CostModel(calibrated('msrn')).route(1000, 1000, 'msrn', 4, max_seconds=100, max_memory_mb=1e6,
+                                                          allow_downscale=False)
+    assert estimate.strategy == 'reject'
+    assert any(t.model == 'edsr' for t in tried)
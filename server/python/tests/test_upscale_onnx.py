@@ -0,0 +1,85 @@
+import io
+import os
+
+import numpy as np
+import pytest
+import torch
+from PIL import Image
+
+pytest.importorskip('onnxruntime')
+
+import upscale_onnx
+import upscale_server
+import weight_store
+from test_upscale_tiling import conv_model
+
+
+def pan_x2_weights():
+    """pan x2 weights already on disk (the tests never download them)"""
+    from huggingface_hub import try_to_load_from_cache
+    cached = try_to_load_from_cache(upscale_server.MODEL_MAPPING['pan'], 'pytorch_model_2x.pt',
+                                    cache_dir=upscale_server.MODELS_DIR)
+    return isinstance(cached, str) or os.path.exists(weight_store.store_path('pan-x2', 'super-image'))
+
+
+needs_pan_weights = pytest.mark.skipif(not pan_x2_weights(), reason='poids pan x2 absents')
+
+
+def smooth_image(size=48):
+    rng = np.random.default_rng(0)
+    y, x = np.mgrid[0:size, 0:size] / size
+    image = np.stack([x, y, (x + y) / 2], axis=0) * 0.7 + rng.random((3, size, size)) * 0.3
+    return torch.from_numpy(image[None].astype(np.float32))
+
+
+@pytest.mark.parametrize('backend', ['onnx', 'onnx-int8'])
+def test_onnx_matches_torch(tmp_path, backend):
+    model = conv_model(2)
+    path = str(tmp_path / 'conv-x2.onnx')
+    upscale_onnx.export_onnx(model, path)
+    if backend == 'onnx-int8':
+        int8_path = str(tmp_path / 'conv-x2-int8.onnx')
+        upscale_onnx.quantize_int8(path, int8_path)
+        path = int8_path
+    # Only the final graph is left behind: no shared or stray temp files
+    assert not [f for f in os.listdir(tmp_path) if f.endswith('.tmp')]
+
+    inputs = smooth_image()
+    with torch.no_grad():
+        reference = model(inputs).numpy()
+    output = upscale_onnx.OnnxUpscaler(path, threads=1)(inputs).numpy()
+    assert output.shape == reference.shape
+    assert upscale_onnx.psnr(output, reference) >= upscale_onnx.PARITY_PSNR[backend]
+
+
+@needs_pan_weights
+@pytest.mark.parametrize('backend', ['onnx', 'onnx-int8'])
+def test_pan_export_matches_torch(tmp_path, monkeypatch, backend):
+    # Exported next to the test, not into models/onnx
+    monkeypatch.setattr(upscale_onnx, 'ONNX_DIR', str(tmp_path))
+    model = upscale_server.get_model('pan', 2, backend='torch')
+    path = upscale_onnx.ensure_exported('pan', 2, backend, lambda: model)
+
+    inputs = smooth_image(64)
+    with torch.no_grad():
+        reference = model(inputs).numpy()
+    output = upscale_onnx.OnnxUpscaler(path, threads=1)(inputs).numpy()
+    assert output.shape == reference.shape == (1, 3, 128, 128)
+    assert upscale_onnx.psnr(output, reference) >= upscale_onnx.PARITY_PSNR[backend]
+    assert upscale_onnx.max_error(output, reference) <= upscale_onnx.PARITY_MAX_ERROR[backend]
+
+
+def test_torch_fallback_is_cached_under_torch(monkeypatch):
+    # The ONNX backend is unavailable: get_model() hands back the PyTorch model
+    monkeypatch.setattr(upscale_server, 'get_model', lambda *args, **kwargs: conv_model(4))
+    stored = []
+    monkeypatch.setattr(upscale_server.result_cache, 'put', lambda key, data: stored.append(key))
+    buffer = io.BytesIO()
+    Image.new('RGB', (16, 16), (90, 120, 200)).save(buffer, 'PNG')
+    data = buffer.getvalue()
+
+    upscale_server.run_upscale(data, 'a.png', 'pan', 4, tile_size=0, backend='onnx')
+    key = lambda backend: upscale_server.make_key(data, op='upscale', model='pan', scale=4, denoise=None,
+                                                  tile_size=0, backend=backend,
+                                                  **upscale_server.parse_output_format({})[0].cache_params())
+    assert stored == [key('torch')]
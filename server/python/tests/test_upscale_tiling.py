@@ -0,0 +1,60 @@
+import pytest
+import torch
+
+from upscale_server import _feather, _tile_starts, upscale_tensor
+
+
+def conv_model(scale):
+    """Small deterministic super-resolution net (receptive field of 2 pixels)"""
+    torch.manual_seed(0)
+    model = torch.nn.Sequential(
+        torch.nn.Conv2d(3, 8, 3, padding=1),
+        torch.nn.ReLU(),
+        torch.nn.Conv2d(8, 3 * scale * scale, 3, padding=1),
+        torch.nn.PixelShuffle(scale)
+    )
+    return model.eval()
+
+
+@pytest.mark.parametrize('length,tile,overlap', [(100, 32, 8), (40, 32, 16), (33, 32, 8), (32, 32, 8), (10, 32, 8)])
+def test_tile_starts_cover_with_overlap(length, tile, overlap):
+    starts = _tile_starts(length, tile, overlap)
+    assert starts[0] == 0
+    assert starts[-1] + min(tile, length) == length
+    for a, b in zip(starts, starts[1:]):
+        assert b > a and a + tile - b >= overlap
+
+
+def test_feather_ramps_only_on_shared_edges():
+    weights = _feather(64, 16, fade_in=True, fade_out=False)
+    assert weights[-1] == 1 and weights[32] == 1
+    assert weights[0] < 0.01 and torch.all(weights[:16][1:] >= weights[:16][:-1])
+    assert torch.all(_feather(64, 16, False, False) == 1)
+
+
+@pytest.mark.parametrize('height,width,tile,overlap,scale', [
+    (70, 100, 32, 8, 2),   # edge tiles shorter than the stride
+    (40, 45, 32, 16, 4),   # overlap larger than the remainder
+    (64, 64, 32, 8, 3),
+])
+def test_tiled_matches_untiled(height, width, tile, overlap, scale):
+    model = conv_model(scale)
+    torch.manual_seed(1)
+    inputs = torch.rand(1, 3, height, width)
+    with torch.no_grad():
+        reference = model(inputs)
+    tiled = upscale_tensor(model, inputs, scale, tile_size=tile, overlap=overlap, batch_size=3)
+    assert tiled.shape == reference.shape
+    # Padded tile borders keep a near-zero blend weight: well under one 8-bit level
+    assert torch.allclose(tiled, reference, atol=1e-3)
+    assert (tiled - reference).abs().mean() < 1e-4
+
+
+def test_untiled_when_image_fits_in_a_tile():
+    model = conv_model(2)
+    inputs = torch.rand(1, 3, 20, 24)
+    calls = []
+    result = upscale_tensor(model, inputs, 2, tile_size=32, progress=lambda done, total: calls.append((done, total)))
+    assert calls == [(1, 1)]
+    with torch.no_grad():
+        assert torch.equal(result, model(inputs))
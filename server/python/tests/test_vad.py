@@ -0,0 +1,83 @@
+import numpy as np
+import pytest
+
+import vad
+
+SR = 16000
+
+
+def tone(seconds, freq=220.0, level=0.3):
+    """A voiced-like sound: a fundamental and harmonics inside the speech band"""
+    t = np.arange(int(seconds * SR)) / SR
+    wave = sum(np.sin(2 * np.pi * freq * k * t) / k for k in range(2, 8))
+    return (level * wave / np.abs(wave).max()).astype(np.float32)
+
+
+def quiet(seconds, seed=0):
+    return (np.random.default_rng(seed).standard_normal(int(seconds * SR)) * 1e-4).astype(np.float32)
+
+
+def test_tones_are_found_between_silences():
+    # speech at 1.0-3.0s and 5.0-6.5s
+    pcm = np.concatenate([quiet(1.0), tone(2.0), quiet(2.0, 1), tone(1.5, freq=180.0), quiet(1.0, 2)]) + quiet(7.5, 3)
+    regions = vad.speech_regions(pcm, SR)
+
+    assert len(regions) == 2
+    for (start, end), (expected_start, expected_end) in zip(regions, [(1.0, 3.0), (5.0, 6.5)]):
+        # Padded by PAD_SECONDS, give or take a frame
+        tolerance = vad.PAD_SECONDS + vad.FRAME_MS / 1000
+        assert abs(start / SR - expected_start) <= tolerance
+        assert abs(end / SR - expected_end) <= tolerance
+        assert start / SR <= expected_start + vad.FRAME_MS / 1000
+        assert end / SR >= expected_end - vad.FRAME_MS / 1000
+
+
+def test_short_pauses_are_merged_and_clicks_dropped():
+    pcm = np.concatenate([quiet(1.0), tone(1.0), quiet(0.2, 1), tone(1.0), quiet(1.0, 2),
+                          tone(0.1), quiet(1.0, 3)])
+    regions = vad.speech_regions(pcm, SR)
+    # The 0.2s pause is below MIN_SILENCE_SECONDS, the 0.1s click below MIN_SPEECH_SECONDS
+    assert len(regions) == 1
+    assert regions[0][1] / SR < 3.5
+
+
+def test_broadband_noise_is_not_speech():
+    noise = (np.random.default_rng(0).standard_normal(3 * SR) * 0.3).astype(np.float32)
+    pcm = np.concatenate([quiet(1.0), noise, quiet(1.0, 1)])
+    assert vad.speech_regions(pcm, SR) == []
+
+
+def test_pack_speech_inserts_gaps_between_regions():
+    pcm = np.arange(10 * SR, dtype=np.float32)
+    regions = [(1 * SR, 2 * SR), (4 * SR, 6 * SR)]
+    packed, _ = vad.pack_speech(pcm, regions, SR)
+
+    gap = int(vad.GAP_SECONDS * SR)
+    assert len(packed) == 3 * SR + gap
+    np.testing.assert_array_equal(packed[:SR], pcm[SR:2 * SR])
+    assert not packed[SR:SR + gap].any()
+    np.testing.assert_array_equal(packed[SR + gap:], pcm[4 * SR:6 * SR])
+
+
+def test_pack_speech_without_regions():
+    packed, timeline = vad.pack_speech(np.ones(SR, dtype=np.float32), [], SR)
+    assert len(packed) == 0
+    assert timeline.to_original(1.5) == 1.5
+
+
+def test_timeline_maps_packed_times_back():
+    regions = [(1 * SR, 2 * SR), (4 * SR, 6 * SR)]
+    _, timeline = vad.pack_speech(np.zeros(10 * SR, dtype=np.float32), regions, SR)
+    second = 1.0 + vad.GAP_SECONDS
+
+    assert timeline.to_original(0.0) == pytest.approx(1.0)
+    assert timeline.to_original(0.5) == pytest.approx(1.5)
+    # Inside the inserted gap: sticks to the end of the first region
+    assert timeline.to_original(1.0 + vad.GAP_SECONDS / 2) == pytest.approx(2.0)
+    assert timeline.to_original(second) == pytest.approx(4.0)
+    assert timeline.to_original(second + 1.5) == pytest.approx(5.5)
+
+    segments = timeline.remap([{'start': 0.25, 'end': second + 0.5,
+                                'words': [{'start': second, 'end': second + 0.5}]}])
+    assert segments[0]['start'] == 1.25 and segments[0]['end'] == 4.5
+    assert segments[0]['words'][0] == {'start': 4.0, 'end': 4.5}
@@ -0,0 +1,17 @@
+import os
+
+import torch
+
+import weight_store
+
+
+def test_save_only_replaces_other_versions_of_the_same_model(tmp_path, monkeypatch):
+    monkeypatch.setattr(weight_store, 'STORE_DIR', str(tmp_path))
+    neighbours = ['whisper-large-v2-1.0.pt', 'whisper-large-v3-1.0.pt', 'whisper-large-v3-turbo-1.0.pt']
+    for filename in neighbours + ['whisper-large-0.9.pt']:
+        (tmp_path / filename).write_bytes(b'')
+
+    path = os.path.join(str(tmp_path), 'whisper-large-1.0.pt')
+    weight_store._save(torch.nn.Linear(2, 2), 'whisper-large', path)
+
+    assert sorted(os.listdir(tmp_path)) == sorted(neighbours + ['whisper-large-1.0.pt'])
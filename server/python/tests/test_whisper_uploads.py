@@ -0,0 +1,112 @@
+import io
+import json
+import time
+import wave
+
+import numpy as np
+import pytest
+
+import whisper_server
+from audio import find_ffmpeg
+from benchmark import StubWhisperModel
+
+needs_ffmpeg = pytest.mark.skipif(find_ffmpeg() is None, reason='ffmpeg introuvable')
+
+
+def wav_bytes(seconds=12, sr=16000):
+    t = np.arange(int(seconds * sr)) / sr
+    samples = (np.sin(2 * np.pi * 440 * t) * 8000).astype(np.int16)
+    buffer = io.BytesIO()
+    with wave.open(buffer, 'wb') as f:
+        f.setnchannels(1)
+        f.setsampwidth(2)
+        f.setframerate(sr)
+        f.writeframes(samples.tobytes())
+    return buffer.getvalue()
+
+
+@pytest.fixture
+def client(monkeypatch):
+    whisper_server.registry.get('base', StubWhisperModel)
+    # Every upload above 10KB is spooled to a temp file
+    monkeypatch.setattr(whisper_server, 'UPLOAD_SPOOL_MB', 0.01)
+    return whisper_server.app.test_client()
+
+
+def test_oversized_body_is_refused_before_reading(client, monkeypatch):
+    monkeypatch.setitem(whisper_server.app.config, 'MAX_CONTENT_LENGTH', 1024)
+    response = client.post('/transcribe', data={'file': (io.BytesIO(b'x' * 4096), 'a.wav')})
+    assert response.status_code == 413
+    assert 'error' in response.json
+
+
+@needs_ffmpeg
+def test_spooled_upload_is_transcribed(client):
+    response = client.post('/transcribe', data={'file': (io.BytesIO(wav_bytes()), 'a.wav'), 'model': 'base'})
+    assert response.status_code == 200
+    assert len(response.json['segments']) == 3
+
+
+@needs_ffmpeg
+def test_job_and_stream_outlive_the_request(client):
+    response = client.post('/jobs', data={'file': (io.BytesIO(wav_bytes()), 'a.wav'), 'model': 'base'})
+    assert response.status_code == 202
+    job_id = response.json['id']
+    for _ in range(200):
+        state = client.get(f'/jobs/{job_id}').json['state']
+        if state in ('done', 'error'):
+            break
+        time.sleep(0.05)
+    assert state == 'done'
+    assert len(client.get(f'/jobs/{job_id}/result').json['segments']) == 3
+
+    response = client.post('/transcribe/stream', data={'file': (io.BytesIO(wav_bytes()), 'a.wav'), 'model': 'base'})
+    events = [json.loads(line) for line in response.get_data(as_text=True).splitlines()]
+    assert events[-1]['type'] == 'done'
+    assert events[-1]['segments'] == 3
+
+
+@pytest.fixture
+def cache(monkeypatch, tmp_path):
+    from result_cache import ResultCache
+    from transcript_cache import TranscriptCache
+    cache = TranscriptCache(str(tmp_path))
+    cache.audio = ResultCache(str(tmp_path / 'audio'), max_mb=16)
+    cache.transcripts = ResultCache(str(tmp_path / 'transcripts'), max_mb=16)
+    monkeypatch.setattr(whisper_server, 'transcript_cache', cache)
+    return cache
+
+
+@needs_ffmpeg
+def test_resubmitted_stream_reads_the_cached_audio(client, cache, monkeypatch):
+    def stream(language):
+        response = client.post('/transcribe/stream', data={'file': (io.BytesIO(wav_bytes()), 'a.wav'),
+                                                           'model': 'base', 'language': language})
+        return [json.loads(line) for line in response.get_data(as_text=True).splitlines()]
+
+    assert stream('fr')[-1]['type'] == 'done'
+
+    def no_decode(*args, **kwargs):
+        raise AssertionError('decoded again')
+
+    # Another language: not in the cache, streamed from the cached audio, never decoded or loaded whole
+    monkeypatch.setattr(whisper_server, 'decode_audio', no_decode)
+    monkeypatch.setattr(whisper_server, 'iter_pcm', no_decode)
+    monkeypatch.setattr(whisper_server, 'iter_windows', no_decode)
+    done = stream('en')[-1]
+    assert done['type'] == 'done'
+    assert done['segments'] == 3
+    assert done['cache']['audio'] == 'HIT'
+
+
+def test_batch_results_carry_a_transcript_id(client, cache, monkeypatch):
+    result = {'success': True, 'text': 'bonjour', 'language': 'fr', 'duration': 1.0, 'seconds': 0.1,
+              'segments': [{'start': 0.0, 'end': 1.0, 'text': 'bonjour'}], 'fingerprint': 'ab' * 32}
+    monkeypatch.setattr(whisper_server.transcribe_pool, 'map', lambda payloads, *args: ([dict(result)], {
+        'files': 1, 'audio_seconds': 1.0, 'wall_seconds': 0.1, 'audio_hours_per_hour': 10}))
+
+    response = client.post('/transcribe/batch', data={'files': [(io.BytesIO(b'audio'), 'a.wav')]})
+    transcript_id = response.json['results'][0]['transcript_id']
+    assert transcript_id and 'fingerprint' not in response.json['results'][0]
+    srt = client.get(f'/transcripts/{transcript_id}/srt').get_data(as_text=True)
+    assert 'bonjour' in srt
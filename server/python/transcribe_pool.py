@@ -0,0 +1,198 @@
+"""
+Process pool for multi-file transcription (/transcribe/batch).
+One Whisper forward pass stops scaling after a few threads, so large machines
+run several replicas side by side: each worker process is pinned to its own
+slice of cores and keeps its own copy of the model.
+The slices are cut from the cores the server process may run on: under
+serve.py each server worker is pinned to its own share first, so the pools of
+two workers never land on the same cores.
+
+The replicas are separate processes, outside the server's ModelRegistry:
+AI_MODEL_MEMORY_MB does not cover them. The weights are memory-mapped from
+weight_store, so the pool adds about one copy of the model (shared page cache)
+plus each replica's activations; size WHISPER_POOL_WORKERS for that.
+
+Configuration:
+  WHISPER_POOL_THREADS   cores per replica (default 4)
+  WHISPER_POOL_WORKERS   replicas (default: cores / threads / server workers)
+"""
+import io
+import multiprocessing
+import os
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+POOL_THREADS = 4
+
+
+def _env_int(name, default):
+    try:
+        return int(os.environ.get(name, default))
+    except ValueError:
+        return default
+
+
+# --- Worker process side ---
+
+_model = None
+_model_name = None
+
+
+def _init_worker(counter, threads):
+    """Pin this worker to its slice of the inherited cores (Linux) and size torch's pool to it"""
+    with counter.get_lock():
+        index = counter.value
+        counter.value += 1
+    cores = sorted(os.sched_getaffinity(0)) if hasattr(os, 'sched_getaffinity') else list(range(os.cpu_count() or 1))
+    slices = max(len(cores) // threads, 1)
+    mine = cores[(index % slices) * threads:(index % slices + 1) * threads] or cores
+    if hasattr(os, 'sched_setaffinity'):
+        os.sched_setaffinity(0, mine)
+    from warmup import import_torch
+    import_torch().set_num_threads(len(mine))
+    print(f"🧵 Whisper pool: réplique {index} sur les cœurs {mine[0]}-{mine[-1]}")
+
+
+def _get_model(model_name):
+    # One resident model per replica: switching models replaces it
+    global _model, _model_name
+    if _model_name != model_name:
+        import whisper
+        import weight_store
+        _model = None
+        # Replicas map the same converted weights: one copy in RAM for the whole pool
+        _model = weight_store.load(f'whisper-{model_name}', lambda: whisper.load_model(model_name),
+                                   package='openai-whisper')
+        _model_name = model_name
+    return _model
+
+
+def transcribe_file(data, model_name, language=None, use_vad=False, words=False):
+    """Decode and transcribe one file inside a replica, returns a JSON-ready dict"""
+    from audio import decode_audio, SAMPLE_RATE
+    from segments import clean_segments
+    from transcript_cache import pcm_fingerprint
+    start = time.perf_counter()
+    pcm = decode_audio(io.BytesIO(data))
+    duration = len(pcm) / SAMPLE_RATE
+    # Lets the server file the result in its transcript cache without the audio
+    fingerprint = pcm_fingerprint(pcm)
+
+    timeline = vad_info = None
+    if use_vad:
+        from vad import speech_regions, pack_speech, vad_report
+        regions = speech_regions(pcm)
+        pcm, timeline = pack_speech(pcm, regions)
+        vad_info = vad_report(int(duration * SAMPLE_RATE), regions)
+
+    options = {'fp16': False}
+    if language:
+        options['language'] = language
+    if words:
+        options['word_timestamps'] = True
+    if len(pcm):
+        result = _get_model(model_name).transcribe(pcm, **options)
+    else:
+        result = {'text': '', 'language': language, 'segments': []}
+
+    segments = clean_segments(result.get('segments', []))
+    if timeline:
+        timeline.remap(segments)
+
+    response = {
+        'success': True,
+        'text': result['text'].strip(),
+        'language': result.get('language') or 'unknown',
+        'duration': round(duration, 2),
+        'segments': segments,
+        'seconds': round(time.perf_counter() - start, 2),
+        'fingerprint': fingerprint
+    }
+    if vad_info:
+        response['vad'] = vad_info
+    return response
+
+
+# --- Server side ---
+
+class TranscribePool:
+    """Lazily started pool of pinned Whisper replicas"""
+
+    def __init__(self, workers=None, threads=None):
+        cores = len(os.sched_getaffinity(0)) if hasattr(os, 'sched_getaffinity') else (os.cpu_count() or 1)
+        self.threads = max(threads or _env_int('WHISPER_POOL_THREADS', POOL_THREADS), 1)
+        server_workers = max(_env_int('AI_WORKERS', 1), 1)
+        default_workers = max(cores // self.threads // server_workers, 1)
+        self.workers = max(workers or _env_int('WHISPER_POOL_WORKERS', default_workers), 1)
+        self.files = 0
+        self.audio_seconds = 0.0
+        self.busy_seconds = 0.0
+        self._pending = 0
+        self._lock = threading.Lock()
+        self._executor = None
+        self._executor_pid = None
+
+    def _pool(self):
+        # Spawned, not forked: the server process already runs threads. Created per process.
+        if self._executor is None or self._executor_pid != os.getpid():
+            context = multiprocessing.get_context('spawn')
+            self._executor = ProcessPoolExecutor(
+                max_workers=self.workers,
+                mp_context=context,
+                initializer=_init_worker,
+                initargs=(context.Value('i', 0), self.threads)
+            )
+            self._executor_pid = os.getpid()
+        return self._executor
+
+    def map(self, payloads, model_name, language=None, use_vad=False, words=False):
+        """Transcribe every payload across the replicas; one result (or error dict) per payload, in order"""
+        with self._lock:
+            self._pending += len(payloads)
+        start = time.perf_counter()
+        futures = [self._pool().submit(transcribe_file, data, model_name, language, use_vad, words)
+                   for data in payloads]
+        results = []
+        for future in futures:
+            try:
+                results.append(future.result())
+            except BrokenProcessPool as e:
+                # A replica died (e.g. out of memory): start a fresh pool next time
+                self._executor = None
+                results.append({'success': False, 'error': f'Erreur de transcription: {e}'})
+            except Exception as e:
+                results.append({'success': False, 'error': f'Erreur de transcription: {e}'})
+            with self._lock:
+                self._pending -= 1
+        wall = time.perf_counter() - start
+
+        audio = sum(r.get('duration', 0) for r in results)
+        with self._lock:
+            self.files += len(payloads)
+            self.audio_seconds += audio
+            self.busy_seconds += wall
+        return results, {
+            'files': len(payloads),
+            'audio_seconds': round(audio, 2),
+            'wall_seconds': round(wall, 2),
+            'audio_hours_per_hour': round(audio / wall, 2) if wall else 0,
+            'replicas': self.workers,
+            'threads_per_replica': self.threads
+        }
+
+    def depth(self):
+        with self._lock:
+            return self._pending
+
+    def stats(self):
+        with self._lock:
+            return {
+                'replicas': self.workers,
+                'threads_per_replica': self.threads,
+                'started': self._executor is not None and self._executor_pid == os.getpid(),
+                'pending': self._pending,
+                'files': self.files,
+                'audio_hours_per_hour': round(self.audio_seconds / self.busy_seconds, 2) if self.busy_seconds else 0
+            }
@@ -0,0 +1,242 @@
+"""
+Transcription cache for the Whisper server, in two disk-backed LRU layers
+(result_cache.ResultCache, each bounded by AI_RESULT_CACHE_MB):
+- decoded audio: the 16 kHz PCM of each uploaded file, so another model or
+  language skips ffmpeg;
+- transcripts, keyed by a fingerprint of the decoded PCM, so a re-encoded or
+  re-tagged copy of a recording finds the same entries: the language detected
+  for the recording, whole results per model and options, and the per-window
+  results of the windowed paths (/jobs, /transcribe/stream), which let an
+  interrupted job resume where it stopped.
+The upload -> fingerprint link is kept with the transcripts: a repeated request
+is answered without reading the audio back.
+"""
+import hashlib
+import json
+import os
+import re
+
+import numpy as np
+
+from result_cache import ResultCache, make_key
+
+_TRANSCRIPT_ID = re.compile(r'^[0-9a-f]{64}$')
+# Samples per chunk read back from the audio cache (one 30s Whisper window at 16 kHz)
+CHUNK_SAMPLES = 30 * 16000
+
+
+def pcm_fingerprint(pcm):
+    """Identity of a recording: sha256 of its decoded 16 kHz PCM"""
+    return hashlib.sha256(memoryview(np.ascontiguousarray(pcm)).cast('B')).hexdigest()
+
+
+class TranscriptCache:
+    def __init__(self, directory):
+        self.audio = ResultCache(os.path.join(directory, 'whisper-audio'))
+        self.transcripts = ResultCache(os.path.join(directory, 'whisper'))
+
+    @property
+    def enabled(self):
+        return self.transcripts.enabled
+
+    def get_json(self, key):
+        data = self.transcripts.get(key) if self.enabled else None
+        return json.loads(data) if data is not None else None
+
+    def put_json(self, key, value):
+        if self.enabled:
+            self.transcripts.put(key, json.dumps(value, ensure_ascii=False).encode('utf-8'))
+
+    def open(self, data):
+        """Recording view of an uploaded file"""
+        return Recording(self, data)
+
+    def transcript(self, transcript_id):
+        """Finished transcription by the id returned with it, or None (unknown or evicted)"""
+        if not _TRANSCRIPT_ID.match(transcript_id or ''):
+            return None
+        result = self.get_json(transcript_id)
+        return result if isinstance(result, dict) and 'segments' in result else None
+
+    def stats(self):
+        return {'audio': self.audio.stats(), 'transcripts': self.transcripts.stats()}
+
+
+class Recording:
+    """
+    One uploaded file as seen by the cache. `status` collects what was served
+    from the cache (HIT / MISS per layer) and is reported in the responses.
+    """
+
+    def __init__(self, cache, data):
+        self.cache = cache
+        self.data = data
+        self.upload = make_key(data, op='upload') if cache.enabled else None
+        link = cache.get_json(make_key(b'', op='link', upload=self.upload)) if self.upload else None
+        self.fingerprint = link['fingerprint'] if link else None
+        self.status = {'transcript': 'MISS', 'audio': None, 'language': None}
+        # Cache key of the result, handed out so subtitles can be rendered from it later
+        self.transcript_id = None
+        self._language = None
+        self._windows = []
+
+    def _key(self, kind, **params):
+        return make_key(self.fingerprint.encode('ascii'), kind=kind, **params)
+
+    def pcm(self, decode):
+        """Decoded audio, from the cache or decode(data) (then cached)"""
+        cached = self.cache.audio.get(self.upload) if self.upload else None
+        if cached is not None:
+            self.status['audio'] = 'HIT'
+            # bytearray: callers get a writable array, as from decode_audio
+            pcm = np.frombuffer(bytearray(cached), np.float32)
+            if self.fingerprint is None:
+                self.set_audio(pcm, store=False)
+            return pcm
+        self.status['audio'] = 'MISS'
+        pcm = decode(self.data)
+        self.set_audio(pcm)
+        return pcm
+
+    def stream(self, decode_chunks, chunk_samples=CHUNK_SAMPLES):
+        """
+        PCM chunks of the recording, never the whole audio at once: read back from the
+        audio cache, else decode_chunks() (a decoder's chunk stream) through collect()
+        """
+        source = self.cache.audio.open(self.upload) if self.upload else None
+        if source is None:
+            return self.collect(decode_chunks())
+        self.status['audio'] = 'HIT'
+        return self._read(source, chunk_samples)
+
+    def _read(self, source, chunk_samples):
+        # The link may have been evicted while the audio was not: fingerprinted on the way
+        digest = hashlib.sha256() if self.fingerprint is None else None
+        with source:
+            for data in iter(lambda: source.read(chunk_samples * 4), b''):
+                if digest:
+                    digest.update(data)
+                # bytearray: callers get writable arrays, as from the decoder
+                yield np.frombuffer(bytearray(data), np.float32)
+        if digest:
+            self.link(digest.hexdigest())
+
+    def collect(self, chunks):
+        """
+        Pass PCM chunks through while they are decoded. Each chunk is hashed and
+        written to the audio cache as it goes, so the whole audio is never held
+        in memory; the entry and the fingerprint are committed at the end.
+        """
+        if not self.cache.enabled:
+            yield from chunks
+            return
+        self.status['audio'] = 'MISS'
+        digest = hashlib.sha256()
+        writer = self.cache.audio.writer(self.upload)
+        complete = False
+        try:
+            for chunk in chunks:
+                data = memoryview(np.ascontiguousarray(chunk)).cast('B')
+                digest.update(data)
+                writer.write(data)
+                yield chunk
+            complete = True
+        finally:
+            if not complete:
+                # Decoding failed or the consumer stopped: no partial audio in the cache
+                writer.abort()
+        writer.commit()
+        self.link(digest.hexdigest())
+
+    def set_audio(self, pcm, store=True):
+        """Fingerprint the decoded audio, store it and flush the results computed before it was known"""
+        if not self.cache.enabled:
+            return
+        if store:
+            self.cache.audio.put(self.upload, memoryview(np.ascontiguousarray(pcm)).cast('B'))
+        self.link(pcm_fingerprint(pcm))
+
+    def link(self, fingerprint):
+        """Tie the upload to the recording's fingerprint (pcm_fingerprint of its audio)"""
+        self.fingerprint = fingerprint
+        self.cache.put_json(make_key(b'', op='link', upload=self.upload), {'fingerprint': self.fingerprint})
+        for windows in self._windows:
+            windows.flush()
+
+    def language(self):
+        """Language detected on an earlier transcription of this recording, or None"""
+        if self._language is None and self.fingerprint is not None:
+            entry = self.cache.get_json(self._key('language'))
+            self.status['language'] = 'HIT' if entry else 'MISS'
+            self._language = entry['language'] if entry else None
+        return self._language
+
+    def remember_language(self, language, model):
+        if language and self.fingerprint is not None and self._language is None:
+            self._language = language
+            self.cache.put_json(self._key('language'), {'language': language, 'model': model})
+
+    def result(self, model, language=None, **params):
+        """Cached result for these options, or None. Without a language, the detected one is used."""
+        if self.fingerprint is None:
+            return None
+        language = language or self.language()
+        key = self._key('result', model=model, language=language, **params)
+        result = self.cache.get_json(key)
+        self.status['transcript'] = 'HIT' if result is not None else 'MISS'
+        if result is not None:
+            self.transcript_id = key
+        return result
+
+    def store_result(self, result, model, language=None, **params):
+        """Stored under the language it was transcribed with, requested or detected"""
+        detected = result.get('language')
+        if not language and detected and detected != 'unknown':
+            self.remember_language(detected, model)
+            language = detected
+        if self.fingerprint is not None:
+            self.transcript_id = self._key('result', model=model, language=language, **params)
+            self.cache.put_json(self.transcript_id, result)
+
+    def windows(self, model, language=None, **params):
+        """Per-window result cache for transcribe_windows()"""
+        windows = WindowCache(self, dict(params, model=model, language=language))
+        self._windows.append(windows)
+        return windows
+
+
+class WindowCache:
+    """Results of the 30s windows of one recording and set of options, by window index"""
+
+    def __init__(self, recording, params):
+        self.recording = recording
+        self.params = params
+        self.hits = 0
+        self._pending = []
+
+    def get(self, index):
+        if self.recording.fingerprint is None:
+            return None
+        entry = self.recording.cache.get_json(self.recording._key('window', index=index, **self.params))
+        if entry is not None:
+            self.hits += 1
+        return entry
+
+    def put(self, index, entry):
+        if not self.recording.cache.enabled:
+            return
+        # Serialized now: the caller may remap the segments afterwards
+        data = json.dumps(entry, ensure_ascii=False).encode('utf-8')
+        if self.recording.fingerprint is None:
+            # Streamed decode: the fingerprint is only known once the audio is complete
+            self._pending.append((index, data))
+        else:
+            self._write(index, data)
+
+    def flush(self):
+        pending, self._pending = self._pending, []
+        for index, data in pending:
+            self._write(index, data)
+
+    def _write(self, index, data):
+        self.recording.cache.transcripts.put(self.recording._key('window', index=index, **self.params), data)
@@ -0,0 +1,222 @@
+"""
+Cost estimation and routing for upscale jobs.
+Inference time and peak memory are predicted from the input size, the model,
+the scale and the backend with per-model coefficients measured by
+calibrate_upscale.py (rough built-in defaults until then):
+  seconds = overhead + seconds_per_mp * megapixels fed to the network / speedup(threads)
+  memory  = activations (per input megapixel, or per tile batch when tiled)
+            + the output buffers (per output pixel)
+The job is then routed to the first strategy that fits the budgets:
+  direct   whole image in one forward pass (it fits in a tile, or tiling is off)
+  tiled    tile by tile: bounded activations, a little more compute for the overlaps
+  lighter  a faster, smaller model at the same scale: same output size, less detail
+  downscale  a lower scale (same model first, then the lighter ones): the output buffers
+           grow with the square of the scale, so this is what brings huge jobs under budget
+  reject   nothing fits: the request is refused with the estimate
+Without calibrated coefficients for the requested setup, the defaults are only
+guesses: the job is tiled when they say so, otherwise it runs as requested and
+the estimate is only reported. Lighter models, lower scales and refusals need
+calibrated figures (and lighter/downscale candidates calibrated ones of their own).
+
+Configuration:
+  UPSCALE_ROUTING           0 to only report the estimate (every job runs as requested)
+  UPSCALE_MAX_SECONDS       predicted inference time budget (default 300)
+  UPSCALE_MAX_MEMORY_MB     predicted memory budget (default half of the physical memory)
+  UPSCALE_ALLOW_DOWNSCALE   0 to reject rather than lower the scale
+  UPSCALE_CALIBRATION_FILE  coefficients file (default models/calibration/upscale.json)
+"""
+import json
+import math
+import os
+
+from cpu_scheduler import PARALLEL_FRACTION, speedup
+
+PROJECT_ROOT = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+CALIBRATION_FILE = os.environ.get('UPSCALE_CALIBRATION_FILE') or \
+    os.path.join(PROJECT_ROOT, "models", "calibration", "upscale.json")
+
+ROUTING = os.environ.get('UPSCALE_ROUTING', '1').lower() not in ('0', 'false', 'no', 'off')
+MAX_SECONDS = float(os.environ.get('UPSCALE_MAX_SECONDS', 300))
+ALLOW_DOWNSCALE = os.environ.get('UPSCALE_ALLOW_DOWNSCALE', '1').lower() not in ('0', 'false', 'no', 'off')
+
+
+def _physical_memory_mb():
+    try:
+        return os.sysconf('SC_PAGE_SIZE') * os.sysconf('SC_PHYS_PAGES') / (1024 * 1024)
+    except (ValueError, OSError, AttributeError):
+        return 8192
+
+
+MAX_MEMORY_MB = float(os.environ.get('UPSCALE_MAX_MEMORY_MB') or _physical_memory_mb() / 2)
+
+# Lightest to heaviest: 'lighter' tries the models before the requested one, heaviest first
+MODEL_ORDER = ('pan', 'edsr', 'msrn', 'drln')
+
+# Uncalibrated single-thread figures per input megapixel, from the model sizes, for x4
+# (pessimistic for x2/x3: the upsampling layers run at the output resolution)
+DEFAULT_COEFFICIENTS = {
+    'pan': {'seconds_per_mp': 12.0, 'mb_per_mp': 5000.0, 'overhead': 0.1},
+    'edsr': {'seconds_per_mp': 60.0, 'mb_per_mp': 10000.0, 'overhead': 0.1},
+    'msrn': {'seconds_per_mp': 240.0, 'mb_per_mp': 12000.0, 'overhead': 0.2},
+    'drln': {'seconds_per_mp': 1400.0, 'mb_per_mp': 15000.0, 'overhead': 0.5}
+}
+
+# Bytes per output pixel held outside the network: the float32 result (plus the blend
+# weights when tiled), then the uint8 array and the PIL image
+OUTPUT_BYTES_DIRECT = 12 + 3 + 3
+OUTPUT_BYTES_TILED = 12 + 4 + 3 + 3
+SCALES = (2, 3, 4)
+
+PARALLEL = PARALLEL_FRACTION['upscale']
+
+
+def coefficient_key(model, scale, backend):
+    return f"{model}-x{scale}-{backend}"
+
+
+def load_calibration(path=CALIBRATION_FILE):
+    """Coefficients by coefficient_key(), {} when the server has not been calibrated"""
+    try:
+        with open(path, encoding='utf-8') as f:
+            return json.load(f).get('coefficients', {})
+    except (OSError, ValueError):
+        return {}
+
+
+def save_calibration(coefficients, path=CALIBRATION_FILE, **info):
+    """Merged into the existing file: a partial calibration keeps the other models"""
+    merged = load_calibration(path)
+    merged.update(coefficients)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, 'w', encoding='utf-8') as f:
+        json.dump({'coefficients': merged, **info}, f, indent=2, sort_keys=True)
+    return merged
+
+
+def _tile_count(length, tile, overlap):
+    # Same cover as upscale_server._tile_starts()
+    if length <= tile:
+        return 1
+    return math.ceil((length - tile) / max(tile - overlap, 1)) + 1
+
+
+class Estimate:
+    """Predicted cost of one way to run a job"""
+
+    def __init__(self, model, scale, backend, strategy, seconds, memory_mb, tile_size, calibrated):
+        self.model = model
+        self.scale = scale
+        self.backend = backend
+        self.strategy = strategy
+        self.seconds = seconds
+        self.memory_mb = memory_mb
+        self.tile_size = tile_size
+        self.calibrated = calibrated
+        # Measured by run_upscale (None on a cache hit)
+        self.actual_seconds = None
+        self.actual_memory_mb = None
+
+    def fits(self, max_seconds=MAX_SECONDS, max_memory_mb=MAX_MEMORY_MB):
+        return self.seconds <= max_seconds and self.memory_mb <= max_memory_mb
+
+    def to_dict(self):
+        data = {
+            'strategy': self.strategy,
+            'model': self.model,
+            'scale': self.scale,
+            'backend': self.backend,
+            'tile_size': self.tile_size,
+            'seconds': round(self.seconds, 2),
+            'memory_mb': round(self.memory_mb, 1),
+            'calibrated': self.calibrated
+        }
+        if self.actual_seconds is not None:
+            data.update(actual_seconds=round(self.actual_seconds, 2), actual_memory_mb=round(self.actual_memory_mb, 1))
+        return data
+
+
+class CostModel:
+    def __init__(self, coefficients=None, threads=1, tile_overlap=16, tile_batch=4):
+        self.coefficients = load_calibration() if coefficients is None else coefficients
+        self.threads = max(int(threads or 1), 1)
+        self.tile_overlap = tile_overlap
+        self.tile_batch = max(tile_batch, 1)
+
+    def _coefficients(self, model, scale, backend):
+        """(coefficients, calibrated): this exact setup, else the torch run of it, else the defaults"""
+        for key in (coefficient_key(model, scale, backend), coefficient_key(model, scale, 'torch')):
+            if key in self.coefficients:
+                return self.coefficients[key], True
+        return DEFAULT_COEFFICIENTS.get(model, DEFAULT_COEFFICIENTS['pan']), False
+
+    def estimate(self, width, height, model, scale, backend='torch', tile_size=0):
+        coefficients, calibrated = self._coefficients(model, scale, backend)
+        mp = width * height / 1e6
+        out_mp = mp * scale * scale
+        if tile_size <= 0 or (width <= tile_size and height <= tile_size):
+            fed_mp = mp
+            activations = coefficients['mb_per_mp'] * mp
+            output_mb = OUTPUT_BYTES_DIRECT * out_mp
+            strategy = 'direct'
+        else:
+            overlap = min(self.tile_overlap, tile_size // 2)
+            tile_w, tile_h = min(tile_size, width), min(tile_size, height)
+            tiles = _tile_count(width, tile_w, overlap) * _tile_count(height, tile_h, overlap)
+            fed_mp = tiles * tile_w * tile_h / 1e6
+            activations = coefficients['mb_per_mp'] * tile_w * tile_h / 1e6 * min(self.tile_batch, tiles)
+            output_mb = OUTPUT_BYTES_TILED * out_mp
+            strategy = 'tiled'
+        seconds = coefficients['overhead'] + coefficients['seconds_per_mp'] * fed_mp / speedup(self.threads, PARALLEL)
+        return Estimate(model, scale, backend, strategy, seconds, activations + output_mb,
+                        tile_size if strategy == 'tiled' else 0, calibrated)
+
+    def route(self, width, height, model, scale, backend='torch', tile_size=0, default_tile=256,
+              max_seconds=MAX_SECONDS, max_memory_mb=MAX_MEMORY_MB, allow_downscale=ALLOW_DOWNSCALE):
+        """
+        Strategy for a job: the requested setup when it fits, else tiled, else a lighter
+        model, else a lower scale. Returns (estimate, tried): estimate.strategy is
+        'reject' when nothing fits. Uncalibrated, it stops after tiling and runs as asked.
+        """
+        requested = self.estimate(width, height, model, scale, backend, tile_size)
+        tried = [requested]
+        if requested.fits(max_seconds, max_memory_mb):
+            return requested, tried
+
+        # Tiling bounds the activations; it only adds time, so a job over the time budget stays over it
+        tile = tile_size if requested.strategy == 'tiled' else default_tile
+        tiled = requested
+        if requested.strategy == 'direct' and requested.memory_mb > max_memory_mb and \
+                tile > 0 and (width > tile or height > tile):
+            tiled = self.estimate(width, height, model, scale, backend, tile)
+            tried.append(tiled)
+            if tiled.fits(max_seconds, max_memory_mb):
+                return tiled, tried
+
+        if not requested.calibrated:
+            # Default coefficients: not enough to change the model or the scale, or to refuse
+            return tiled, tried
+
+        # Same layout as requested unless that one was over the memory budget
+        layout = requested.tile_size if requested.memory_mb <= max_memory_mb else tile
+        lighter_models = list(reversed(MODEL_ORDER[:MODEL_ORDER.index(model)])) if model in MODEL_ORDER else []
+        for lighter in lighter_models:
+            candidate = self.estimate(width, height, lighter, scale, backend, layout)
+            candidate.strategy = 'lighter'
+            tried.append(candidate)
+            if candidate.calibrated and candidate.fits(max_seconds, max_memory_mb):
+                return candidate, tried
+
+        if allow_downscale:
+            for lower in sorted((s for s in SCALES if s < scale), reverse=True):
+                for candidate_model in [model] + lighter_models:
+                    candidate = self.estimate(width, height, candidate_model, lower, backend, tile)
+                    candidate.strategy = 'downscale'
+                    tried.append(candidate)
+                    if candidate.calibrated and candidate.fits(max_seconds, max_memory_mb):
+                        return candidate, tried
+
+        # Refused with the cost of what was asked for (tiled if that was the way to run it)
+        asked = requested if requested.memory_mb <= max_memory_mb else tiled
+        rejected = Estimate(model, scale, backend, 'reject', asked.seconds, asked.memory_mb,
+                            asked.tile_size, asked.calibrated)
+        return rejected, tried
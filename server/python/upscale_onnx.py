@@ -0,0 +1,182 @@
+"""
+ONNX Runtime backend for the upscale models.
+Each (model, scale) pair is exported to ONNX once from its PyTorch weights and
+cached under models/onnx/, optionally with dynamic INT8 quantization.
+
+Backends: 'torch' (eager PyTorch), 'onnx' (FP32 graph), 'onnx-int8' (quantized).
+
+Parity check (PSNR of ONNX output against PyTorch):
+  python upscale_onnx.py --model pan --scale 4 [--backend onnx-int8]
+"""
+import inspect
+import os
+import tempfile
+
+import numpy as np
+
+from warmup import import_torch
+
+BACKENDS = ('torch', 'onnx', 'onnx-int8')
+
+PROJECT_ROOT = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+ONNX_DIR = os.path.join(PROJECT_ROOT, "models", "onnx")
+
+# Minimum PSNR (dB) against PyTorch for the parity check
+PARITY_PSNR = {'onnx': 45.0, 'onnx-int8': 30.0}
+# Largest per-pixel difference allowed (on the [0, 1] scale)
+PARITY_MAX_ERROR = {'onnx': 1e-3, 'onnx-int8': 0.1}
+
+
+def onnx_path(model_key, scale, backend='onnx'):
+    suffix = '-int8' if backend == 'onnx-int8' else ''
+    return os.path.join(ONNX_DIR, f"{model_key}-x{scale}{suffix}.onnx")
+
+
+def _temp_path(path):
+    """Unique temp file next to `path`: concurrent exports (workers, threads) never share one"""
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), prefix=os.path.basename(path) + '.',
+                                    suffix='.tmp')
+    os.close(fd)
+    return tmp_path
+
+
+def _publish(tmp_path, path, write):
+    """write(tmp_path) then atomic rename to `path`; the temp file never outlives a failure"""
+    try:
+        write(tmp_path)
+        os.replace(tmp_path, path)
+    finally:
+        if os.path.exists(tmp_path):
+            os.unlink(tmp_path)
+
+
+def export_onnx(model, path):
+    """Export a super-image model with dynamic batch/height/width axes (atomic write)"""
+    torch = import_torch()
+    kwargs = {}
+    if 'dynamo' in inspect.signature(torch.onnx.export).parameters:
+        # The TorchScript exporter handles these conv nets with dynamic shapes
+        kwargs['dynamo'] = False
+    axes = {0: 'batch', 2: 'height', 3: 'width'}
+    model.eval()
+
+    def write(tmp_path):
+        with torch.no_grad():
+            torch.onnx.export(
+                model,
+                (torch.rand(1, 3, 64, 64),),
+                tmp_path,
+                input_names=['input'],
+                output_names=['output'],
+                dynamic_axes={'input': axes, 'output': axes},
+                opset_version=17,
+                **kwargs
+            )
+
+    _publish(_temp_path(path), path, write)
+
+
+def quantize_int8(src_path, dst_path):
+    """Dynamic INT8 quantization of the weights (activations stay FP32)"""
+    from onnxruntime.quantization import quantize_dynamic, QuantType
+    _publish(_temp_path(dst_path), dst_path,
+             lambda tmp_path: quantize_dynamic(src_path, tmp_path, weight_type=QuantType.QUInt8))
+
+
+def ensure_exported(model_key, scale, backend, load_torch_model):
+    """Path of the cached graph for (model, scale, backend), exporting it on first use"""
+    fp32_path = onnx_path(model_key, scale, 'onnx')
+    if not os.path.exists(fp32_path):
+        print(f"📤 Export ONNX de {model_key} x{scale}...")
+        export_onnx(load_torch_model(), fp32_path)
+    if backend == 'onnx':
+        return fp32_path
+
+    int8_path = onnx_path(model_key, scale, 'onnx-int8')
+    if not os.path.exists(int8_path):
+        print(f"🗜️ Quantification INT8 de {model_key} x{scale}...")
+        quantize_int8(fp32_path, int8_path)
+    return int8_path
+
+
+class OnnxUpscaler:
+    """Callable drop-in for a super-image model: (N, 3, H, W) tensor in, upscaled tensor out"""
+
+    def __init__(self, path, threads=None):
+        import onnxruntime as ort
+        self._torch = import_torch()
+        options = ort.SessionOptions()
+        options.intra_op_num_threads = threads or self._torch.get_num_threads()
+        options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+        self.path = path
+        self.session = ort.InferenceSession(path, sess_options=options, providers=["CPUExecutionProvider"])
+
+    def __call__(self, inputs):
+        array = inputs.detach().cpu().numpy().astype(np.float32, copy=False)
+        output = self.session.run(None, {'input': array})[0]
+        return self._torch.from_numpy(output)
+
+    def size_mb(self):
+        return os.path.getsize(self.path) / (1024 * 1024)
+
+
+def load_onnx_model(model_key, scale, backend, load_torch_model):
+    path = ensure_exported(model_key, scale, backend, load_torch_model)
+    return OnnxUpscaler(path)
+
+
+def psnr(a, b):
+    """PSNR in dB between two images in [0, 1]"""
+    mse = float(np.mean((np.clip(a, 0, 1) - np.clip(b, 0, 1)) ** 2))
+    return float('inf') if mse == 0 else 10 * np.log10(1.0 / mse)
+
+
+def max_error(a, b):
+    """Largest per-pixel difference between two images in [0, 1]"""
+    return float(np.abs(np.clip(a, 0, 1) - np.clip(b, 0, 1)).max())
+
+
+def main():
+    import argparse
+    import time
+    import upscale_server
+    torch = import_torch()
+
+    parser = argparse.ArgumentParser(description='PSNR parity check of the ONNX backends against PyTorch')
+    parser.add_argument('--model', default='pan')
+    parser.add_argument('--scale', type=int, default=4)
+    parser.add_argument('--backend', choices=BACKENDS[1:], default=None, help='Default: both ONNX backends')
+    parser.add_argument('--size', type=int, default=128, help='Side of the synthetic test image')
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(0)
+    # Smooth gradient plus texture, closer to a photo than pure noise
+    y, x = np.mgrid[0:args.size, 0:args.size] / args.size
+    image = np.stack([x, y, (x + y) / 2], axis=0) * 0.7 + rng.random((3, args.size, args.size)) * 0.3
+    inputs = torch.from_numpy(image[None].astype(np.float32))
+
+    reference_model = upscale_server.get_model(args.model, args.scale, backend='torch')
+    start = time.perf_counter()
+    with torch.no_grad():
+        reference = reference_model(inputs).numpy()
+    print(f"torch      {time.perf_counter() - start:.3f}s")
+
+    failed = False
+    for backend in [args.backend] if args.backend else BACKENDS[1:]:
+        model = upscale_server.get_model(args.model, args.scale, backend=backend)
+        start = time.perf_counter()
+        output = model(inputs).numpy()
+        elapsed = time.perf_counter() - start
+        score = psnr(output, reference)
+        error = max_error(output, reference)
+        ok = score >= PARITY_PSNR[backend] and error <= PARITY_MAX_ERROR[backend]
+        failed = failed or not ok
+        print(f"{backend:<10} {elapsed:.3f}s  PSNR {score:.2f} dB  écart max {error:.4f}  {'OK' if ok else 'ÉCHEC'} "
+              f"(min {PARITY_PSNR[backend]} dB, max {PARITY_MAX_ERROR[backend]})")
+
+    raise SystemExit(1 if failed else 0)
+
+
+if __name__ == '__main__':
+    main()
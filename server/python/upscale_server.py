@@ -5,6 +5,8 @@ Uses super-image library with EDSR model
 import os
 import sys
 import io
+import time
+import warnings
 
 # === MODELS DIRECTORY CONFIGURATION ===
 # Store models in project's models/ folder instead of user's home directory
@@ -33,24 +35,53 @@ import numpy as np
 os.environ['CUDA_VISIBLE_DEVICES'] = ''
 os.environ['ORT_DISABLE_ALL_CUDA'] = '1'
 
-import torch
-# Optimize CPU threads - allow override via env
-num_cores = os.cpu_count() or 4
-env_threads = os.environ.get('AI_THREADS')
-if env_threads:
-    try:
-        torch.set_num_threads(int(env_threads))
-        print(f"🧵 Thread count set from AI_THREADS: {env_threads}")
-    except ValueError:
-        torch.set_num_threads(num_cores)
-else:
-    torch.set_num_threads(num_cores)
+from model_registry import ModelRegistry
+from upscale_onnx import BACKENDS, OnnxUpscaler, load_onnx_model
+from result_cache import ResultCache, make_key
+from jobs import JobManager, QueueFull, queue_full_response, register_job_routes
+from image_io import encode, parse_output_format, stream_response
+from warmup import Warmup, import_torch, register_ready_route
+from cpu_scheduler import CpuScheduler
+import denoise as denoiser
+import upscale_cost
+import weight_store
+import metrics
 
 app = Flask(__name__)
 CORS(app)
 
-# Global models cache: {(model_name, scale): model_object}
-models = {}
+# Global models cache: {(model_name, scale): model_object}, LRU under AI_MODEL_MEMORY_MB
+registry = ModelRegistry('upscale')
+
+# Cached outputs, next to the models folder (models/cache/upscale)
+result_cache = ResultCache(os.path.join(os.path.dirname(MODELS_DIR), "cache", "upscale"))
+
+# Async jobs: POST /jobs, GET /jobs/<id>, GET /jobs/<id>/result
+job_manager = JobManager('upscale')
+register_job_routes(app, job_manager)
+
+# Bounded concurrent inferences, threads split between them
+cpu_scheduler = CpuScheduler('upscale')
+
+# Prometheus metrics on /metrics
+metrics.init_app(app, 'upscale', registry=registry, queues={'jobs': job_manager.depth, 'cpu': cpu_scheduler.depth},
+                 models=upscale_cost.MODEL_ORDER)
+
+# Tiled inference: peak memory is bounded by the tile size instead of the image size.
+# UPSCALE_TILE_SIZE=0 disables tiling (whole image in one forward pass).
+TILE_SIZE = int(os.environ.get('UPSCALE_TILE_SIZE', 256))
+TILE_OVERLAP = int(os.environ.get('UPSCALE_TILE_OVERLAP', 16))
+TILE_BATCH = int(os.environ.get('UPSCALE_TILE_BATCH', 4))
+
+# Time/memory predictions that route oversized jobs (tiles, lighter model, lower scale or refusal)
+cost_model = upscale_cost.CostModel(threads=cpu_scheduler.cores, tile_overlap=TILE_OVERLAP, tile_batch=TILE_BATCH)
+
+# Inference backend: 'torch', 'onnx' or 'onnx-int8' (overridable per request)
+DEFAULT_BACKEND = os.environ.get('UPSCALE_BACKEND', 'torch').lower()
+if DEFAULT_BACKEND not in BACKENDS:
+    DEFAULT_BACKEND = 'torch'
+
+OUTPUT_FORMATS = ('png', 'webp', 'jpeg')
 
 MODEL_MAPPING = {
     'edsr': 'eugenesiow/edsr-base',
@@ -59,43 +90,130 @@ MODEL_MAPPING = {
     'drln': 'eugenesiow/drln'
 }
 
-def get_model(model_name='pan', scale=4):
-    """Load super-image model based on name and scale"""
-    global models
-    
+def get_model(model_name='pan', scale=4, backend=None):
+    """Load super-image model based on name, scale and inference backend"""
     # Normalize model name
     model_key = model_name.lower()
     if model_key not in MODEL_MAPPING:
         model_key = 'pan'
-        
-    cache_key = (model_key, scale)
-    
-    if cache_key not in models:
+
+    def load():
+        import_torch()
+        from super_image import EdsrModel, MsrnModel, PanModel, DrlnModel
+
+        pretrained_id = MODEL_MAPPING[model_key]
+        print(f"Loading {model_key} model for x{scale}...")
+
+        model_class = {
+            'edsr': EdsrModel,
+            'msrn': MsrnModel,
+            'pan': PanModel,
+            'drln': DrlnModel
+        }[model_key]
+        model = weight_store.load(f'{model_key}-x{scale}',
+                                  lambda: model_class.from_pretrained(pretrained_id, scale=scale),
+                                  package='super-image')
+
+        print(f"Model {model_key} x{scale} loaded successfully!")
+        return model
+
+    backend = backend or DEFAULT_BACKEND
+    if backend != 'torch':
         try:
-            from super_image import EdsrModel, MsrnModel, PanModel, DrlnModel
-            
-            pretrained_id = MODEL_MAPPING[model_key]
-            print(f"Loading {model_key} model for x{scale}...")
-            
-            if model_key == 'edsr':
-                from super_image import EdsrModel
-                models[cache_key] = EdsrModel.from_pretrained(pretrained_id, scale=scale)
-            elif model_key == 'msrn':
-                from super_image import MsrnModel
-                models[cache_key] = MsrnModel.from_pretrained(pretrained_id, scale=scale)
-            elif model_key == 'pan':
-                from super_image import PanModel
-                models[cache_key] = PanModel.from_pretrained(pretrained_id, scale=scale)
-            elif model_key == 'drln':
-                from super_image import DrlnModel
-                models[cache_key] = DrlnModel.from_pretrained(pretrained_id, scale=scale)
-            
-            print(f"Model {model_key} x{scale} loaded successfully!")
+            return registry.get((model_key, scale, backend),
+                                lambda: load_onnx_model(model_key, scale, backend, load))
         except Exception as e:
-            print(f"Error loading model {model_key} x{scale}: {e}")
-            return None
-            
-    return models[cache_key]
+            print(f"⚠️ Backend {backend} indisponible pour {model_key} x{scale} ({e}), retour à PyTorch")
+
+    try:
+        return registry.get((model_key, scale), load)
+    except Exception as e:
+        print(f"Error loading model {model_key} x{scale}: {e}")
+        return None
+
+
+def _tile_starts(length, tile, overlap):
+    """Start offsets covering [0, length) with tiles of size `tile` overlapping by at least `overlap`"""
+    if length <= tile:
+        return [0]
+    stride = max(tile - overlap, 1)
+    starts = list(range(0, length - tile, stride))
+    starts.append(length - tile)
+    return starts
+
+
+def _feather(length, ramp, fade_in, fade_out):
+    """1D blending weights: linear ramps on the edges shared with a neighbour tile.
+
+    The outer quarter of each ramp gets a near-zero weight so that pixels computed
+    with zero padding at a tile border barely contribute to the blend.
+    """
+    torch = import_torch()
+    weights = torch.ones(length)
+    ramp = min(ramp, length // 2)
+    if ramp > 0:
+        margin = ramp // 4
+        edge = torch.arange(1, ramp + 1, dtype=torch.float32) - margin
+        edge = (edge / (ramp - margin + 1)).clamp(min=1e-3)
+        if fade_in:
+            weights[:ramp] = edge
+        if fade_out:
+            weights[-ramp:] = edge.flip(0)
+    return weights
+
+
+def upscale_tensor(mdl, inputs, scale, tile_size=TILE_SIZE, overlap=TILE_OVERLAP, batch_size=TILE_BATCH, progress=None):
+    """Upscale a (1, C, H, W) tensor, tile by tile when it is larger than tile_size.
+    progress(done, total) is called after each batch of tiles."""
+    torch = import_torch()
+    _, channels, h, w = inputs.shape
+    if tile_size <= 0 or (h <= tile_size and w <= tile_size):
+        with torch.no_grad():
+            preds = mdl(inputs)
+        if progress:
+            progress(1, 1)
+        return preds
+
+    overlap = min(overlap, tile_size // 2)
+    tile_h, tile_w = min(tile_size, h), min(tile_size, w)
+    ys = _tile_starts(h, tile_h, overlap)
+    xs = _tile_starts(w, tile_w, overlap)
+    tiles = [(y, x) for y in ys for x in xs]
+
+    output = torch.zeros((1, channels, h * scale, w * scale))
+    weight_sum = torch.zeros((1, 1, h * scale, w * scale))
+    ramp = overlap * scale
+
+    with torch.no_grad():
+        for i in range(0, len(tiles), max(batch_size, 1)):
+            group = tiles[i:i + max(batch_size, 1)]
+            batch = torch.cat([inputs[:, :, y:y + tile_h, x:x + tile_w] for y, x in group])
+            # Share of the cores as it stands now that other requests came in or finished
+            cpu_scheduler.refresh()
+            preds = mdl(batch)
+            for (y, x), pred in zip(group, preds):
+                wy = _feather(tile_h * scale, ramp, y > 0, y + tile_h < h)
+                wx = _feather(tile_w * scale, ramp, x > 0, x + tile_w < w)
+                weight = (wy[:, None] * wx[None, :])[None, None]
+                oy, ox = y * scale, x * scale
+                output[:, :, oy:oy + tile_h * scale, ox:ox + tile_w * scale] += pred.unsqueeze(0) * weight
+                weight_sum[:, :, oy:oy + tile_h * scale, ox:ox + tile_w * scale] += weight
+            if progress:
+                progress(i + len(group), len(tiles))
+
+    # In place: a second output-sized tensor is what tips huge images over the memory limit
+    return output.div_(weight_sum)
+
+
+# torch and the default model in the background: the port is bound right away
+def warm_default_model():
+    if get_model('pan', 4) is None:
+        raise RuntimeError('Modèle non disponible')
+
+
+warmup = Warmup('upscale').add('pan-4', warm_default_model)
+register_ready_route(app, warmup)
+
 
 @app.route('/health', methods=['GET'])
 def health_check():
@@ -103,7 +221,15 @@ def health_check():
         'status': 'ok', 
         'service': 'upscale',
         'device': 'cpu',
-        'threads': torch.get_num_threads()
+        'threads': sys.modules['torch'].get_num_threads() if 'torch' in sys.modules else None,
+        'ready': warmup.ready,
+        'tile_size': TILE_SIZE,
+        'backend': DEFAULT_BACKEND,
+        'calibrated': sorted(cost_model.coefficients),
+        'models': registry.stats(),
+        'cache': result_cache.stats(),
+        'jobs': job_manager.stats(),
+        'scheduler': cpu_scheduler.stats()
     })
 
 @app.route('/info', methods=['GET'])
@@ -114,94 +240,261 @@ def get_info():
             {'id': 'edsr', 'name': 'EDSR (Base)', 'description': 'Équilibré et robuste', 'speed': 'Médium'},
             {'id': 'msrn', 'name': 'MSRN', 'description': 'Multi-échelle, bons détails', 'speed': 'Médium'},
         ],
-        'scales': [2, 3, 4]
+        'scales': [2, 3, 4],
+        'backends': list(BACKENDS),
+        'denoise_methods': list(denoiser.METHODS),
+        'output_formats': list(OUTPUT_FORMATS),
+        'routing': {
+            'enabled': upscale_cost.ROUTING,
+            'max_seconds': upscale_cost.MAX_SECONDS,
+            'max_memory_mb': round(upscale_cost.MAX_MEMORY_MB),
+            'allow_downscale': upscale_cost.ALLOW_DOWNSCALE
+        }
     })
 
-@app.route('/upscale', methods=['POST'])
-def upscale_image():
-    if 'file' not in request.files:
-        return jsonify({'error': 'Aucun fichier fourni'}), 400
 
-    file = request.files['file']
-    scale = int(request.form.get('scale', 4))
-    model_name = request.form.get('model', 'pan')
-    denoise = request.form.get('denoise', 'false').lower() == 'true'
+def parse_upscale_form(form):
+    """Read upscale parameters from a request form, returns (params, error message)"""
+    output, error = parse_output_format(form, OUTPUT_FORMATS)
+    if error:
+        return None, error
+    denoise, error = denoiser.parse_method(form.get('denoise'))
+    if error:
+        return None, error
+    try:
+        params = {
+            'scale': int(form.get('scale', 4)),
+            'model_name': form.get('model', 'pan'),
+            'denoise': denoise,
+            'tile_size': int(form.get('tile_size', TILE_SIZE)),
+            'backend': form.get('backend', DEFAULT_BACKEND).lower(),
+            'output': output
+        }
+    except ValueError:
+        return None, 'Paramètres invalides (scale, tile_size)'
+    if params['backend'] not in BACKENDS:
+        return None, f"Backend inconnu (choix: {', '.join(BACKENDS)})"
+    return params, None
+
+
+def plan_upscale(input_data, filename, params):
+    """
+    Cost estimate of a job and the parameters it will actually run with, as (estimate, params).
+    The estimate is None when the image header cannot be read (run_upscale reports the error).
+    """
+    try:
+        with Image.open(io.BytesIO(input_data)) as img:
+            width, height = img.size
+    except Exception:
+        return None, params
+    model_name = params['model_name'].lower()
+    if model_name not in MODEL_MAPPING:
+        model_name = 'pan'
+    requested = dict(params, model_name=model_name)
+    if not upscale_cost.ROUTING:
+        return cost_model.estimate(width, height, model_name, params['scale'], params['backend'],
+                                   params['tile_size']), requested
+
+    estimate, _ = cost_model.route(width, height, model_name, params['scale'], params['backend'],
+                                   params['tile_size'], default_tile=TILE_SIZE or 256)
+    print(f"📐 {filename}: {width}x{height} ({width * height / 1e6:.1f}MP) -> {estimate.strategy} "
+          f"{estimate.model} x{estimate.scale}, ~{estimate.seconds:.1f}s, ~{estimate.memory_mb:.0f}MB"
+          + ('' if estimate.calibrated else ' (non calibré)'))
+    if estimate.strategy in ('direct', 'reject'):
+        return estimate, requested
+    return estimate, dict(requested, model_name=estimate.model, scale=estimate.scale,
+                          tile_size=estimate.tile_size or params['tile_size'])
+
+
+def too_expensive_response(estimate):
+    return jsonify({
+        'error': f"Image trop lourde pour ce serveur: ~{estimate.seconds:.1f}s et ~{estimate.memory_mb:.0f}MB "
+                 f"estimés (limites: {upscale_cost.MAX_SECONDS:g}s, {upscale_cost.MAX_MEMORY_MB:.0f}MB)",
+        'estimate': estimate.to_dict()
+    }), 413
 
-    if file.filename == '':
-        return jsonify({'error': 'Nom de fichier vide'}), 400
 
-    mdl = get_model(model_name, scale)
+def set_cost_headers(response, estimate):
+    """Chosen strategy and predicted vs. measured cost"""
+    if estimate is None:
+        return
+    response.headers['X-Upscale-Strategy'] = estimate.strategy
+    response.headers['X-Upscale-Model'] = f"{estimate.model}-x{estimate.scale}"
+    response.headers['X-Cost-Calibrated'] = 'true' if estimate.calibrated else 'false'
+    response.headers['X-Cost-Estimated-Seconds'] = f"{estimate.seconds:.2f}"
+    response.headers['X-Cost-Estimated-Memory-MB'] = f"{estimate.memory_mb:.0f}"
+    if estimate.actual_seconds is not None:
+        response.headers['X-Cost-Actual-Seconds'] = f"{estimate.actual_seconds:.2f}"
+        response.headers['X-Cost-Actual-Memory-MB'] = f"{estimate.actual_memory_mb:.0f}"
+
+
+def run_upscale(input_data, filename, model_name='pan', scale=4, denoise=None, tile_size=TILE_SIZE,
+                backend=DEFAULT_BACKEND, output=None, job=None, stream=False, estimate=None):
+    """
+    Upscale pipeline shared by /upscale and /jobs, returns (encoded bytes, cache status).
+    denoise is a denoise.METHODS name, or None to skip denoising.
+    With stream=True a freshly computed result comes back un-encoded instead, as
+    (PIL image, cache store callback, model label) for stream_response().
+    The measured inference time and memory growth are recorded on `estimate` (from plan_upscale).
+    """
+    output = output or parse_output_format({})[0]
+
+    def result_key(ran_backend):
+        return make_key(input_data, op='upscale', model=model_name.lower(), scale=scale,
+                        denoise=denoise, tile_size=tile_size, backend=ran_backend, **output.cache_params())
+
+    cache_key = result_key(backend)
+    cached = result_cache.get(cache_key)
+    if cached is not None:
+        print(f"⚡ Résultat en cache pour {filename}")
+        return cached, 'HIT'
+
+    mdl = get_model(model_name, scale, backend)
+    fallback = mdl is None
     if mdl is None:
         # Fallback to PAN x4 if requested combination fails
         mdl = get_model('pan', 4)
+        scale = 4
         if mdl is None:
-            return jsonify({'error': 'Modèle non disponible'}), 500
+            raise RuntimeError('Modèle non disponible')
+
+    # get_model() falls back to PyTorch when the ONNX graph cannot be built: the result
+    # is cached under the backend that actually ran, not the requested one
+    ran_backend = backend if isinstance(mdl, OnnxUpscaler) else 'torch'
+    if ran_backend != backend:
+        cache_key = result_key(ran_backend)
 
-    import time
+    # Label of the model that actually runs (the stage metrics must not carry client input)
+    model_key = 'pan' if fallback or model_name.lower() not in MODEL_MAPPING else model_name.lower()
+    model_label = f"{model_key}-{scale}" + ('' if ran_backend == 'torch' else f"-{ran_backend}")
     start_time = time.time()
-    
-    try:
-        from super_image import ImageLoader
-        import cv2
-        
-        # Load image
-        load_start = time.time()
-        img = Image.open(file.stream).convert('RGB')
+
+    torch = import_torch()
+
+    # Load image
+    with metrics.stage('load', model_label):
+        img = Image.open(io.BytesIO(input_data))
+        if img.mode != 'RGB':
+            img = img.convert('RGB')
         w, h = img.size
         pixels = w * h
-        print(f"🖼️ Image chargée: {w}x{h} ({pixels/1e6:.1f}MP) - Fichier: {file.filename}")
-        
-        if pixels > 12000000: # > 12MP is massive for CPU upscale
-            print(f"⚠️ ATTENTION: Image très grande ({pixels/1e6:.1f}MP). Le traitement sur CPU sera TRÈS LENT.")
-        
-        load_end = time.time()
-        
+        print(f"🖼️ Image chargée: {w}x{h} ({pixels/1e6:.1f}MP) - Fichier: {filename}")
+
+    if job:
+        job.update(0.02, stage='load', width=w, height=h)
+
+    # Single HWC uint8 array shared by denoising and the tensor conversion
+    img_array = np.asarray(img)
+
+    # Denoising and inference run in a CPU slot: bounded concurrency, threads split between requests
+    if job:
+        job.update(0.02, stage='queued')
+    # Predicted seconds when known: the scheduler admits the cheapest jobs first
+    cost = estimate.seconds if estimate is not None else pixels * scale * scale / 1e6
+    with cpu_scheduler.slot(model_label, cost=cost) as threads, metrics.RssSampler() as rss:
+        rss_start = rss.peak
+        if threads:
+            print(f"🧵 {threads} thread(s) pour {filename}")
         # Apply denoising if requested (before upscaling to save time)
         if denoise:
-            denoise_start = time.time()
-            print("✨ Début du débruitage (Denoise)...")
-            img_array = np.array(img)
-            # Denoising on smaller image is much faster
-            # Reduced searchWindowSize from 21 to 7 for massive CPU speedup
-            denoised = cv2.fastNlMeansDenoisingColored(img_array, None, 10, 10, 7, 7)
-            img = Image.fromarray(denoised)
-            denoise_end = time.time()
-            print(f"✨ Débruité en {denoise_end - denoise_start:.2f}s")
-        
-        # Prepare for model
-        prep_start = time.time()
-        inputs = ImageLoader.load_image(img)
-        prep_end = time.time()
-        
+            print(f"✨ Début du débruitage ({denoise})...")
+            if job:
+                job.update(0.02, stage='denoise')
+            with metrics.stage('denoise', model_label) as timer:
+                # Denoising on smaller image is much faster; strips run on the granted threads
+                img_array, denoise_info = denoiser.denoise(img_array, denoise, threads or cpu_scheduler.cores,
+                                                           model=model_label)
+            print(f"✨ Débruitage {denoise_info['method']} (bruit estimé: {denoise_info['sigma']}) "
+                  f"en {timer.seconds:.2f}s")
+            if job:
+                job.update(0.05, denoise=denoise_info)
+
+        # Prepare for model: (1, 3, H, W) float in [0, 1], one conversion pass
+        with metrics.stage('prep', model_label):
+            with warnings.catch_warnings():
+                # The decoded array is read-only; the uint8 view is only read by the float conversion
+                warnings.simplefilter('ignore', UserWarning)
+                inputs = torch.from_numpy(img_array).permute(2, 0, 1).unsqueeze(0)
+            inputs = inputs.to(torch.float32, memory_format=torch.contiguous_format).div_(255.0)
+        del img, img_array
+
+        def on_tiles(done, total):
+            # Inference is the bulk of the work: map it to 10%..95%
+            job.update(0.1 + 0.85 * done / total, stage='inference', tiles_done=done, tiles_total=total)
+
         # Run inference
-        print(f"🚀 Début de l'agrandissement x{scale} avec {model_name}...")
-        inf_start = time.time()
-        with torch.no_grad():
-            preds = mdl(inputs)
-        inf_end = time.time()
-        print(f"🚀 Agrandissement terminé en {inf_end - inf_start:.2f}s")
-        
-        # Convert tensor output to PIL Image
-        save_start = time.time()
-        output_tensor = preds.squeeze(0).permute(1, 2, 0).clamp(0, 1).cpu().numpy()
-        output_array = (output_tensor * 255).astype(np.uint8)
-        output_img = Image.fromarray(output_array)
-        
-        # Save to buffer
-        output_buffer = io.BytesIO()
-        output_img.save(output_buffer, format='PNG')
-        output_buffer.seek(0)
-        save_end = time.time()
-        
-        total_time = time.time() - start_time
-        print(f"🏁 Traitement total: {total_time:.2f}s")
-        
-        return send_file(
-            output_buffer,
-            mimetype='image/png',
-            as_attachment=True,
-            download_name=f"upscaled-{os.path.splitext(file.filename)[0]}.png"
-        )
+        print(f"🚀 Début de l'agrandissement x{scale} avec {model_name} (tuiles: {tile_size or 'non'})...")
+        if job:
+            job.update(0.1, stage='inference')
+        with metrics.stage('inference', model_label) as timer:
+            preds = upscale_tensor(mdl, inputs, scale, tile_size=tile_size, progress=on_tiles if job else None)
+        print(f"🚀 Agrandissement terminé en {timer.seconds:.2f}s")
+        if estimate is not None:
+            estimate.actual_seconds = timer.seconds
+            metrics.observe_cost_ratio(model_label, timer.seconds / max(estimate.seconds, 1e-3))
+
+        # Convert tensor output to PIL Image: scaled and quantized in place, then a single HWC copy.
+        # Still sampled: the estimate counts the uint8 array and the PIL image too
+        if job:
+            job.update(0.95, stage='save')
+        with metrics.stage('convert', model_label):
+            preds = preds.squeeze(0).clamp_(0, 1).mul_(255.0)
+            output_array = preds.to(torch.uint8).permute(1, 2, 0).contiguous().numpy()
+            del preds
+            output_img = Image.fromarray(output_array)
+    if estimate is not None:
+        # Process-wide growth: concurrent jobs add to it
+        estimate.actual_memory_mb = max(rss.peak - rss_start, 0) / (1024 * 1024)
+
+    total_time = time.time() - start_time
+    print(f"🏁 Traitement total: {total_time:.2f}s")
+
+    # Do not remember a fallback result under the requested model's key
+    def store(data):
+        if not fallback:
+            result_cache.put(cache_key, data)
+
+    if stream:
+        return (output_img, store, model_label), 'MISS'
+    output_data = encode(output_img, output, stage='save', model=model_label)
+    store(output_data)
+    return output_data, 'MISS'
+
+
+@app.route('/upscale', methods=['POST'])
+def upscale_image():
+    if 'file' not in request.files:
+        return jsonify({'error': 'Aucun fichier fourni'}), 400
+
+    file = request.files['file']
+    params, error = parse_upscale_form(request.form)
+    if error:
+        return jsonify({'error': error}), 400
+
+    if file.filename == '':
+        return jsonify({'error': 'Nom de fichier vide'}), 400
+
+    try:
+        input_data = file.read()
+        estimate, params = plan_upscale(input_data, file.filename, params)
+        if estimate is not None and estimate.strategy == 'reject':
+            return too_expensive_response(estimate)
+
+        output = params['output']
+        download_name = f"upscaled-{os.path.splitext(file.filename)[0]}.{output.extension}"
+        result, cache_status = run_upscale(input_data, file.filename, stream=True, estimate=estimate, **params)
+
+        if cache_status == 'HIT':
+            response = send_file(io.BytesIO(result), mimetype=output.mimetype, as_attachment=True,
+                                 download_name=download_name)
+        else:
+            # Sent while it is being encoded, cached once complete
+            output_img, store, model_label = result
+            response = stream_response(output_img, output, download_name, on_complete=store,
+                                       stage='save', model=model_label)
+        response.headers['X-Cache'] = cache_status
+        set_cost_headers(response, estimate)
+        return response
 
     except Exception as e:
         print(f"Error: {str(e)}")
@@ -209,9 +502,51 @@ def upscale_image():
         traceback.print_exc()
         return jsonify({'error': f'Erreur de traitement: {str(e)}'}), 500
 
+
+@app.route('/jobs', methods=['POST'])
+def create_upscale_job():
+    """Same form as /upscale, returns a job id right away (202)"""
+    if 'file' not in request.files:
+        return jsonify({'error': 'Aucun fichier fourni'}), 400
+
+    file = request.files['file']
+    params, error = parse_upscale_form(request.form)
+    if error:
+        return jsonify({'error': error}), 400
+
+    if file.filename == '':
+        return jsonify({'error': 'Nom de fichier vide'}), 400
+
+    input_data = file.read()
+    filename = file.filename
+    # Refused before queueing when nothing fits the budgets
+    estimate, params = plan_upscale(input_data, filename, params)
+    if estimate is not None and estimate.strategy == 'reject':
+        return too_expensive_response(estimate)
+    output = params['output']
+    download_name = f"upscaled-{os.path.splitext(filename)[0]}.{output.extension}"
+
+    def work(job):
+        if estimate is not None:
+            job.update(0.0, cost=estimate.to_dict())
+        output_data, cache_status = run_upscale(input_data, filename, job=job, estimate=estimate, **params)
+        job.detail['cache'] = cache_status
+        if estimate is not None:
+            job.detail['cost'] = estimate.to_dict()
+        return output_data, output.mimetype, download_name
+
+    try:
+        job = job_manager.submit('upscale', work)
+    except QueueFull as e:
+        return queue_full_response(e)
+
+    return jsonify(job.to_dict()), 202
+
+
 if __name__ == '__main__':
-    print(f"AI Upscale Server starting on http://localhost:5300 (CPU Mode, {torch.get_num_threads()} threads)")
-    # Pre-load only PAN model to be light and fast
-    get_model('pan', 4)
+    threads = os.environ.get('AI_THREADS') or os.cpu_count() or 4
+    print(f"AI Upscale Server starting on http://localhost:5300 (CPU Mode, {threads} threads)")
+    # Only PAN is loaded, in the background; /ready tells when it is done
+    warmup.start()
     app.run(host='0.0.0.0', port=5300, debug=False)
 
@@ -0,0 +1,157 @@
+"""
+Voice activity detection for the Whisper server.
+Energy in the speech band (300-3400 Hz) relative to the file's noise floor,
+combined with spectral flatness to reject broadband noise. No model needed.
+Speech regions are packed back to back so Whisper only decodes speech, and a
+Timeline maps packed times back to the original file.
+
+Configuration:
+  WHISPER_VAD   1 to enable the pre-pass by default (form field `vad` overrides)
+"""
+import bisect
+import os
+
+import numpy as np
+
+from audio import SAMPLE_RATE
+
+FRAME_MS = 30
+SPEECH_BAND_HZ = (300, 3400)
+# A frame is speech when it is this many dB above the noise floor...
+MARGIN_DB = 10.0
+# ...and above this absolute level (dBFS of the band power)
+MIN_LEVEL_DB = -60.0
+# White noise has a flatness around 0.56 per frame, voiced speech far less
+MAX_FLATNESS = 0.5
+SMOOTH_FRAMES = 5
+MIN_SPEECH_SECONDS = 0.25
+MIN_SILENCE_SECONDS = 0.5
+PAD_SECONDS = 0.2
+# Silence inserted between packed regions so they stay separate segments
+GAP_SECONDS = 0.3
+
+_BLOCK_FRAMES = 4096
+
+
+def vad_enabled(value=None):
+    """Form value if given, else WHISPER_VAD"""
+    if value is None or value == '':
+        value = os.environ.get('WHISPER_VAD', '0')
+    return str(value).lower() in ('1', 'true', 'yes', 'on')
+
+
+def _frame_features(pcm, frame_len, sr):
+    """Speech-band level (dB) and spectral flatness per frame, computed in blocks"""
+    n_frames = len(pcm) // frame_len
+    frames = pcm[:n_frames * frame_len].reshape(n_frames, frame_len)
+    window = np.hanning(frame_len).astype(np.float32)
+    freqs = np.fft.rfftfreq(frame_len, 1 / sr)
+    band = (freqs >= SPEECH_BAND_HZ[0]) & (freqs <= SPEECH_BAND_HZ[1])
+
+    level = np.empty(n_frames, dtype=np.float32)
+    flatness = np.empty(n_frames, dtype=np.float32)
+    for start in range(0, n_frames, _BLOCK_FRAMES):
+        block = frames[start:start + _BLOCK_FRAMES] * window
+        power = np.abs(np.fft.rfft(block, axis=1))[:, band] ** 2 + 1e-12
+        mean_power = power.mean(axis=1)
+        level[start:start + len(block)] = 10 * np.log10(mean_power / frame_len)
+        flatness[start:start + len(block)] = np.exp(np.log(power).mean(axis=1)) / mean_power
+    return level, flatness
+
+
+def _runs(flags):
+    """(start, end) index pairs of the True runs in a boolean array"""
+    edges = np.diff(np.concatenate(([0], flags.astype(np.int8), [0])))
+    return list(zip(np.flatnonzero(edges == 1), np.flatnonzero(edges == -1)))
+
+
+def speech_regions(pcm, sr=SAMPLE_RATE):
+    """Speech regions as (start, end) sample indices, padded and merged"""
+    frame_len = int(sr * FRAME_MS / 1000)
+    if len(pcm) < frame_len:
+        return [(0, len(pcm))] if len(pcm) else []
+
+    level, flatness = _frame_features(pcm, frame_len, sr)
+    noise_floor = float(np.percentile(level, 10))
+    threshold = max(noise_floor + MARGIN_DB, MIN_LEVEL_DB)
+    # Single-frame flatness is noisy, average it over ~150 ms
+    flatness = np.convolve(flatness, np.ones(SMOOTH_FRAMES) / SMOOTH_FRAMES, mode='same')
+    speech = (level > threshold) & (flatness < MAX_FLATNESS)
+
+    frame_seconds = frame_len / sr
+    regions = []
+    for start, end in _runs(speech):
+        if regions and (start - regions[-1][1]) * frame_seconds < MIN_SILENCE_SECONDS:
+            regions[-1] = (regions[-1][0], end)
+        else:
+            regions.append((start, end))
+
+    pad = int(PAD_SECONDS * sr)
+    result = []
+    for start, end in regions:
+        if (end - start) * frame_seconds < MIN_SPEECH_SECONDS:
+            continue
+        start = max(start * frame_len - pad, 0)
+        end = min(end * frame_len + pad, len(pcm))
+        if result and start <= result[-1][1]:
+            result[-1] = (result[-1][0], end)
+        else:
+            result.append((start, end))
+    return [(int(start), int(end)) for start, end in result]
+
+
+class Timeline:
+    """Maps times on the packed speech-only audio back to the original file"""
+
+    def __init__(self):
+        self._packed = []
+        self._original = []
+        self._lengths = []
+
+    def add(self, packed_start, original_start, length):
+        self._packed.append(packed_start)
+        self._original.append(original_start)
+        self._lengths.append(length)
+
+    def to_original(self, t):
+        if not self._packed:
+            return t
+        i = max(bisect.bisect_right(self._packed, t) - 1, 0)
+        # Times inside an inserted gap stick to the end of the previous region
+        offset = min(max(t - self._packed[i], 0.0), self._lengths[i])
+        return self._original[i] + offset
+
+    def remap(self, segments):
+        """Segment dicts (and their words) with start/end moved to the original timeline"""
+        for seg in segments:
+            for item in [seg] + seg.get('words', []):
+                item['start'] = round(self.to_original(item['start']), 2)
+                item['end'] = round(self.to_original(item['end']), 2)
+        return segments
+
+
+def pack_speech(pcm, regions, sr=SAMPLE_RATE):
+    """Concatenate the speech regions (separated by short gaps), returns (packed pcm, Timeline)"""
+    gap = np.zeros(int(GAP_SECONDS * sr), dtype=np.float32)
+    parts = []
+    timeline = Timeline()
+    position = 0
+    for start, end in regions:
+        if parts:
+            parts.append(gap)
+            position += len(gap)
+        timeline.add(position / sr, start / sr, (end - start) / sr)
+        parts.append(pcm[start:end])
+        position += end - start
+    packed = np.concatenate(parts) if parts else np.zeros(0, dtype=np.float32)
+    return packed, timeline
+
+
+def vad_report(total_samples, regions, sr=SAMPLE_RATE):
+    speech = sum(end - start for start, end in regions) / sr
+    total = total_samples / sr
+    return {
+        'regions': len(regions),
+        'speech_seconds': round(speech, 2),
+        'skipped_seconds': round(total - speech, 2)
+    }
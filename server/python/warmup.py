@@ -0,0 +1,122 @@
+"""
+Background warm-up shared by the AI servers.
+The servers bind their port right away with only Flask imported; heavy modules
+(torch, whisper, rembg) and default models are loaded by a daemon thread so
+/health answers within a second. GET /ready reports the warm-up progress and
+returns 200 once it is complete (503 before that).
+"""
+import os
+import sys
+import threading
+import time
+import traceback
+
+from flask import jsonify
+
+_torch_lock = threading.Lock()
+_cv2_lock = threading.Lock()
+
+
+def _threads():
+    """Thread count from AI_THREADS (default: all cores)"""
+    threads = os.cpu_count() or 4
+    env_threads = os.environ.get('AI_THREADS')
+    if env_threads:
+        try:
+            threads = int(env_threads)
+            print(f"🧵 Thread count set from AI_THREADS: {env_threads}")
+        except ValueError:
+            pass
+    return threads
+
+
+def import_torch():
+    """torch, imported on first use with the thread count from AI_THREADS (default: all cores)"""
+    with _torch_lock:
+        first = 'torch' not in sys.modules
+        import torch
+        if first:
+            torch.set_num_threads(_threads())
+        return torch
+
+
+def import_cv2():
+    """cv2, imported on first use with its thread pool sized like torch's"""
+    with _cv2_lock:
+        first = 'cv2' not in sys.modules
+        import cv2
+        if first:
+            cv2.setNumThreads(_threads())
+        return cv2
+
+
+class Warmup:
+    """Named steps run once, in order, by a background thread"""
+
+    def __init__(self, service):
+        self.service = service
+        self.steps = []
+        self.state = 'pending'
+        self.started = None
+        self.finished = None
+        self._lock = threading.Lock()
+        self._thread_pid = None
+
+    def add(self, name, fn):
+        self.steps.append({'name': name, 'fn': fn, 'state': 'pending', 'seconds': None, 'error': None})
+        return self
+
+    def start(self):
+        """Start the warm-up thread (once per process: threads do not survive a fork)"""
+        with self._lock:
+            if self._thread_pid == os.getpid():
+                return self
+            self._thread_pid = os.getpid()
+            self.state = 'running'
+            self.started = time.time()
+        threading.Thread(target=self._run, daemon=True, name=f'{self.service}-warmup').start()
+        return self
+
+    def _run(self):
+        failed = False
+        for step in self.steps:
+            step['state'] = 'running'
+            start = time.perf_counter()
+            try:
+                step['fn']()
+                step['state'] = 'done'
+            except Exception as e:
+                # Keep going: a missing optional model must not block the other steps
+                traceback.print_exc()
+                step['state'] = 'failed'
+                step['error'] = str(e)
+                failed = True
+            step['seconds'] = round(time.perf_counter() - start, 2)
+        self.finished = time.time()
+        self.state = 'failed' if failed else 'ready'
+        print(f"{'⚠️' if failed else '✅'} {self.service}: préchauffage terminé en {self.finished - self.started:.1f}s")
+
+    @property
+    def ready(self):
+        return self.state == 'ready'
+
+    def status(self):
+        done = sum(1 for step in self.steps if step['state'] in ('done', 'failed'))
+        end = self.finished or time.time()
+        return {
+            'service': self.service,
+            'state': self.state,
+            'ready': self.ready,
+            'progress': round(100 * done / len(self.steps), 1) if self.steps else 100.0,
+            'seconds': round(end - self.started, 2) if self.started else 0,
+            'steps': [{key: step[key] for key in ('name', 'state', 'seconds', 'error') if step[key] is not None}
+                      for step in self.steps]
+        }
+
+
+def register_ready_route(app, warmup):
+    """GET /ready: warm-up status, 200 once every step has completed"""
+
+    @app.route('/ready', methods=['GET'])
+    def ready():
+        return jsonify(warmup.status()), 200 if warmup.ready else 503
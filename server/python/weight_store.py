@@ -0,0 +1,94 @@
+"""
+Memory-mapped weight store for the torch models (Whisper, super-image).
+The first load of a model goes through its library as usual (checkpoint parsing,
+FP16 -> FP32 conversion); the ready-to-run module is then saved once under
+models/weights/. Later loads memory-map that file: tensors are used in place
+from the page cache instead of being copied to the heap, so switching models
+costs little more than rebuilding the module structure, and every process
+mapping the file (gunicorn workers, transcription replicas) shares the same
+physical pages.
+
+The files are pickled modules written by this store (loaded with
+weights_only=False) and are named after the library version, so an upgrade
+converts the model again.
+
+Configuration:
+  AI_WEIGHT_STORE   0 to always load through the libraries
+"""
+import os
+import time
+from importlib import metadata
+
+from warmup import import_torch
+
+PROJECT_ROOT = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+STORE_DIR = os.path.join(PROJECT_ROOT, "models", "weights")
+
+
+def enabled():
+    return os.environ.get('AI_WEIGHT_STORE', '1').lower() not in ('0', 'false', 'no', 'off')
+
+
+def _version(package):
+    try:
+        return metadata.version(package)
+    except metadata.PackageNotFoundError:
+        return 'any'
+
+
+def store_path(name, package):
+    return os.path.join(STORE_DIR, f"{name}-{_version(package)}.pt")
+
+
+def _map(path):
+    torch = import_torch()
+    model = torch.load(path, map_location='cpu', mmap=True, weights_only=False)
+    return model.eval() if hasattr(model, 'eval') else model
+
+
+def _save(model, name, path):
+    torch = import_torch()
+    os.makedirs(STORE_DIR, exist_ok=True)
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    try:
+        torch.save(model, tmp_path)
+        os.replace(tmp_path, path)
+    finally:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+    # Conversions made for other library versions are dead weight. Only `{name}-<version>.pt`
+    # is this model: 'whisper-large' must not match 'whisper-large-v3-<version>.pt'
+    for filename in os.listdir(STORE_DIR):
+        stem, ext = os.path.splitext(filename)
+        stale = os.path.join(STORE_DIR, filename)
+        if ext == '.pt' and stem.rsplit('-', 1)[0] == name and stale != path:
+            os.remove(stale)
+
+
+def load(name, loader, package):
+    """Model `name` mapped from the store, converted from loader() on first use (package: the library it comes from)"""
+    if not enabled():
+        return loader()
+
+    path = store_path(name, package)
+    if os.path.exists(path):
+        start = time.perf_counter()
+        try:
+            model = _map(path)
+            print(f"🗺️ {name} mappé depuis le store en {time.perf_counter() - start:.2f}s")
+            return model
+        except Exception as e:
+            # Truncated file or incompatible library: convert it again
+            print(f"⚠️ Store illisible pour {name} ({e}), reconversion...")
+            os.remove(path)
+
+    model = loader()
+    try:
+        start = time.perf_counter()
+        _save(model, name, path)
+        print(f"💾 {name} converti pour le store en {time.perf_counter() - start:.2f}s")
+        # Serve from the mapping too, so this process shares the pages with the next ones
+        return _map(path)
+    except Exception as e:
+        print(f"⚠️ Conversion de {name} impossible ({e}), modèle chargé normalement")
+        return model
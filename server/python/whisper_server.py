@@ -15,10 +15,12 @@ os.environ['XDG_CACHE_HOME'] = os.path.dirname(MODELS_DIR)
 
 os.environ['CUDA_VISIBLE_DEVICES'] = ''
 
-from flask import Flask, request, jsonify
+from flask import Flask, Request, request, jsonify, send_file, Response, stream_with_context
 from flask_cors import CORS
+from werkzeug.exceptions import HTTPException
 import io
 import sys
+import json
 import tempfile
 import codecs
 
@@ -28,55 +30,41 @@ if sys.platform == 'win32':
     sys.stdout = codecs.getwriter("utf-8")(sys.stdout.detach())
     sys.stderr = codecs.getwriter("utf-8")(sys.stderr.detach())
 
-# Add FFmpeg to PATH - Dynamic Search
-PROJECT_ROOT = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
-USER_HOME = os.path.expanduser("~")
-
-def find_ffmpeg():
-    """Dynamically find ffmpeg in common locations including WinGet packages"""
-    search_locations = [
-        PROJECT_ROOT,
-        os.path.join(PROJECT_ROOT, "server", "python"),
-        os.path.join(USER_HOME, r"AppData\Local\Microsoft\WinGet\Packages"),
-        r"C:\Program Files\ffmpeg\bin",
-        r"C:\ffmpeg\bin"
-    ]
-
-    print("🔎 Whisper: Recherche de FFmpeg...")
-    
-    # Check explicitly defined locations first
-    for loc in search_locations:
-        if not os.path.exists(loc):
-            continue
-            
-        # Recursive search in these locations (useful for WinGet UUID folders)
-        for root, dirs, files in os.walk(loc):
-            if "ffmpeg.exe" in files:
-                ffmpeg_path = os.path.join(root, "ffmpeg.exe")
-                print(f"✅ FFmpeg trouvé: {ffmpeg_path}")
-                return os.path.dirname(ffmpeg_path)
-                
-    return None
-
-ffmpeg_dir = find_ffmpeg()
-if ffmpeg_dir:
-    if ffmpeg_dir not in os.environ['PATH']:
-        os.environ['PATH'] = ffmpeg_dir + os.pathsep + os.environ['PATH']
-        print(f"➕ Ajouté au PATH: {ffmpeg_dir}")
-else:
-    print("⚠️ FFmpeg non trouvé automatiquement. Assurez-vous qu'il est installé.")
-
-try:
-    import whisper
-except ImportError as e:
-    print(f"Erreur import: {e}")
-    print("Installez: pip install openai-whisper flask flask-cors")
-    sys.exit(1)
+import numpy as np
+from audio import find_ffmpeg, decode_audio, iter_pcm, iter_windows, PcmReader, SAMPLE_RATE, WINDOW_SAMPLES
+from vad import vad_enabled, speech_regions, pack_speech, vad_report
+from model_registry import ModelRegistry
+from transcribe_pool import TranscribePool
+from jobs import JobManager, QueueFull, queue_full_response, register_job_routes
+from warmup import Warmup, import_torch, register_ready_route
+from cpu_scheduler import CpuScheduler
+from transcript_cache import TranscriptCache
+from segments import SUBTITLE_FORMATS, clean_segments, render, words_enabled
+import weight_store
+import metrics
+
+
+class SpooledUploadRequest(Request):
+    """
+    Uploaded files stay in memory up to UPLOAD_SPOOL_MB and spill to a temp file
+    beyond; a body over MAX_CONTENT_LENGTH is refused on its Content-Length,
+    before anything is read.
+    """
+
+    def _get_file_stream(self, total_content_length, content_type, filename=None, content_length=None):
+        return tempfile.SpooledTemporaryFile(max_size=UPLOAD_SPOOL_MB * 1024 * 1024)
+
 
 app = Flask(__name__)
+app.request_class = SpooledUploadRequest
 CORS(app)
 
 MAX_SIZE_MB = 500
+MAX_BATCH_FILES = 50
+# Uploads up to this size (MB) are piped to ffmpeg from memory, larger ones from a temp file
+UPLOAD_SPOOL_MB = int(os.environ.get('WHISPER_UPLOAD_SPOOL_MB', 16))
+# Whole request body, a batch included (the form fields get 1MB on top of the file)
+app.config['MAX_CONTENT_LENGTH'] = (MAX_SIZE_MB + 1) * 1024 * 1024
 ALLOWED_EXTENSIONS = {'mp3', 'wav', 'm4a', 'ogg', 'flac', 'webm', 'mp4', 'mpeg', 'mpga'}
 
 # Available Whisper models
@@ -88,30 +76,255 @@ AVAILABLE_MODELS = {
     'large': 'Large (~10GB RAM, meilleure précision)'
 }
 
-# Cache for loaded models
-loaded_models = {}
+# Approximate FP32 footprint, used to make room before loading
+MODEL_SIZES_MB = {
+    'tiny': 150,
+    'base': 290,
+    'small': 970,
+    'medium': 3000,
+    'large': 6000
+}
+
+# Cache for loaded models (LRU under AI_MODEL_MEMORY_MB)
+registry = ModelRegistry('whisper')
+
+
+# Async jobs: POST /jobs, GET /jobs/<id>, GET /jobs/<id>/result
+job_manager = JobManager('whisper')
+register_job_routes(app, job_manager)
+
+# Decoded audio and transcripts, next to the models folder (models/cache/whisper*)
+transcript_cache = TranscriptCache(os.path.join(os.path.dirname(MODELS_DIR), "cache"))
+
+# Pinned model replicas for /transcribe/batch (started on first use)
+transcribe_pool = TranscribePool()
+
+# Bounded concurrent inferences, threads split between them
+cpu_scheduler = CpuScheduler('whisper')
+
+# Prometheus metrics on /metrics
+metrics.init_app(app, 'whisper', registry=registry,
+                 queues={'jobs': job_manager.depth, 'batch': transcribe_pool.depth, 'cpu': cpu_scheduler.depth},
+                 models=AVAILABLE_MODELS)
+
+
+def setup_ffmpeg():
+    """Add FFmpeg to PATH - cached lookup (FFMPEG_PATH, PATH, known install folders)"""
+    ffmpeg_path = find_ffmpeg()
+    if ffmpeg_path:
+        print(f"✅ FFmpeg trouvé: {ffmpeg_path}")
+        ffmpeg_dir = os.path.dirname(ffmpeg_path)
+        if ffmpeg_dir not in os.environ['PATH']:
+            os.environ['PATH'] = ffmpeg_dir + os.pathsep + os.environ['PATH']
+            print(f"➕ Ajouté au PATH: {ffmpeg_dir}")
+    else:
+        print("⚠️ FFmpeg non trouvé automatiquement. Assurez-vous qu'il est installé.")
+
+
+def import_whisper():
+    """whisper and torch take seconds to import: loaded on first use"""
+    import_torch()
+    try:
+        import whisper
+    except ImportError as e:
+        print(f"Erreur import: {e}")
+        print("Installez: pip install openai-whisper flask flask-cors")
+        raise
+    return whisper
 
 
 def get_model(model_name):
     """Load and cache Whisper model"""
     if model_name not in AVAILABLE_MODELS:
         model_name = 'base'
-    
-    if model_name not in loaded_models:
+
+    def load():
+        whisper = import_whisper()
         print(f"Chargement du modèle Whisper '{model_name}'...")
-        loaded_models[model_name] = whisper.load_model(model_name)
+        model = weight_store.load(f'whisper-{model_name}', lambda: whisper.load_model(model_name),
+                                  package='openai-whisper')
         print(f"Modèle '{model_name}' chargé!")
-    
-    return loaded_models[model_name]
+        return model
+
+    return registry.get(model_name, load, size_mb=MODEL_SIZES_MB.get(model_name))
+
+
+# FFmpeg lookup, imports and default model in the background: the port is bound right away
+warmup = Warmup('whisper').add('ffmpeg', setup_ffmpeg).add('base', lambda: get_model('base'))
+register_ready_route(app, warmup)
 
 
 def allowed_file(filename):
     return '.' in filename and filename.rsplit('.', 1)[1].lower() in ALLOWED_EXTENSIONS
 
 
+def check_upload(file):
+    """Validate one uploaded audio file, returns (error message, size in MB)"""
+    if file.filename == '':
+        return 'Nom de fichier vide', 0
+
+    if not allowed_file(file.filename):
+        return 'Extension non autorisee', 0
+
+    file.seek(0, os.SEEK_END)
+    size_mb = file.tell() / (1024 * 1024)
+    file.seek(0)
+
+    if size_mb > MAX_SIZE_MB:
+        return f'Fichier trop volumineux ({size_mb:.1f}MB)', size_mb
+    return None, size_mb
+
+
+@app.errorhandler(413)
+def request_too_large(error):
+    return jsonify({'error': f'Requête trop volumineuse (max {MAX_SIZE_MB}MB)'}), 413
+
+
+def upload_stream(upload):
+    """Readable stream at the start of an upload given as bytes or as its (seekable) stream"""
+    if isinstance(upload, (bytes, bytearray)):
+        return io.BytesIO(upload)
+    upload.seek(0)
+    return upload
+
+
+def decode_upload(upload):
+    return decode_audio(upload_stream(upload))
+
+
+def take_upload(file):
+    """
+    Stream of an uploaded file, detached from the request so it outlives it (jobs,
+    streamed responses) without a copy of the bytes; the caller closes it.
+    """
+    stream = file.stream
+    file.stream = io.BytesIO()
+    stream.seek(0)
+    return stream
+
+
+def load_recording(recording, model_name, language, **params):
+    """
+    (cached result, None) when the recording was already transcribed with these options,
+    else (None, decoded audio). A file never seen before is decoded to find out.
+    """
+    result = recording.result(model_name, language, **params)
+    if result is not None:
+        return result, None
+    known = recording.fingerprint is not None
+    with metrics.stage('decode', model_name):
+        pcm = recording.pcm(decode_upload)
+    if not known:
+        # The same audio may have come in another file (re-encoded, re-tagged)
+        result = recording.result(model_name, language, **params)
+        if result is not None:
+            return result, None
+    return None, pcm
+
+
+def transcribe_options(language=None, words=False):
+    options = {'fp16': False}  # Force FP32 on CPU
+    if language:
+        options['language'] = language
+    if words:
+        # Aligned on the decoder's cross-attention of the same pass, no second decode
+        options['word_timestamps'] = True
+    return options
+
+
+def subtitle_response(result, fmt, filename='transcription'):
+    """SRT/VTT attachment rendered from a transcription's segments"""
+    body = render(result['segments'], fmt).encode('utf-8')
+    return send_file(io.BytesIO(body), mimetype=f"{SUBTITLE_FORMATS[fmt]}; charset=utf-8", as_attachment=True,
+                     download_name=f"{os.path.splitext(filename)[0]}.{fmt}")
+
+
+def apply_vad(pcm, model_name=''):
+    """Speech-only audio, the Timeline back to the original file and the skipped-audio report"""
+    with metrics.stage('vad', model_name):
+        regions = speech_regions(pcm)
+        packed, timeline = pack_speech(pcm, regions)
+    report = vad_report(len(pcm), regions)
+    print(f"🔇 VAD: {report['regions']} zone(s) de parole, {report['skipped_seconds']:.1f}s de silence ignorées")
+    return packed, timeline, report
+
+
+def transcribe_windows(model, chunks, options, model_name='', windows=None):
+    """
+    Transcribe a PCM chunk stream one 30s window at a time.
+    Yields (segments, language, seconds done) as each window completes, with timestamps on the
+    original timeline. The audio of a window's last (possibly cut) segment is
+    carried over to the next window instead of being committed.
+    windows: optional transcript_cache.WindowCache, windows found there are not transcribed again.
+    """
+    reader = PcmReader(chunks)
+    options = dict(options)
+    carry = np.zeros(0, dtype=np.float32)
+    offset = 0.0
+    segment_id = 0
+    index = 0
+
+    while True:
+        wanted = WINDOW_SAMPLES - len(carry)
+        fresh = reader.read(wanted)
+        window = np.concatenate([carry, fresh]) if len(carry) else fresh
+        if not len(window):
+            break
+        is_last = len(fresh) < wanted
+
+        cached = windows.get(index) if windows else None
+        if cached is not None:
+            committed, cut = cached['segments'], cached['cut']
+            if not options.get('language'):
+                options['language'] = cached['language']
+            segment_id += len(committed)
+        else:
+            # One slot per window: long files make room for short requests between windows
+            with cpu_scheduler.slot(model_name, cost=len(window) / SAMPLE_RATE), metrics.stage('window', model_name):
+                result = model.transcribe(window, **options)
+            if not options.get('language'):
+                # Detect once on the first window, then keep it for the whole file
+                options['language'] = result.get('language')
+
+            segments = result.get('segments', [])
+            cut = len(window) / SAMPLE_RATE
+            if not is_last and len(segments) > 1:
+                tail_start = segments[-1]['start']
+                # Only carry a bounded tail so every window still makes progress
+                if 0 < tail_start and cut - tail_start < WINDOW_SAMPLES / SAMPLE_RATE / 2:
+                    segments = segments[:-1]
+                    cut = tail_start
+
+            committed = clean_segments(segments, offset, cut, segment_id)
+            segment_id += len(committed)
+            if windows:
+                windows.put(index, {'segments': committed, 'language': options.get('language'), 'cut': cut})
+        index += 1
+
+        if committed:
+            # Condition the next window on the end of what was just said
+            options['initial_prompt'] = ' '.join(s['text'] for s in committed)[-200:]
+
+        yield committed, options.get('language'), offset + cut
+
+        if is_last:
+            break
+        carry = window[int(cut * SAMPLE_RATE):]
+        offset += cut
+
+
 @app.route('/health', methods=['GET'])
 def health_check():
-    return jsonify({'status': 'ok', 'service': 'whisper-stt'})
+    return jsonify({
+        'status': 'ok',
+        'service': 'whisper-stt',
+        'ready': warmup.ready,
+        'models': registry.stats(),
+        'jobs': job_manager.stats(),
+        'pool': transcribe_pool.stats(),
+        'cache': transcript_cache.stats(),
+        'scheduler': cpu_scheduler.stats()
+    })
 
 
 @app.route('/models', methods=['GET'])
@@ -127,73 +340,335 @@ def get_models():
 
 @app.route('/transcribe', methods=['POST'])
 def transcribe_audio():
-    tmp_path = None
     try:
         if 'file' not in request.files:
             return jsonify({'error': 'Aucun fichier fourni'}), 400
 
         file = request.files['file']
         model_name = request.form.get('model', 'base')
+        if model_name not in AVAILABLE_MODELS:
+            model_name = 'base'
         language = request.form.get('language', None)
+        use_vad = vad_enabled(request.form.get('vad'))
+        use_words = words_enabled(request.form.get('words'))
+        # json (default), or the transcription directly as a subtitle file
+        fmt = (request.form.get('format') or 'json').lower()
+        if fmt != 'json' and fmt not in SUBTITLE_FORMATS:
+            return jsonify({'error': f"Format inconnu: {fmt} (json, {', '.join(SUBTITLE_FORMATS)})"}), 400
+
+        error, size_mb = check_upload(file)
+        if error:
+            return jsonify({'error': error}), 400
 
-        if file.filename == '':
-            return jsonify({'error': 'Nom de fichier vide'}), 400
+        print(f"Transcription de {file.filename} ({size_mb:.2f}MB) avec modele '{model_name}'...")
+
+        # Same recording, model and options as an earlier request: no decode, no model
+        recording = transcript_cache.open(file.stream)
+        result, audio = load_recording(recording, model_name, language, vad=use_vad, words=use_words)
+
+        if result is not None:
+            print(f"⚡ Transcription en cache pour {file.filename}")
+        else:
+            # Load model and transcribe
+            model = get_model(model_name)
+
+            # Without a language, reuse the one detected on an earlier pass over this recording
+            language = language or recording.language()
+            options = transcribe_options(language, use_words)
+
+            duration = len(audio) / SAMPLE_RATE
+            timeline = vad_info = None
+            if use_vad:
+                audio, timeline, vad_info = apply_vad(audio, model_name)
+
+            if len(audio):
+                with cpu_scheduler.slot(model_name, cost=len(audio) / SAMPLE_RATE), \
+                        metrics.stage('transcribe', model_name):
+                    transcript = model.transcribe(audio, **options)
+            else:
+                transcript = {'text': '', 'language': language or 'unknown'}
+
+            print("Transcription terminee!")
+
+            segments = clean_segments(transcript.get('segments', []))
+            result = {
+                'success': True,
+                'text': transcript['text'],
+                'language': transcript.get('language') or 'unknown',
+                'duration': round(duration, 2),
+                'segments': timeline.remap(segments) if timeline else segments
+            }
+            if vad_info:
+                result['vad'] = vad_info
+            recording.store_result(result, model_name, language, vad=use_vad, words=use_words)
+
+        if fmt != 'json':
+            response = subtitle_response(result, fmt, file.filename)
+        else:
+            response = jsonify(dict(result, transcript_id=recording.transcript_id, cache=recording.status))
+        response.headers['X-Cache'] = recording.status['transcript']
+        return response
+
+    except HTTPException:
+        # 413 from the request body size: answered by request_too_large()
+        raise
+    except Exception as e:
+        # Avoid UnicodeEncodeError on Windows print
+        error_msg = str(e)
+        print(f"Erreur STT: {error_msg[:200]}...")
+        return jsonify({'error': f'Erreur de transcription: {error_msg}'}), 500
 
-        if not allowed_file(file.filename):
-            return jsonify({'error': 'Extension non autorisee'}), 400
 
-        file.seek(0, os.SEEK_END)
-        size_mb = file.tell() / (1024 * 1024)
-        file.seek(0)
+@app.route('/transcribe/batch', methods=['POST'])
+def transcribe_batch():
+    """Transcribe several files in parallel across the pool's model replicas"""
+    files = request.files.getlist('files')
+    if not files:
+        return jsonify({'error': 'Aucun fichier fourni'}), 400
 
-        if size_mb > MAX_SIZE_MB:
-            return jsonify({'error': f'Fichier trop volumineux ({size_mb:.1f}MB)'}), 400
+    model_name = request.form.get('model', 'base')
+    if model_name not in AVAILABLE_MODELS:
+        model_name = 'base'
+    language = request.form.get('language', None)
+    use_vad = vad_enabled(request.form.get('vad'))
+    use_words = words_enabled(request.form.get('words'))
+
+    if len(files) > MAX_BATCH_FILES:
+        return jsonify({'error': f'Trop de fichiers (max {MAX_BATCH_FILES})'}), 400
+
+    for file in files:
+        error, _ = check_upload(file)
+        if error:
+            return jsonify({'error': f'{file.filename}: {error}'}), 400
+
+    print(f"Transcription par lot de {len(files)} fichiers avec modele '{model_name}' "
+          f"({transcribe_pool.workers} répliques x {transcribe_pool.threads} threads)...")
+    payloads = [file.read() for file in files]
+    with metrics.stage('batch', model_name):
+        results, stats = transcribe_pool.map(payloads, model_name, language, use_vad, use_words)
+
+    for file, data, result in zip(files, payloads, results):
+        fingerprint = result.pop('fingerprint', None)
+        if result['success']:
+            result['transcript_id'] = None
+            if fingerprint and transcript_cache.enabled:
+                # Cached like a /transcribe result: the id renders subtitles, /transcribe finds it
+                recording = transcript_cache.open(data)
+                recording.link(fingerprint)
+                stored = {k: v for k, v in result.items() if k not in ('seconds', 'transcript_id')}
+                recording.store_result(stored, model_name, language, vad=use_vad, words=use_words)
+                result['transcript_id'] = recording.transcript_id
+        result['filename'] = file.filename
+    print(f"Lot termine: {stats['audio_seconds']:.0f}s d'audio en {stats['wall_seconds']:.1f}s "
+          f"({stats['audio_hours_per_hour']}h d'audio par heure)")
 
-        # Save to temp file
-        ext = file.filename.rsplit('.', 1)[1].lower()
-        with tempfile.NamedTemporaryFile(suffix=f'.{ext}', delete=False) as tmp:
-            file.save(tmp.name)
-            tmp_path = tmp.name
+    return jsonify({
+        'success': all(r['success'] for r in results),
+        'results': results,
+        'stats': stats
+    })
 
-        print(f"Transcription de {file.filename} ({size_mb:.2f}MB) avec modele '{model_name}'...")
 
-        # Load model and transcribe
+@app.route('/jobs', methods=['POST'])
+def create_transcribe_job():
+    """Same form as /transcribe, returns a job id right away (202)"""
+    if 'file' not in request.files:
+        return jsonify({'error': 'Aucun fichier fourni'}), 400
+
+    file = request.files['file']
+    model_name = request.form.get('model', 'base')
+    if model_name not in AVAILABLE_MODELS:
+        model_name = 'base'
+    language = request.form.get('language', None)
+    use_vad = vad_enabled(request.form.get('vad'))
+    use_words = words_enabled(request.form.get('words'))
+
+    error, size_mb = check_upload(file)
+    if error:
+        return jsonify({'error': error}), 400
+
+    # The upload is closed with the request: the job takes its stream over
+    upload = take_upload(file)
+    filename = file.filename
+
+    def work(job):
+        with upload:
+            return run(job)
+
+    def run(job):
+        print(f"Job {job.id}: transcription de {filename} ({size_mb:.2f}MB) avec modele '{model_name}'...")
+        recording = transcript_cache.open(upload)
+        cached, pcm = load_recording(recording, model_name, language, mode='windows', vad=use_vad, words=use_words)
+        if cached is not None:
+            print(f"⚡ Job {job.id}: transcription en cache")
+            return dict(cached, transcript_id=recording.transcript_id, cache=recording.status)
+
+        original_duration = len(pcm) / SAMPLE_RATE
+        timeline = vad_info = None
+        if use_vad:
+            pcm, timeline, vad_info = apply_vad(pcm, model_name)
+        total = len(pcm) / SAMPLE_RATE
         model = get_model(model_name)
-        
-        # Transcribe options
-        options = {
-            'fp16': False  # Force FP32 on CPU
+        job_language = language or recording.language()
+        options = transcribe_options(job_language, use_words)
+        # Windows done by an earlier, interrupted run are not transcribed again
+        windows = recording.windows(model_name, job_language, vad=use_vad, words=use_words)
+
+        segments = []
+        detected = None
+        duration = 0.0
+        for window_segments, detected, duration in transcribe_windows(model, iter_windows(pcm), options, model_name,
+                                                                      windows):
+            segments.extend(timeline.remap(window_segments) if timeline else window_segments)
+            job.update(duration / total if total else 0, segments=len(segments),
+                       seconds_done=round(duration, 1), seconds_total=round(total, 1))
+
+        print(f"Job {job.id}: transcription terminee!")
+        result = {
+            'success': True,
+            'text': ' '.join(seg['text'] for seg in segments),
+            'language': detected or 'unknown',
+            'duration': round(original_duration, 2),
+            'segments': segments
         }
-        if language:
-            options['language'] = language
+        if vad_info:
+            result['vad'] = vad_info
+        recording.store_result(result, model_name, job_language, mode='windows', vad=use_vad, words=use_words)
+        return dict(result, transcript_id=recording.transcript_id, cache=dict(recording.status, windows=windows.hits))
 
-        result = model.transcribe(tmp_path, **options)
+    try:
+        job = job_manager.submit('transcribe', work)
+    except QueueFull as e:
+        upload.close()
+        return queue_full_response(e)
 
-        # Clean up temp file
-        if tmp_path and os.path.exists(tmp_path):
-            os.unlink(tmp_path)
+    return jsonify(job.to_dict()), 202
 
-        print("Transcription terminee!")
 
-        return jsonify({
-            'success': True,
-            'text': result['text'],
-            'language': result.get('language', 'unknown')
-        })
+@app.route('/transcribe/stream', methods=['POST'])
+def transcribe_stream():
+    """Emit segments while the file is transcribed, as NDJSON (default) or SSE"""
+    if 'file' not in request.files:
+        return jsonify({'error': 'Aucun fichier fourni'}), 400
 
-    except Exception as e:
-        # Avoid UnicodeEncodeError on Windows print
-        error_msg = str(e)
-        print(f"Erreur STT: {error_msg[:200]}...")
-        
-        # Clean up temp file on error
-        if tmp_path and os.path.exists(tmp_path):
-            try:
-                os.unlink(tmp_path)
-            except:
-                pass
-                
-        return jsonify({'error': f'Erreur de transcription: {error_msg}'}), 500
+    file = request.files['file']
+    model_name = request.form.get('model', 'base')
+    if model_name not in AVAILABLE_MODELS:
+        model_name = 'base'
+    language = request.form.get('language', None)
+    use_vad = vad_enabled(request.form.get('vad'))
+    use_words = words_enabled(request.form.get('words'))
+    use_sse = request.form.get('format') == 'sse' or 'text/event-stream' in request.headers.get('Accept', '')
+
+    error, size_mb = check_upload(file)
+    if error:
+        return jsonify({'error': error}), 400
+
+    print(f"Transcription en flux de {file.filename} ({size_mb:.2f}MB) avec modele '{model_name}'...")
+    # The upload is closed before the response body is generated: the generator takes its stream over
+    upload = take_upload(file)
+
+    def encode(event):
+        line = json.dumps(event, ensure_ascii=False)
+        return f"event: {event['type']}\ndata: {line}\n\n" if use_sse else line + "\n"
+
+    def replay(recording, result, status):
+        """Events of a transcription found in the cache"""
+        yield encode({'type': 'language', 'language': result['language']})
+        for seg in result['segments']:
+            yield encode({'type': 'segment', **seg})
+        done = {'type': 'done', 'language': result['language'], 'segments': len(result['segments']),
+                'duration': result['duration'], 'transcript_id': recording.transcript_id, 'cache': status}
+        if result.get('vad'):
+            done['vad'] = result['vad']
+        yield encode(done)
+
+    def generate():
+        try:
+            recording = transcript_cache.open(upload)
+            pcm = cached = None
+            if use_vad:
+                # The VAD noise floor is estimated on the whole file, so decode it first
+                cached, pcm = load_recording(recording, model_name, language, mode='windows', vad=True,
+                                             words=use_words)
+            elif recording.fingerprint is not None:
+                cached = recording.result(model_name, language, mode='windows', vad=False, words=use_words)
+            if cached is not None:
+                print("⚡ Transcription en flux servie depuis le cache")
+                yield from replay(recording, cached, recording.status)
+                return
+
+            model = get_model(model_name)
+            stream_language = language or recording.language()
+            options = transcribe_options(stream_language, use_words)
+            windows = recording.windows(model_name, stream_language, vad=use_vad, words=use_words)
+
+            timeline = vad_info = None
+            if pcm is not None:
+                original_duration = len(pcm) / SAMPLE_RATE
+                if use_vad:
+                    pcm, timeline, vad_info = apply_vad(pcm, model_name)
+                chunks = iter_windows(pcm)
+            else:
+                # Window by window: read back from the audio cache, or decoded while it is
+                # transcribed (and cached once complete); windows already done come from `windows`
+                chunks = recording.stream(lambda: iter_pcm(upload_stream(upload)))
+
+            detected = None
+            segments = []
+            duration = 0.0
+            for window_segments, lang, duration in transcribe_windows(model, chunks, options, model_name, windows):
+                if detected is None and lang:
+                    detected = lang
+                    yield encode({'type': 'language', 'language': lang})
+                for seg in timeline.remap(window_segments) if timeline else window_segments:
+                    segments.append(seg)
+                    yield encode({'type': 'segment', **seg})
+
+            print("Transcription en flux terminee!")
+            result = {
+                'success': True,
+                'text': ' '.join(seg['text'] for seg in segments),
+                'language': detected or 'unknown',
+                'duration': round(original_duration if pcm is not None else duration, 2),
+                'segments': segments
+            }
+            if vad_info:
+                result['vad'] = vad_info
+            recording.store_result(result, model_name, stream_language, mode='windows', vad=use_vad, words=use_words)
+
+            done = {'type': 'done', 'language': result['language'], 'segments': len(segments),
+                    'duration': result['duration'], 'transcript_id': recording.transcript_id,
+                    'cache': dict(recording.status, windows=windows.hits)}
+            if vad_info:
+                done['vad'] = vad_info
+            yield encode(done)
+
+        except Exception as e:
+            error_msg = str(e)
+            print(f"Erreur STT: {error_msg[:200]}...")
+            yield encode({'type': 'error', 'error': f'Erreur de transcription: {error_msg}'})
+        finally:
+            upload.close()
+
+    return Response(
+        stream_with_context(generate()),
+        mimetype='text/event-stream' if use_sse else 'application/x-ndjson',
+        headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'}
+    )
+
+
+@app.route('/transcripts/<transcript_id>/<fmt>', methods=['GET'])
+def get_transcript(transcript_id, fmt):
+    """A finished transcription (transcript_id from its response) as json, srt or vtt, without the model"""
+    if fmt != 'json' and fmt not in SUBTITLE_FORMATS:
+        return jsonify({'error': f"Format inconnu: {fmt} (json, {', '.join(SUBTITLE_FORMATS)})"}), 400
+    result = transcript_cache.transcript(transcript_id)
+    if result is None:
+        return jsonify({'error': 'Transcription introuvable (inconnue ou sortie du cache)'}), 404
+    if fmt == 'json':
+        return jsonify(dict(result, transcript_id=transcript_id))
+    return subtitle_response(result, fmt, request.args.get('name', 'transcription'))
 
 
 @app.route('/info', methods=['GET'])
@@ -201,27 +676,16 @@ def get_info():
     return jsonify({
         'service': 'Whisper Speech-to-Text',
         'max_size_mb': MAX_SIZE_MB,
+        'max_batch_files': MAX_BATCH_FILES,
         'allowed_extensions': list(ALLOWED_EXTENSIONS),
         'available_models': list(AVAILABLE_MODELS.keys()),
+        'subtitle_formats': list(SUBTITLE_FORMATS),
         'status': 'ready'
     })
 
 
-import torch
-# Optimize CPU threads - allow override via env
-num_cores = os.cpu_count() or 4
-env_threads = os.environ.get('AI_THREADS')
-if env_threads:
-    try:
-        torch.set_num_threads(int(env_threads))
-        print(f"🧵 Thread count set from AI_THREADS: {env_threads}")
-    except ValueError:
-        torch.set_num_threads(num_cores)
-else:
-    torch.set_num_threads(num_cores)
-
 if __name__ == '__main__':
     print("Whisper STT Server starting on http://localhost:5200")
-    # Pre-load default model
-    get_model('base')
+    # Default model loaded in the background, /ready tells when it is done
+    warmup.start()
     app.run(host='0.0.0.0', port=5200, debug=False)
@@ -17,17 +17,19 @@ const storage = multer.diskStorage({
 
 const fileFilter = (req, file, cb) => {
     const allowedTypes = ['image/png', 'image/jpeg', 'image/jpg', 'image/webp', 'image/gif', 'image/bmp'];
-    if (allowedTypes.includes(file.mimetype)) {
+    // Videos: frame-by-frame removal, returned as an animated PNG / WebP
+    const videoTypes = ['video/mp4', 'video/webm', 'video/quicktime', 'video/x-matroska', 'video/x-msvideo', 'video/x-m4v'];
+    if (allowedTypes.includes(file.mimetype) || videoTypes.includes(file.mimetype)) {
         cb(null, true);
     } else {
-        cb(new Error('Type de fichier non supporté. Utilisez PNG, JPG, WEBP, GIF ou BMP.'), false);
+        cb(new Error('Type de fichier non supporté. Utilisez PNG, JPG, WEBP, GIF, BMP ou une vidéo (MP4, WEBM, MOV).'), false);
     }
 };
 
 const upload = multer({
     storage,
     fileFilter,
-    limits: { fileSize: 30 * 1024 * 1024 } // 30MB max
+    limits: { fileSize: 50 * 1024 * 1024 } // 50MB max (videos)
 });
 
 // Routes
@@ -45,5 +45,6 @@ router.get('/health', sttController.checkHealth);
 router.get('/models', sttController.getModels);
 router.get('/info', sttController.getInfo);
 router.post('/transcribe', upload.single('file'), sttController.transcribe);
+router.get('/transcripts/:id/:format', sttController.getTranscript);
 
 module.exports = router;